@@ -0,0 +1,199 @@
+"""
+Módulo para limitar las llamadas simultáneas a los servicios de IA (LM Studio
+y Whisper): cada servicio tiene un número máximo de peticiones en curso y una
+cola de espera acotada. Cuando la cola está llena, o la espera supera el
+límite, la petición se rechaza al momento (503 con Retry-After) en lugar de
+quedarse esperando hasta el timeout y bloquear un hilo del servidor.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Peso de la última petición en la media móvil del tiempo de servicio
+SERVICE_TIME_ALPHA = 0.2
+
+class BackendSaturatedError(Exception):
+    """El servicio está saturado y la petición no se ha admitido"""
+
+    def __init__(self, backend, reason, queue_length, estimated_wait):
+        self.backend = backend
+        self.reason = reason  # 'queue_full' o 'queue_timeout'
+        self.queue_length = queue_length
+        self.estimated_wait = estimated_wait
+        self.retry_after = max(1, math.ceil(estimated_wait))
+        super().__init__(f'{backend} está ocupado ({queue_length} peticiones en cola). '
+                         f'Vuelve a intentarlo en {self.retry_after} s')
+
+    def to_dict(self):
+        return {
+            'success': False,
+            'error': str(self),
+            'backend': self.backend,
+            'reason': self.reason,
+            'queue_length': self.queue_length,
+            'estimated_wait': round(self.estimated_wait, 1),
+            'retry_after': self.retry_after
+        }
+
+class AdmissionTicket:
+    """Plaza concedida a una petición (se devuelve con release)"""
+
+    def __init__(self, queue_position, queue_wait):
+        self.queue_position = queue_position  # 0 = entró sin esperar
+        self.queue_wait = queue_wait
+        self.started = time.monotonic()
+        self.released = False
+
+    def to_dict(self):
+        return {
+            'queue_position': self.queue_position,
+            'queue_wait': round(self.queue_wait, 3)
+        }
+
+class AdmissionController:
+    """
+    Semáforo con cola de espera acotada (FIFO) para un servicio
+
+    Como mucho `max_concurrent` peticiones están en curso y `max_queue`
+    esperan turno. La espera estimada se calcula con la media móvil del
+    tiempo que tarda cada petición en el servicio.
+    """
+
+    def __init__(self, name, max_concurrent=1, max_queue=4, queue_timeout=30, initial_estimate=10):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.avg_service_time = float(initial_estimate)
+        self.active = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.peak_queue = 0
+        self.total_queue_wait = 0.0
+        self._waiters = deque()
+        self._condition = threading.Condition()
+
+    def estimated_wait(self, position):
+        """Segundos estimados hasta que entre la petición en el puesto `position` de la cola"""
+        return math.ceil(position / self.max_concurrent) * self.avg_service_time
+
+    def acquire(self):
+        """
+        Espera una plaza en el servicio
+
+        Returns:
+            AdmissionTicket: Plaza concedida, con el puesto en la cola y los segundos de espera
+
+        Raises:
+            BackendSaturatedError: Si la cola está llena o se supera queue_timeout
+        """
+        with self._condition:
+            if self.active < self.max_concurrent and not self._waiters:
+                self.active += 1
+                self.admitted += 1
+                return AdmissionTicket(0, 0.0)
+
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                position = len(self._waiters) + 1
+                print(f"🚫 {self.name}: cola llena ({len(self._waiters)}), petición rechazada")
+                raise BackendSaturatedError(self.name, 'queue_full', len(self._waiters),
+                                            self.estimated_wait(position))
+
+            waiter = object()
+            self._waiters.append(waiter)
+            position = len(self._waiters)
+            self.queued += 1
+            self.peak_queue = max(self.peak_queue, position)
+            print(f"⏳ {self.name}: petición en cola (puesto {position}, "
+                  f"espera estimada {self.estimated_wait(position):.0f}s)")
+
+            start = time.monotonic()
+            deadline = start + self.queue_timeout
+            while self._waiters[0] is not waiter or self.active >= self.max_concurrent:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(waiter)
+                    self.timed_out += 1
+                    # El siguiente de la cola puede haber pasado a ser el primero
+                    self._condition.notify_all()
+                    print(f"⌛ {self.name}: {self.queue_timeout}s en cola sin plaza, petición rechazada")
+                    raise BackendSaturatedError(self.name, 'queue_timeout', len(self._waiters),
+                                                self.estimated_wait(len(self._waiters) + 1))
+                self._condition.wait(remaining)
+
+            self._waiters.popleft()
+            self.active += 1
+            self.admitted += 1
+            queue_wait = time.monotonic() - start
+            self.total_queue_wait += queue_wait
+            # Con varias plazas libres, el nuevo primero de la cola también puede entrar
+            self._condition.notify_all()
+            return AdmissionTicket(position, queue_wait)
+
+    def release(self, ticket):
+        """Devuelve la plaza de una petición terminada (se puede llamar más de una vez)"""
+        with self._condition:
+            if ticket.released:
+                return
+            ticket.released = True
+            self.active -= 1
+            service_time = time.monotonic() - ticket.started
+            self.avg_service_time += SERVICE_TIME_ALPHA * (service_time - self.avg_service_time)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Plaza en el servicio durante el bloque with (devuelve el AdmissionTicket)"""
+        ticket = self.acquire()
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def get_stats(self):
+        """
+        Estado y saturación del servicio
+
+        Returns:
+            dict: Límites, peticiones en curso y en cola, admitidas, rechazadas y tiempos medios
+        """
+        with self._condition:
+            requests = self.admitted + self.rejected + self.timed_out
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'queued': len(self._waiters),
+                'peak_queue': self.peak_queue,
+                'admitted': self.admitted,
+                'queued_total': self.queued,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'rejection_rate': round((self.rejected + self.timed_out) / requests, 3) if requests else 0.0,
+                'avg_queue_wait': round(self.total_queue_wait / self.queued, 3) if self.queued else 0.0,
+                'avg_service_time': round(self.avg_service_time, 3),
+                'estimated_wait': round(self.estimated_wait(len(self._waiters) + 1), 1)
+                if self.active >= self.max_concurrent else 0.0
+            }
+
+def create_admission_controller(name, config):
+    """
+    Crea el control de admisión de un servicio según la configuración
+
+    Args:
+        name (str): Nombre del servicio para los logs y los mensajes de error
+        config (dict): Entrada de ADMISSION_CONFIG
+    """
+    return AdmissionController(
+        name,
+        max_concurrent=config['max_concurrent'],
+        max_queue=config['max_queue'],
+        queue_timeout=config['queue_timeout'],
+        initial_estimate=config['initial_estimate']
+    )
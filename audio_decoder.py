@@ -0,0 +1,118 @@
+"""
+Módulo para decodificar notas de voz (webm, ogg, mp4, wav...) en memoria a un
+array float32 mono a 16 kHz, el formato que espera Whisper, sin archivos temporales.
+"""
+
+import io
+import os
+import shutil
+import subprocess
+
+import numpy as np
+
+# PyAV es opcional: decodifica desde memoria sin lanzar procesos
+try:
+    import av
+    PYAV_AVAILABLE = True
+except ImportError:
+    av = None
+    PYAV_AVAILABLE = False
+
+SAMPLE_RATE = 16000
+
+# Copia de FFmpeg que instala install_ffmpeg_windows.bat
+BUNDLED_FFMPEG_DIR = os.path.join('ffmpeg', 'ffmpeg-master-latest-win64-gpl', 'bin')
+
+class AudioDecodeError(Exception):
+    """El audio no se pudo decodificar"""
+    pass
+
+def find_ffmpeg(configured_path=None):
+    """
+    Busca el ejecutable de FFmpeg una sola vez, sin modificar el PATH del proceso
+
+    Returns:
+        str: Ruta de FFmpeg o None si no está instalado
+    """
+    if configured_path:
+        return configured_path
+    return shutil.which('ffmpeg') or shutil.which('ffmpeg', path=os.path.abspath(BUNDLED_FFMPEG_DIR))
+
+class AudioDecoder:
+    """
+    Decodificador de audio en memoria
+
+    Usa PyAV si está instalado; si no, FFmpeg leyendo de stdin y escribiendo
+    PCM por stdout (los mismos parámetros que whisper.load_audio).
+    """
+
+    def __init__(self, backend='auto', ffmpeg_path=None, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.ffmpeg_path = find_ffmpeg(ffmpeg_path)
+        if backend == 'auto':
+            backend = 'pyav' if PYAV_AVAILABLE else 'ffmpeg'
+        if backend not in ('pyav', 'ffmpeg'):
+            raise ValueError(f'Decodificador de audio no soportado: {backend}')
+        self.backend = backend
+
+    @property
+    def available(self):
+        return PYAV_AVAILABLE if self.backend == 'pyav' else self.ffmpeg_path is not None
+
+    def decode(self, data):
+        """
+        Decodifica un audio comprimido
+
+        Args:
+            data (bytes): Contenido del archivo de audio
+
+        Returns:
+            numpy.ndarray: Muestras float32 mono en [-1, 1] a sample_rate Hz
+
+        Raises:
+            AudioDecodeError: Si el audio no es válido o no hay decodificador
+        """
+        if not data:
+            raise AudioDecodeError('Audio vacío')
+        if self.backend == 'pyav':
+            return self._decode_with_pyav(data)
+        return self._decode_with_ffmpeg(data)
+
+    def duration(self, samples):
+        """Duración en segundos de un array decodificado"""
+        return len(samples) / self.sample_rate
+
+    def _decode_with_pyav(self, data):
+        if not PYAV_AVAILABLE:
+            raise AudioDecodeError('PyAV no está instalado')
+        try:
+            chunks = []
+            with av.open(io.BytesIO(data)) as container:
+                resampler = av.AudioResampler(format='s16', layout='mono', rate=self.sample_rate)
+                for frame in container.decode(audio=0):
+                    chunks.extend(resampled.to_ndarray().ravel() for resampled in resampler.resample(frame))
+                # Vaciar las muestras que queden en el remuestreador
+                chunks.extend(resampled.to_ndarray().ravel() for resampled in resampler.resample(None))
+        except av.error.FFmpegError as e:
+            raise AudioDecodeError(f'No se pudo decodificar el audio: {str(e)}')
+
+        if not chunks:
+            raise AudioDecodeError('El audio no contiene muestras')
+        return np.concatenate(chunks).astype(np.float32) / 32768.0
+
+    def _decode_with_ffmpeg(self, data):
+        if not self.ffmpeg_path:
+            raise AudioDecodeError('FFmpeg no está instalado. Ejecuta install_ffmpeg_windows.bat o instala ffmpeg.')
+
+        command = [
+            self.ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+            '-i', 'pipe:0',
+            '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(self.sample_rate),
+            'pipe:1'
+        ]
+        process = subprocess.run(command, input=data, capture_output=True)
+        if process.returncode != 0:
+            raise AudioDecodeError(f'No se pudo decodificar el audio: {process.stderr.decode(errors="ignore").strip()}')
+        if not process.stdout:
+            raise AudioDecodeError('El audio no contiene muestras')
+        return np.frombuffer(process.stdout, np.int16).astype(np.float32) / 32768.0
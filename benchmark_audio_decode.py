@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para medir la decodificación de notas de voz antes de Whisper:
+compara el proceso anterior (archivo temporal .wav que FFmpeg vuelve a leer de
+disco, como whisper.load_audio) con AudioDecoder (en memoria, sin archivos).
+
+Resultado en milisegundos por segundo de audio.
+
+Uso: python benchmark_audio_decode.py [carpeta_de_notas_de_voz]
+Sin carpeta se generan notas WAV sintéticas de 5, 15 y 30 segundos.
+"""
+
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from config import TRANSCRIPTION_CONFIG
+from audio_decoder import AudioDecoder, SAMPLE_RATE
+
+AUDIO_EXTENSIONS = ('.webm', '.ogg', '.mp4', '.m4a', '.wav', '.mp3')
+REPETITIONS = 5
+
+def synthetic_voice_note(seconds, rate=48000):
+    """Nota WAV sintética (tono con ruido) como la que graba un móvil"""
+    t = np.arange(int(seconds * rate)) / rate
+    signal = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * np.random.default_rng(0).normal(size=t.size)
+    pcm = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(pcm.tobytes())
+    return output.getvalue()
+
+def legacy_decode(data, ffmpeg_path):
+    """Proceso anterior: archivo temporal + FFmpeg leyendo el archivo (whisper.load_audio)"""
+    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
+        temp_file.write(data)
+        temp_path = temp_file.name
+    try:
+        command = [ffmpeg_path, '-nostdin', '-threads', '0', '-i', temp_path,
+                   '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(SAMPLE_RATE), '-']
+        output = subprocess.run(command, capture_output=True, check=True).stdout
+        return np.frombuffer(output, np.int16).astype(np.float32) / 32768.0
+    finally:
+        os.unlink(temp_path)
+
+def measure(function, data):
+    """Tiempo medio en segundos de REPETITIONS ejecuciones"""
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        samples = function(data)
+    return (time.perf_counter() - start) / REPETITIONS, samples
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else None
+    decoder = AudioDecoder(TRANSCRIPTION_CONFIG['decoder'], ffmpeg_path=TRANSCRIPTION_CONFIG['ffmpeg_path'])
+    if not decoder.available:
+        print("❌ No hay decodificador disponible: instala PyAV (pip install av) o FFmpeg")
+        sys.exit(1)
+
+    if folder:
+        notes = []
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    notes.append((name, f.read()))
+    else:
+        print("⚠️  Sin carpeta de notas de voz: usando WAV sintéticos")
+        notes = [(f'sintetica_{seconds}s.wav', synthetic_voice_note(seconds)) for seconds in (5, 15, 30)]
+
+    print("🧪 Decodificación de notas de voz para Whisper")
+    print("=" * 50)
+    print(f"📊 Decodificador: {decoder.backend} | FFmpeg: {decoder.ffmpeg_path or 'no disponible'}")
+
+    for name, data in notes:
+        memory_time, samples = measure(decoder.decode, data)
+        seconds = decoder.duration(samples)
+        print(f"\n📁 {name} ({len(data) / 1024:.0f} KB, {seconds:.1f}s de audio)")
+        if decoder.ffmpeg_path:
+            legacy_time, _ = measure(lambda audio: legacy_decode(audio, decoder.ffmpeg_path), data)
+            print(f"   Anterior (archivo temporal): {legacy_time / seconds * 1000:7.2f} ms por segundo de audio")
+        print(f"   En memoria ({decoder.backend}):{' ' * (14 - len(decoder.backend))}"
+              f"{memory_time / seconds * 1000:7.2f} ms por segundo de audio")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para medir la normalización de fotos (IMAGE_NORMALIZE_CONFIG)
+sobre un corpus de fotos de campo: tamaño y dimensiones antes/después,
+calidad elegida y tiempo por foto, comparado con la compresión anterior
+(solo por encima de 10 MB, calidad 85 fija y sin redimensionar).
+
+Uso: python benchmark_image_normalize.py [carpeta_de_fotos]
+Sin carpeta se usan test_frame.jpg y fotos sintéticas de 12 MP.
+"""
+
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from config import IMAGE_NORMALIZE_CONFIG
+from image_normalizer import create_image_normalizer
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def legacy_compress(image_bytes, quality=85, max_size_mb=10):
+    """Compresión anterior de web_app.compress_image"""
+    if len(image_bytes) / (1024 * 1024) <= max_size_mb:
+        return image_bytes
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+def synthetic_photo(width, height, quality, seed):
+    """Foto sintética con degradados y ruido (parecida en peso a una foto real)"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack(np.broadcast_arrays(x + y * 0, y + x * 0, (x + y) / 2), axis=-1)
+    noise = rng.normal(0, 25, (height, width, 3))
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+def load_corpus(folder):
+    """Devuelve una lista de (nombre, bytes) con las fotos a medir"""
+    if folder:
+        corpus = []
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(PHOTO_EXTENSIONS):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    corpus.append((name, f.read()))
+        return corpus
+
+    print("⚠️  Sin carpeta de fotos: usando test_frame.jpg y fotos sintéticas de 12 MP")
+    corpus = []
+    if os.path.exists('test_frame.jpg'):
+        with open('test_frame.jpg', 'rb') as f:
+            corpus.append(('test_frame.jpg', f.read()))
+    corpus.append(('sintetica_12mp_q92.jpg', synthetic_photo(4000, 3000, 92, 1)))
+    corpus.append(('sintetica_12mp_q98.jpg', synthetic_photo(4000, 3000, 98, 2)))
+    return corpus
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else None
+    normalizer = create_image_normalizer(IMAGE_NORMALIZE_CONFIG)
+    corpus = load_corpus(folder)
+    if not corpus:
+        print(f"❌ No se encontraron fotos en {folder}")
+        sys.exit(1)
+
+    print("🧪 Normalización de fotos")
+    print("=" * 50)
+    print(f"📊 Objetivo: {normalizer.target_bytes / 1024:.0f} KB, máx. {normalizer.max_dimension} px, "
+          f"{normalizer.output_format} (progresivo: {normalizer.progressive})")
+
+    totals = {'original': 0, 'legacy': 0, 'normalized': 0, 'time': 0.0}
+    for name, data in corpus:
+        with Image.open(io.BytesIO(data)) as image:
+            dimensions = f"{image.width}x{image.height}"
+
+        start = time.perf_counter()
+        legacy = legacy_compress(data)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        normalized = normalizer.normalize(data)
+        elapsed = time.perf_counter() - start
+        output = normalized.data if normalized else data
+
+        totals['original'] += len(data)
+        totals['legacy'] += len(legacy)
+        totals['normalized'] += len(output)
+        totals['time'] += elapsed
+
+        print(f"\n📁 {name} ({dimensions}, {len(data) / 1024:.0f} KB)")
+        print(f"   Anterior:    {len(legacy) / 1024:8.0f} KB ({legacy_time * 1000:.0f} ms)")
+        if normalized:
+            print(f"   Normalizada: {normalized.size / 1024:8.0f} KB, {normalized.width}x{normalized.height}, "
+                  f"calidad {normalized.quality} ({elapsed * 1000:.0f} ms)")
+        else:
+            print(f"   Normalizada: sin cambios, ya cumple los límites ({elapsed * 1000:.0f} ms)")
+
+    print("\n" + "=" * 50)
+    print(f"📉 Total original:    {totals['original'] / (1024 * 1024):.2f} MB")
+    print(f"📉 Total anterior:    {totals['legacy'] / (1024 * 1024):.2f} MB")
+    print(f"📉 Total normalizado: {totals['normalized'] / (1024 * 1024):.2f} MB "
+          f"({(1 - totals['normalized'] / totals['original']) * 100:.1f}% menos)")
+    print(f"⏱️  Tiempo medio de normalización: {totals['time'] / len(corpus) * 1000:.0f} ms por foto")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para el parser de respuestas de LM Studio (lm_response_parser):
+comprueba el resultado esperado de cada respuesta del corpus
+fixtures/lm_studio_responses.json y mide el tiempo por respuesta frente a la
+búsqueda de JSON anterior (varias expresiones regulares con [\\s\\S]*?).
+
+Uso: python benchmark_lm_parser.py [corpus.json]
+"""
+
+import json
+import re
+import sys
+import time
+
+from lm_response_parser import parse_lm_response
+
+DEFAULT_CORPUS = 'fixtures/lm_studio_responses.json'
+REPETITIONS = 2000
+LONG_REPETITIONS = 20
+
+def legacy_find_json(content):
+    """Búsqueda de JSON anterior de process_image_with_lm_studio"""
+    code_block_match = re.search(r'```(?:json)?\s*(\{[\s\S]*?)\s*```', content, re.DOTALL)
+    if code_block_match:
+        content = code_block_match.group(1)
+    json_match = re.search(r'\{[\s\S]*?"stop_number"[\s\S]*?"description"[\s\S]*?\}', content, re.DOTALL)
+    if not json_match:
+        json_match = re.search(r'\{[\s\S]*?"stop_number"[\s\S]*?\}', content, re.DOTALL)
+    if not json_match:
+        json_match = re.search(r'\{[\s\S]*?"stop_number"', content, re.DOTALL)
+        if json_match:
+            json_candidate = content[json_match.start():]
+            json_match = re.search(r'\{[\s\S]*?"stop_number"[\s\S]*?"description"[\s\S]*', json_candidate, re.DOTALL)
+    if not json_match:
+        return None
+    try:
+        return json.loads(json_match.group(0))
+    except json.JSONDecodeError:
+        stop_match = re.search(r'"stop_number"\s*:\s*"([^"]+)"', json_match.group(0), re.IGNORECASE)
+        return {'stop_number': stop_match.group(1)} if stop_match else None
+
+def long_truncated_response():
+    """Respuesta larga con razonamiento y el JSON cortado (peor caso del backtracking)"""
+    reasoning = 'Analizo la imagen {paso} con detalle y reviso el poste. ' * 100
+    return reasoning + '{"stop_number": "P1171", "description": "Cristal roto en la marquesina y pintadas'
+
+def measure(function, contents, repetitions=REPETITIONS):
+    """Tiempo medio en microsegundos por respuesta"""
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        for content in contents:
+            function(content)
+    return (time.perf_counter() - start) / (repetitions * len(contents)) * 1e6
+
+def main():
+    corpus_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CORPUS
+    with open(corpus_path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+
+    print("🧪 Parser de respuestas de LM Studio")
+    print("=" * 50)
+
+    failures = 0
+    for case in corpus:
+        result = parse_lm_response(case['content'])
+        values = {
+            'stop_number': result.stop_number,
+            'description': result.description,
+            'source': result.source,
+            'refusal': result.refusal
+        }
+        mismatches = {key: values[key] for key, expected in case['expected'].items() if values[key] != expected}
+        if mismatches:
+            failures += 1
+            print(f"❌ {case['name']}: {mismatches} (esperado {case['expected']})")
+        else:
+            print(f"✅ {case['name']}: {result.stop_number} ({result.source})")
+
+    contents = [case['content'] for case in corpus]
+    print(f"\n📊 Corpus: {len(corpus)} respuestas, {REPETITIONS} repeticiones")
+    print(f"   Anterior (solo búsqueda de JSON): {measure(legacy_find_json, contents):8.1f} µs por respuesta")
+    print(f"   Parser completo:                  {measure(parse_lm_response, contents):8.1f} µs por respuesta")
+
+    long_response = [long_truncated_response()]
+    print(f"\n📊 Respuesta larga truncada ({len(long_response[0]) / 1024:.0f} KB)")
+    print(f"   Anterior (solo búsqueda de JSON): {measure(legacy_find_json, long_response, LONG_REPETITIONS):8.1f} µs")
+    print(f"   Parser completo:                  {measure(parse_lm_response, long_response, LONG_REPETITIONS):8.1f} µs")
+
+    if failures:
+        print(f"\n❌ {failures} respuestas con resultado distinto al esperado")
+        sys.exit(1)
+    print("\n✅ Todas las respuestas dan el resultado esperado")
+
+if __name__ == "__main__":
+    main()
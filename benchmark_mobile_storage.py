@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para el almacenamiento móvil: compara un archivo JSON por
+dispositivo (mobile_storage_<id>.json con indent=2) con la base de datos SQLite
+compartida (MobileStorageDatabase).
+
+Para cada dispositivo se guarda una sesión, varias renovaciones del token y la
+lista de usuarios; después se mide la carga y la búsqueda de los
+dispositivos de un usuario. Todo se hace en una carpeta temporal.
+
+Uso: python benchmark_mobile_storage.py [dispositivos]
+"""
+
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from mobile_storage import MobileStorage, MobileStorageDatabase
+
+DEFAULT_DEVICES = 500
+TOKEN_REFRESHES = 5
+USERS = 50
+
+def build_users_list():
+    """Lista de usuarios de GTask de ejemplo"""
+    return [{'_id': f'user-{index:04d}', 'username': f'usuario{index}', 'email': f'usuario{index}@malla.es'}
+            for index in range(USERS)]
+
+def exercise(storages):
+    """Sesión, renovaciones del token y lista de usuarios de cada dispositivo; devuelve las escrituras"""
+    users_list = build_users_list()
+    writes = 0
+    for index, storage in enumerate(storages):
+        user = users_list[index % USERS]
+        for refresh in range(TOKEN_REFRESHES):
+            storage.save_user_session(user, f'token-{index}-{refresh}' * 20, datetime.now() + timedelta(hours=24))
+            writes += 1
+        storage.save_users_list(users_list)
+        writes += 1
+    return writes
+
+def find_devices_in_files(folder, user_id):
+    """Búsqueda de los dispositivos de un usuario con un archivo por dispositivo (hay que leerlos todos)"""
+    devices = []
+    for path in glob.glob(os.path.join(folder, 'mobile_storage_*.json')):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if ((data.get('user_session') or {}).get('user') or {}).get('_id') == user_id:
+            devices.append(path)
+    return devices
+
+def folder_size(folder):
+    """Archivos y bytes de una carpeta"""
+    paths = [os.path.join(folder, name) for name in os.listdir(folder)]
+    return len(paths), sum(os.path.getsize(path) for path in paths)
+
+def run_json(folder, devices):
+    with contextlib.redirect_stdout(io.StringIO()):
+        storages = [MobileStorage(os.path.join(folder, f'mobile_storage_device-{index}.json'))
+                    for index in range(devices)]
+        start = time.perf_counter()
+        writes = exercise(storages)
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for index in range(devices):
+            MobileStorage(os.path.join(folder, f'mobile_storage_device-{index}.json'))
+        load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = find_devices_in_files(folder, 'user-0001')
+    lookup_time = time.perf_counter() - start
+    return writes, write_time, load_time, lookup_time, len(found)
+
+def run_sqlite(folder, devices):
+    database = MobileStorageDatabase(os.path.join(folder, 'mobile_storage.db'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        storages = [MobileStorage(None, database=database, device_id=f'device-{index}') for index in range(devices)]
+        start = time.perf_counter()
+        writes = exercise(storages)
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for index in range(devices):
+            MobileStorage(None, database=database, device_id=f'device-{index}')
+        load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = database.find_devices_by_user('user-0001')
+    lookup_time = time.perf_counter() - start
+    database._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return writes, write_time, load_time, lookup_time, len(found)
+
+def report(name, folder, result):
+    writes, write_time, load_time, lookup_time, found = result
+    files, size = folder_size(folder)
+    print(f"\n📊 {name}")
+    print(f"   Escrituras:             {writes} en {write_time:.2f}s ({write_time / writes * 1000:.3f} ms cada una)")
+    print(f"   Carga de dispositivos:  {load_time * 1000:.1f} ms en total")
+    print(f"   Dispositivos de un usuario: {found} en {lookup_time * 1000:.2f} ms")
+    print(f"   En disco:               {files} archivos, {size / 1024:.0f} KB")
+    return write_time
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DEVICES
+
+    print("🧪 Almacenamiento móvil: archivos JSON frente a SQLite")
+    print("=" * 50)
+    print(f"📱 {devices} dispositivos, {TOKEN_REFRESHES} renovaciones de token y una lista de {USERS} usuarios cada uno")
+
+    with tempfile.TemporaryDirectory() as json_folder, tempfile.TemporaryDirectory() as sqlite_folder:
+        json_time = report('Un archivo JSON por dispositivo', json_folder, run_json(json_folder, devices))
+        sqlite_time = report('SQLite compartido', sqlite_folder, run_sqlite(sqlite_folder, devices))
+
+    print(f"\n✅ Escrituras {json_time / sqlite_time:.1f}x más rápidas con SQLite")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para medir la memoria del envío de fotos a Business Central:
+compara el proceso anterior (base64 -> bytes -> base64 varias veces) con
+ImagePayload (bytes decodificados una vez y base64 generado al serializar).
+
+Cada variante se ejecuta en un proceso nuevo para medir su pico de RSS.
+
+Uso: python benchmark_photo_memory.py [tamaño_mb]
+"""
+
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+try:
+    import resource  # Solo disponible en Linux/macOS
+except ImportError:
+    resource = None
+
+def get_peak_rss_mb():
+    """Pico de memoria residente del proceso en MB (0 si no se puede medir)"""
+    if resource is None:
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss está en KB en Linux
+
+def build_fijacion(url):
+    """Estructura de fijación como la que se envía a BC"""
+    return [{
+        "qrtarea": "QR-BENCH",
+        "idnavision": "T-0001",
+        "empresa": "Malla Publicidad",
+        "user": "bench",
+        "document": [{"document": {"url": url, "name": "photo_bench.jpg", "file_id": ""}}]
+    }]
+
+def legacy_pipeline(image_data, filepath):
+    """Proceso anterior: petición + trabajo en cola + cuerpo para BC"""
+    # process_photo_with_task
+    image_base64 = image_data.split(',', 1)[1]  # clean_and_validate_base64 (data URL)
+    image_bytes = base64.b64decode(image_base64)
+    image_base64 = base64.b64encode(image_bytes).decode('utf-8')  # compress_image sin cambios
+    with open(filepath, 'wb') as f:
+        f.write(image_bytes)
+    del image_bytes, image_base64
+
+    # run_photo_job + send_to_business_central_with_session
+    with open(filepath, 'rb') as f:
+        image_base64 = base64.b64encode(f.read()).decode('utf-8')
+    base64.b64decode(image_base64)  # validación
+    datos = {"jsonText": json.dumps(build_fijacion(image_base64))}
+    log_line = f"Datos enviados: {json.dumps(datos, indent=2)}"  # print de depuración
+    body = json.dumps(datos).encode('utf-8')  # requests codifica la cadena
+    del log_line
+    return len(body)
+
+def payload_pipeline(image_data, filepath):
+    """Proceso actual con ImagePayload"""
+    from image_payload import ImagePayload, IMAGE_PLACEHOLDER
+
+    image = ImagePayload.from_base64(image_data)
+    image.save(filepath)
+    del image
+
+    image = ImagePayload.from_file(filepath)
+    datos_json = json.dumps({"jsonText": json.dumps(build_fijacion(IMAGE_PLACEHOLDER))})
+    log_line = f"Datos enviados: {datos_json}"  # print de depuración
+    body = image.embed_in_json(datos_json)
+    del log_line
+    return len(body)
+
+def run_variant(variant, size_mb):
+    """Ejecuta una variante en este proceso e imprime sus medidas en JSON"""
+    pipeline = legacy_pipeline if variant == 'legacy' else payload_pipeline
+    raw = os.urandom(int(size_mb * 1024 * 1024))
+    image_data = 'data:image/jpeg;base64,' + base64.b64encode(raw).decode('utf-8')
+    del raw
+
+    rss_before = get_peak_rss_mb()
+    with tempfile.TemporaryDirectory() as folder:
+        tracemalloc.start()
+        body_size = pipeline(image_data, os.path.join(folder, 'photo_bench.jpg'))
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    rss_after = get_peak_rss_mb()
+
+    print(json.dumps({
+        'body_size': body_size,
+        'traced_peak_mb': traced_peak / (1024 * 1024),
+        'rss_growth_mb': rss_after - rss_before
+    }))
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print("🧪 Memoria del envío de fotos a Business Central")
+    print("=" * 50)
+    print(f"📊 Imagen de prueba: {size_mb:.1f} MB")
+
+    results = {}
+    for variant in ('legacy', 'payload'):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--variant', variant, str(size_mb)],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+        results[variant] = json.loads(output.strip().splitlines()[-1])
+
+    if results['legacy']['body_size'] != results['payload']['body_size']:
+        print("❌ Los cuerpos enviados a BC no coinciden")
+        sys.exit(1)
+
+    for variant, label in (('legacy', 'Anterior'), ('payload', 'ImagePayload')):
+        result = results[variant]
+        print(f"   {label:13} pico Python: {result['traced_peak_mb']:7.1f} MB | "
+              f"aumento del pico RSS: {result['rss_growth_mb']:7.1f} MB")
+
+    if resource is None:
+        print("\n⚠️  RSS no disponible en este sistema, se compara el pico de memoria de Python")
+        key = 'traced_peak_mb'
+    else:
+        key = 'rss_growth_mb'
+    reduction = (1 - results['payload'][key] / results['legacy'][key]) * 100
+    print(f"\n📉 Reducción del pico de memoria: {reduction:.1f}%")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == '--variant':
+        run_variant(sys.argv[2], float(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para comparar los motores de transcripción (openai-whisper y
+faster-whisper int8) con grabaciones en español de números de parada:
+factor de tiempo real (tiempo de inferencia / duración del audio), tasa de
+error por palabra (WER) frente a la transcripción de referencia y acierto del
+número de parada que sacan las reglas de stop_parser de cada transcripción.
+
+Uso: python benchmark_transcription.py [carpeta_de_grabaciones] [--generate]
+La carpeta (por defecto benchmark_audio/) contiene las notas de voz y un
+transcripciones.json con {"archivo": {"text": "texto de referencia",
+"stop_number": "P1171" o null}} (también vale {"archivo": "texto"}, sin
+comprobar la parada). El repositorio solo incluye transcripciones.json: con
+--generate se sintetizan con voz (pyttsx3 o espeak-ng) los audios que falten;
+para medir de verdad conviene sustituirlos por notas de voz grabadas en la calle.
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+from config import TRANSCRIPTION_CONFIG
+from audio_decoder import AudioDecoder
+from stop_parser import parse_stop_info, words_to_digits
+from transcription import TranscriptionPool, TRANSCRIPTION_BACKENDS, create_transcription_backend
+
+# Síntesis de voz opcional para generar el corpus (--generate)
+try:
+    import pyttsx3
+    PYTTSX3_AVAILABLE = True
+except ImportError:
+    pyttsx3 = None
+    PYTTSX3_AVAILABLE = False
+
+DEFAULT_FOLDER = 'benchmark_audio'
+REFERENCES_FILE = 'transcripciones.json'
+TTS_LANGUAGE = 'es'
+UNCHECKED = object()  # Grabación sin número de parada esperado
+
+def normalize_words(text):
+    """
+    Palabras en minúsculas sin puntuación (igual que el post-proceso de web_app)
+
+    Los números dichos con palabras se pasan a cifras, para que "mil ciento
+    setenta y uno" y "1171" cuenten como la misma transcripción.
+    """
+    text = text.lower().replace(',', ' ').replace('-', ' ')
+    return re.sub(r'[^\w\s]', ' ', words_to_digits(text)).split()
+
+def load_references(folder):
+    """
+    Lee transcripciones.json
+
+    Returns:
+        dict: {archivo: (texto de referencia, parada esperada)}; la parada es
+            UNCHECKED si la entrada no la indica
+    """
+    with open(os.path.join(folder, REFERENCES_FILE), 'r', encoding='utf-8') as f:
+        references = json.load(f)
+    return {
+        name: (entry, UNCHECKED) if isinstance(entry, str) else (entry['text'], entry.get('stop_number', UNCHECKED))
+        for name, entry in references.items()
+    }
+
+def synthesize_with_pyttsx3(items):
+    """Genera los audios con pyttsx3 (SAPI en Windows, espeak en Linux)"""
+    engine = pyttsx3.init()
+    for voice in engine.getProperty('voices'):
+        languages = ' '.join(str(language) for language in (voice.languages or []))
+        if TTS_LANGUAGE in f'{voice.id} {languages}'.lower():
+            engine.setProperty('voice', voice.id)
+            break
+    for path, text in items:
+        engine.save_to_file(text, path)
+    engine.runAndWait()
+
+def synthesize_with_espeak(executable, items):
+    """Genera los audios con espeak-ng / espeak"""
+    for path, text in items:
+        subprocess.run([executable, '-v', TTS_LANGUAGE, '-w', path, text], check=True)
+
+def generate_missing(folder, references):
+    """
+    Sintetiza con voz los audios del corpus que no existan
+
+    Returns:
+        bool: False si no hay ningún sintetizador disponible
+    """
+    items = [(os.path.join(folder, name), text) for name, (text, _) in sorted(references.items())
+             if not os.path.exists(os.path.join(folder, name))]
+    if not items:
+        return True
+
+    espeak = shutil.which('espeak-ng') or shutil.which('espeak')
+    print(f"🗣️ Generando {len(items)} audios con {'pyttsx3' if PYTTSX3_AVAILABLE else espeak}...")
+    if PYTTSX3_AVAILABLE:
+        synthesize_with_pyttsx3(items)
+    elif espeak:
+        synthesize_with_espeak(espeak, items)
+    else:
+        return False
+    return True
+
+def word_errors(reference, hypothesis):
+    """Distancia de edición por palabras (sustituciones + borrados + inserciones)"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word)
+            ))
+        previous = current
+    return previous[-1]
+
+def load_recordings(folder, decoder, references):
+    """Devuelve una lista de (nombre, muestras, duración, palabras de referencia, parada esperada)"""
+    recordings = []
+    for name, (text, stop_number) in sorted(references.items()):
+        with open(os.path.join(folder, name), 'rb') as f:
+            samples = decoder.decode(f.read())
+        recordings.append((name, samples, decoder.duration(samples), normalize_words(text), stop_number))
+    return recordings
+
+def benchmark_engine(engine, recordings):
+    """Transcribe todas las grabaciones con un motor y muestra sus resultados"""
+    backend = create_transcription_backend(dict(TRANSCRIPTION_CONFIG, engine=engine))
+    print(f"\n🔧 Motor: {engine} (modelo {backend.model_name})")
+    if not backend.available:
+        print(f"   ⚠️  {backend.install_hint}")
+        return None
+
+    pool = TranscriptionPool(backend, workers=1, language=TRANSCRIPTION_CONFIG['language'], warmup=True)
+    pool.load()
+
+    totals = {'audio': 0.0, 'inference': 0.0, 'errors': 0, 'words': 0, 'stops': 0, 'stops_ok': 0}
+    for name, samples, duration, reference, expected_stop in recordings:
+        result, timings = pool.transcribe(samples)
+        hypothesis = normalize_words(result['text'])
+        errors = word_errors(reference, hypothesis)
+        stop_number = parse_stop_info(result['text']).stop_number
+
+        totals['audio'] += duration
+        totals['inference'] += timings['inference']
+        totals['errors'] += errors
+        totals['words'] += len(reference)
+        stop_note = ''
+        if expected_stop is not UNCHECKED:
+            totals['stops'] += 1
+            totals['stops_ok'] += stop_number == expected_stop
+            stop_note = f", parada {stop_number} {'✅' if stop_number == expected_stop else f'❌ (esperada {expected_stop})'}"
+        print(f"   📁 {name} ({duration:.1f}s): RTF {timings['inference'] / duration:.3f}, "
+              f"{errors}/{len(reference)} errores{stop_note} → \"{result['text'].strip()}\"")
+
+    summary = {
+        'load': pool.load_time,
+        'rtf': totals['inference'] / totals['audio'],
+        'wer': totals['errors'] / totals['words'] if totals['words'] else 0.0,
+        'stop_accuracy': totals['stops_ok'] / totals['stops'] if totals['stops'] else None
+    }
+    stop_summary = f" | Paradas: {summary['stop_accuracy'] * 100:.0f}%" if totals['stops'] else ''
+    print(f"   📊 Carga: {summary['load']:.1f}s | RTF: {summary['rtf']:.3f} | "
+          f"WER: {summary['wer'] * 100:.1f}%{stop_summary}")
+    return summary
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    folder = args[0] if args else DEFAULT_FOLDER
+    if not os.path.exists(os.path.join(folder, REFERENCES_FILE)):
+        print(f"❌ No se encontró {os.path.join(folder, REFERENCES_FILE)}")
+        print(f"   Graba notas de voz con números de parada y crea {REFERENCES_FILE} con "
+              f"{{\"archivo\": {{\"text\": \"texto de referencia\", \"stop_number\": \"P1171\"}}}}")
+        sys.exit(1)
+
+    references = load_references(folder)
+    if '--generate' in sys.argv and not generate_missing(folder, references):
+        print("❌ No hay sintetizador de voz: instala pyttsx3 (pip install pyttsx3) o espeak-ng")
+        sys.exit(1)
+    missing = [name for name in references if not os.path.exists(os.path.join(folder, name))]
+    if missing:
+        print(f"❌ Faltan {len(missing)} audios en {folder} (p. ej. {missing[0]})")
+        print("   Grábalos o genéralos con voz sintética: python benchmark_transcription.py --generate")
+        sys.exit(1)
+
+    decoder = AudioDecoder(TRANSCRIPTION_CONFIG['decoder'], ffmpeg_path=TRANSCRIPTION_CONFIG['ffmpeg_path'])
+    if not decoder.available:
+        print("❌ No hay decodificador disponible: instala PyAV (pip install av) o FFmpeg")
+        sys.exit(1)
+
+    recordings = load_recordings(folder, decoder, references)
+    print("🧪 Motores de transcripción")
+    print("=" * 50)
+    print(f"📊 {len(recordings)} grabaciones, {sum(r[2] for r in recordings):.1f}s de audio")
+
+    results = {}
+    for engine in TRANSCRIPTION_BACKENDS:
+        summary = benchmark_engine(engine, recordings)
+        if summary:
+            results[engine] = summary
+
+    if len(results) > 1:
+        print("\n" + "=" * 50)
+        for engine, summary in results.items():
+            stop_accuracy = summary['stop_accuracy']
+            stops = f"paradas {stop_accuracy * 100:3.0f}% | " if stop_accuracy is not None else ''
+            print(f"🏁 {engine:15s} RTF {summary['rtf']:.3f} | WER {summary['wer'] * 100:5.1f}% | "
+                  f"{stops}carga {summary['load']:.1f}s")
+
+if __name__ == "__main__":
+    main()
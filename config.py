@@ -66,9 +66,7 @@ BC_CONFIG = {
     },
     'timeout': 120,  # Aumentado a 2 minutos para imágenes grandes
     'timeout_large_images': 300,  # 5 minutos para imágenes muy grandes
-    'max_image_size_mb': 10,  # Tamaño máximo antes de comprimir
-    'compress_quality': 85,  # Calidad de compresión JPEG (1-100)
-    'enable_compression': True  # Habilitar compresión automática
+    'max_image_size_mb': 10  # Imágenes más grandes usan timeout_large_images (compresión: IMAGE_NORMALIZE_CONFIG)
 }
 
 # Configuración de tipos de incidencia
@@ -77,6 +75,170 @@ INCIDENCE_CONFIG = {
     'default_type': 'EMT'  # Tipo por defecto si no se especifica
 }
 
+# Configuración del cliente HTTP compartido (conexiones keep-alive por host)
+HTTP_CLIENT_CONFIG = {
+    'pool_connections': 8,  # Número de pools (hosts) que se mantienen abiertos
+    'pool_maxsize': 10,  # Conexiones abiertas por host
+    'host_pool_maxsize': {  # Ajuste por host (host:puerto)
+        'bc220.malla.es': 16,  # Cola de trabajos + consultas de tareas
+        'base64-api.deploy.malla.es': 16,  # Conversiones en paralelo de varias incidencias
+        '192.168.10.253:1234': 4  # LM Studio: una sola máquina
+    },
+    'connect_timeout': 10,  # Segundos para establecer la conexión
+    'read_timeout': 30,  # Segundos de espera de respuesta por defecto
+    'connect_retries': 2,  # Reintentos solo de errores de conexión (la petición no llegó a enviarse)
+    'backoff_factor': 0.5
+}
+
+# Configuración del servicio de conversión base64 -> URL de Malla
+BASE64_API_CONFIG = {
+    'save_url': 'https://base64-api.deploy.malla.es/save',
+    'delete_url': 'https://base64-api.deploy.malla.es/delete',
+    'timeout': 30,
+    'max_concurrency': 4  # Conversiones simultáneas por incidencia (imágenes y audios)
+}
+
+# Configuración de reintentos hacia servicios externos
+RETRY_CONFIG = {
+    'budget_ratio': 0.2,  # Cada petición permite 0.2 reintentos (máx. 20% de tráfico extra)
+    'budget_max_tokens': 10,  # Reintentos acumulables como máximo
+    'circuit_breaker': {
+        'failure_threshold': 5,  # Fallos seguidos para dejar de llamar al servicio
+        'reset_timeout': 30  # Segundos antes de volver a probar
+    },
+    'policies': {
+        'base64_save': {
+            'upstream': 'base64-api',
+            'max_attempts': 3,
+            'base_delay': 0.5,  # Backoff: 0.5s, 1s, 2s... con jitter
+            'max_delay': 4,
+            'deadline': 45,  # Plazo total de la petición, reintentos incluidos
+            'attempt_timeout': 30
+        },
+        'base64_delete': {
+            'upstream': 'base64-api',
+            'max_attempts': 3,
+            'base_delay': 0.5,
+            'max_delay': 4,
+            'deadline': 30,
+            'attempt_timeout': 15
+        }
+    }
+}
+
+# Configuración de la caché de tareas por QR ID (GtaskMalla_devuelveidqr)
+TASK_CACHE_CONFIG = {
+    'backend': 'memory',  # 'memory' (por proceso) o 'sqlite' (compartida entre instancias)
+    'sqlite_file': 'temp_uploads/task_cache.db',
+    'ttl': 300,  # Segundos que se reutiliza una lista de tareas
+    'negative_ttl': 60,  # Segundos que se recuerda que un QR no tiene tareas
+    'max_entries': 1000
+}
+
+# Configuración de la cola persistente de trabajos en segundo plano
+JOB_QUEUE_CONFIG = {
+    'db_file': 'jobs.db',  # Base de datos SQLite dentro de la carpeta temp_uploads
+    'workers': 4,  # Número máximo de hilos enviando a Business Central a la vez
+    'max_attempts': 3,  # Reintentos de un trabajo interrumpido por un reinicio
+    'lease_seconds': 600,  # Sin cambios de estado en este tiempo, el trabajo se da por abandonado (worker caído)
+    'wait_timeout': 120,  # Segundos que una petición síncrona espera el resultado del trabajo
+    'poll_interval': 5  # Segundos entre comprobaciones de trabajos pendientes
+}
+
+# Configuración de la subida de fotos en binario (multipart o cuerpo en bruto, sin base64)
+UPLOAD_STREAM_CONFIG = {
+    'chunk_size': 64 * 1024,  # Bytes que se leen y escriben en disco en cada bloque
+    'max_photo_size': 50 * 1024 * 1024  # Igual que MAX_CONTENT_LENGTH de la aplicación web
+}
+
+# Configuración de la normalización de fotos antes de enviarlas (BC y servicio base64)
+IMAGE_NORMALIZE_CONFIG = {
+    'enabled': True,
+    'max_dimension': 2560,  # Píxeles máximos del lado más largo
+    'target_bytes': 1536 * 1024,  # Tamaño objetivo: se busca la mayor calidad que quepa
+    'min_quality': 50,
+    'max_quality': 90,
+    'format': 'jpeg',  # 'jpeg' o 'webp' (usar WebP solo si BC y el servicio base64 lo aceptan)
+    'progressive': True  # JPEG progresivo
+}
+
+# Configuración de la transcripción de notas de voz (Whisper)
+TRANSCRIPTION_CONFIG = {
+    'engine': 'whisper',  # 'whisper' (openai-whisper) o 'faster-whisper' (CTranslate2, cuantizado)
+    'model': 'base',
+    'compute_type': 'int8',  # Solo faster-whisper: 'int8', 'int8_float32', 'float32'...
+    'cpu_threads': 0,  # Solo faster-whisper: hilos de CPU por modelo (0 = automático)
+    'language': 'es',
+    'workers': 1,  # Modelos en memoria = transcripciones simultáneas (cada uno ocupa ~500 MB)
+    'preload': True,  # Cargar al arrancar el servidor (si no, en la primera nota de voz)
+    'warmup': True,  # Transcribir un segundo de silencio al cargar
+    'batch_max_size': 8,  # Notas de voz (de hasta 30 s) transcritas en una misma pasada; 1 = sin lotes
+    'batch_max_wait': 0.05,  # Segundos que un lote espera a que lleguen más notas
+    'decoder': 'auto',  # 'pyav', 'ffmpeg' o 'auto' (PyAV si está instalado)
+    'ffmpeg_path': None  # Ruta de ffmpeg; None = buscar en el PATH y en la carpeta ffmpeg/ del proyecto
+}
+
+# Preparación de las fotos para el modelo de visión de LM Studio
+VISION_PREPROCESS_CONFIG = {
+    'max_dimension': 1024,  # Lado mayor en píxeles de la imagen que recibe el modelo
+    'quality': 85,  # Calidad JPEG
+    'cache_size': 32,  # Fotos preparadas en caché (por hash del contenido)
+    'cache_ttl': 600  # Segundos
+}
+
+# Caché de resultados de IA (/api/process-image-ai y /api/process-audio) por hash del contenido
+# Solo se guardan los resultados con número de parada; los fallidos se vuelven a consultar
+AI_RESULT_CACHE_CONFIG = {
+    'enabled': True,
+    'backend': 'memory',  # 'memory' o 'sqlite' (se conserva entre reinicios)
+    'sqlite_file': 'temp_uploads/ai_results.db',
+    'ttl': 24 * 3600,  # Segundos que se reutiliza un resultado
+    'max_entries': 500
+}
+
+# Extracción del número de parada de las notas de voz
+STOP_EXTRACTION_CONFIG = {
+    'min_confidence': 0.8,  # Por debajo, se consulta al LLM (P/parada + número da 0.95)
+    'llm_fallback': True  # False = solo reglas, nunca LM Studio
+}
+
+# Límite de llamadas simultáneas a los servicios de IA (el resto espera en una cola acotada)
+ADMISSION_CONFIG = {
+    'lm_studio': {
+        'max_concurrent': 1,  # Peticiones a la vez al servidor de LM Studio (una sola máquina)
+        'max_queue': 4,  # Peticiones esperando turno; con la cola llena se responde 503 al momento
+        'queue_timeout': 30,  # Segundos máximos en cola antes de responder 503
+        'initial_estimate': 20  # Segundos por petición hasta tener medidas reales
+    },
+    'whisper': {
+        'max_concurrent': 8,  # Notas de voz a la vez (se transcriben en lotes de batch_max_size)
+        'max_queue': 16,
+        'queue_timeout': 30,
+        'initial_estimate': 5
+    }
+}
+
+# Almacén de las sesiones por dispositivo (usuario y token de GTask)
+SESSION_STORE_CONFIG = {
+    'backend': 'memory',  # 'memory' (un solo worker) o 'sqlite' (compartido entre workers e instancias)
+    'sqlite_file': 'temp_uploads/sessions.db',
+    'ttl': 24 * 3600,  # Segundos sin actividad hasta que caduca la sesión
+    'storage_cache_size': 1000,  # Almacenamientos móviles abiertos por proceso (LRU, solo backend 'json')
+    'max_anonymous_sessions': 1000,  # Sesiones sin login en memoria por proceso (LRU)
+    'touch_granularity': 60,  # Segundos mínimos entre dos renovaciones de la caducidad de una sesión
+    'cleanup_interval': 60  # Segundos entre limpiezas de sesiones caducadas
+}
+
+# Almacenamiento móvil de los dispositivos (sesión guardada, lista de usuarios, ajustes)
+MOBILE_STORAGE_CONFIG = {
+    'backend': 'sqlite',  # 'sqlite' (una base de datos para todos) o 'json' (mobile_storage_<id>.json por dispositivo)
+    'sqlite_file': 'temp_uploads/mobile_storage.db',
+    # Solo backend 'json': segundos que se agrupan los cambios antes de escribirlos (al apagar se
+    # escriben todos). Con 'sqlite' cada cambio se escribe en el momento: la base de datos la
+    # comparten varios workers y una escritura diferida pisaría los cambios hechos por otro
+    'flush_delay': 1.0
+}
+
 # Función para obtener la URL completa de la API
 def get_api_url():
     return f"{API_CONFIG['base_url']}{API_CONFIG['endpoint']}"
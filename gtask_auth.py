@@ -5,6 +5,7 @@ Módulo para manejar autenticación y gestión de usuarios de GTask
 import json
 import requests
 import jwt
+import http_client
 from datetime import datetime, timedelta
 from gtask_config import get_gtask_url, get_gtask_headers, GTASK_CONFIG
 
@@ -38,7 +39,7 @@ class GTaskAuth:
             print(f"🔐 Intentando login en: {url}")
             print(f"👤 Usuario: {username}")
             
-            response = requests.post(
+            response = http_client.post(
                 url,
                 headers=headers,
                 json=login_data,
@@ -136,7 +137,7 @@ class GTaskAuth:
             
             print(f"👥 Obteniendo lista de usuarios desde: {url}")
             
-            response = requests.get(
+            response = http_client.get(
                 url,
                 headers=headers,
                 timeout=GTASK_CONFIG['timeout']
@@ -243,5 +244,35 @@ class GTaskAuth:
         print("🔄 Token expirado o próximo a expirar")
         return False
 
+    def to_dict(self):
+        """
+        Estado del autenticador serializable a JSON (para el almacén de sesiones)
+
+        Returns:
+            dict: Usuario, token, expiración (ISO) y lista de usuarios
+        """
+        return {
+            'current_user': self.current_user,
+            'access_token': self.access_token,
+            'token_expiry': self.token_expiry.isoformat() if self.token_expiry else None,
+            'users_list': self.users_list
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Reconstruye un autenticador a partir de to_dict()
+
+        Args:
+            data (dict): Estado guardado (None = autenticador sin sesión)
+        """
+        auth = cls()
+        if data:
+            auth.current_user = data.get('current_user')
+            auth.access_token = data.get('access_token')
+            auth.token_expiry = datetime.fromisoformat(data['token_expiry']) if data.get('token_expiry') else None
+            auth.users_list = data.get('users_list') or []
+        return auth
+
 # Instancia global del autenticador
 gtask_auth = GTaskAuth()
@@ -0,0 +1,118 @@
+"""
+Módulo con el cliente HTTP compartido para todos los servicios externos
+(Business Central, servicio base64, GTask y LM Studio).
+Mantiene una sesión con pool de conexiones keep-alive por host para no
+repetir el handshake TCP+TLS en cada petición.
+"""
+
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import HTTP_CLIENT_CONFIG
+
+_sessions = {}  # {host: requests.Session}
+_sessions_lock = threading.Lock()
+
+def _create_session(host):
+    """Crea una sesión con el pool y la política de reintentos del host"""
+    pool_maxsize = HTTP_CLIENT_CONFIG['host_pool_maxsize'].get(host, HTTP_CLIENT_CONFIG['pool_maxsize'])
+
+    # Solo se reintentan los errores de conexión: la petición no llegó al servidor,
+    # así que es seguro incluso para POST no idempotentes
+    retry = Retry(
+        total=HTTP_CLIENT_CONFIG['connect_retries'],
+        connect=HTTP_CLIENT_CONFIG['connect_retries'],
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=HTTP_CLIENT_CONFIG['backoff_factor'],
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_CLIENT_CONFIG['pool_connections'],
+        pool_maxsize=pool_maxsize,
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # La sesión es compartida entre dispositivos: no guardar cookies de ninguna respuesta
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    print(f"🔌 Pool HTTP creado para {host} (máx. {pool_maxsize} conexiones)")
+    return session
+
+def get_session(url):
+    """
+    Obtiene la sesión compartida del host de la URL
+
+    Args:
+        url (str): URL de la petición
+
+    Returns:
+        requests.Session: Sesión con pool de conexiones del host
+    """
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _create_session(host)
+                _sessions[host] = session
+    return session
+
+def get_default_timeout():
+    """Timeout por defecto (conexión, lectura) en segundos"""
+    return (HTTP_CLIENT_CONFIG['connect_timeout'], HTTP_CLIENT_CONFIG['read_timeout'])
+
+def request(method, url, **kwargs):
+    """
+    Realiza una petición HTTP con el pool compartido del host
+
+    Acepta los mismos argumentos que requests.request. Si no se indica
+    timeout se usa el de HTTP_CLIENT_CONFIG; un timeout numérico se aplica
+    a la lectura manteniendo el timeout de conexión configurado.
+    """
+    timeout = kwargs.pop('timeout', None)
+    if timeout is None:
+        timeout = get_default_timeout()
+    elif isinstance(timeout, (int, float)):
+        timeout = (min(HTTP_CLIENT_CONFIG['connect_timeout'], timeout), timeout)
+    return get_session(url).request(method, url, timeout=timeout, **kwargs)
+
+def get(url, **kwargs):
+    """Petición GET con el pool compartido"""
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    """Petición POST con el pool compartido"""
+    return request('POST', url, **kwargs)
+
+def delete(url, **kwargs):
+    """Petición DELETE con el pool compartido"""
+    return request('DELETE', url, **kwargs)
+
+def get_pool_stats():
+    """
+    Obtiene los hosts con pool abierto
+
+    Returns:
+        dict: Hosts y tamaño máximo de su pool
+    """
+    return {
+        host: HTTP_CLIENT_CONFIG['host_pool_maxsize'].get(host, HTTP_CLIENT_CONFIG['pool_maxsize'])
+        for host in list(_sessions.keys())
+    }
+
+def close_all():
+    """Cierra todas las conexiones abiertas"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
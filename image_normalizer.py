@@ -0,0 +1,196 @@
+"""
+Módulo para normalizar las fotos antes de enviarlas: orientación EXIF,
+tamaño máximo en píxeles y búsqueda de la calidad que cabe en un tamaño
+objetivo en bytes (JPEG progresivo o WebP).
+"""
+
+import io
+import math
+import os
+import time
+
+from PIL import Image, ImageOps
+
+# Formatos de salida soportados: (formato PIL, extensión)
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'webp': ('WEBP', '.webp')
+}
+
+# Etiqueta EXIF de orientación
+EXIF_ORIENTATION = 0x0112
+
+class NormalizedImage:
+    """Resultado de la normalización de una foto"""
+
+    def __init__(self, data, image_format, extension, width, height, quality, original_size, elapsed):
+        self.data = data
+        self.format = image_format
+        self.extension = extension
+        self.width = width
+        self.height = height
+        self.quality = quality
+        self.original_size = original_size
+        self.elapsed = elapsed
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def describe(self):
+        """Resumen para los logs"""
+        return (f"{self.original_size / 1024:.0f} KB → {self.size / 1024:.0f} KB, "
+                f"{self.width}x{self.height}, {self.format} calidad {self.quality}, {self.elapsed * 1000:.0f} ms")
+
+class ImageNormalizer:
+    """
+    Normaliza fotos para que no superen un tamaño en píxeles ni en bytes
+
+    Las fotos que ya cumplen los límites (tamaño, dimensiones, orientación y
+    formato) no se vuelven a codificar, para no perder calidad.
+    """
+
+    def __init__(self, enabled=True, max_dimension=2560, target_bytes=1536 * 1024, min_quality=50,
+                 max_quality=90, output_format='jpeg', progressive=True, max_downscale_steps=3):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f'Formato de salida no soportado: {output_format}')
+        self.enabled = enabled
+        self.max_dimension = max_dimension
+        self.target_bytes = target_bytes
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.output_format = output_format
+        self.progressive = progressive
+        self.max_downscale_steps = max_downscale_steps
+
+    @property
+    def extension(self):
+        return OUTPUT_FORMATS[self.output_format][1]
+
+    def needs_normalization(self, image, size):
+        """
+        Indica si una foto abierta con PIL (sin cargar) hay que normalizarla
+
+        Args:
+            image: Imagen de PIL recién abierta
+            size (int): Tamaño del archivo en bytes
+        """
+        if size > self.target_bytes:
+            return True
+        if max(image.size) > self.max_dimension:
+            return True
+        if image.format != OUTPUT_FORMATS[self.output_format][0]:
+            return True
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        return orientation not in (None, 1)
+
+    def normalize(self, source):
+        """
+        Normaliza una foto
+
+        Args:
+            source: Bytes de la imagen o ruta del archivo
+
+        Returns:
+            NormalizedImage: Foto normalizada, o None si ya cumple los límites
+                (o la normalización está desactivada)
+        """
+        if not self.enabled:
+            return None
+
+        start = time.perf_counter()
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            original_size = len(source)
+            image = Image.open(io.BytesIO(source))
+        else:
+            original_size = os.path.getsize(source)
+            image = Image.open(source)
+
+        with image:
+            if not self.needs_normalization(image, original_size):
+                return None
+
+            # Los JPEG grandes se decodifican ya reducidos (escalado DCT), mucho más rápido
+            if image.format == 'JPEG':
+                image.draft('RGB', (self.max_dimension, self.max_dimension))
+
+            image = ImageOps.exif_transpose(image)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            if max(image.size) > self.max_dimension:
+                image.thumbnail((self.max_dimension, self.max_dimension), Image.Resampling.LANCZOS)
+
+            data, quality = self._encode_to_target(image)
+            for _ in range(self.max_downscale_steps):
+                if len(data) <= self.target_bytes:
+                    break
+                # Ni con la calidad mínima cabe: reducir las dimensiones en proporción
+                scale = math.sqrt(self.target_bytes / len(data)) * 0.95
+                image = image.resize(
+                    (max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                    Image.Resampling.LANCZOS
+                )
+                data, quality = self._encode_to_target(image)
+
+            image_format, extension = OUTPUT_FORMATS[self.output_format]
+            return NormalizedImage(data, image_format, extension, image.width, image.height, quality,
+                                   original_size, time.perf_counter() - start)
+
+    def _encode(self, image, quality, fast=False):
+        """
+        Codifica la imagen con la calidad indicada
+
+        Con fast=True se omiten las pasadas de optimización (tablas Huffman
+        optimizadas / JPEG progresivo, esfuerzo de WebP); el resultado final
+        con ellas normalmente ocupa algo menos.
+        """
+        output = io.BytesIO()
+        if self.output_format == 'webp':
+            image.save(output, format='WEBP', quality=quality, method=0 if fast else 4)
+        elif fast:
+            image.save(output, format='JPEG', quality=quality)
+        else:
+            image.save(output, format='JPEG', quality=quality, optimize=True, progressive=self.progressive)
+        return output.getvalue()
+
+    def _encode_to_target(self, image):
+        """
+        Busca (búsqueda binaria) la mayor calidad cuyo resultado cabe en target_bytes
+
+        La búsqueda usa la codificación rápida y solo la calidad elegida se
+        codifica con todas las optimizaciones.
+
+        Returns:
+            tuple: (bytes, calidad); con la calidad mínima si no cabe ninguna
+        """
+        quality = self.min_quality
+        if len(self._encode(image, self.max_quality, fast=True)) <= self.target_bytes:
+            quality = self.max_quality
+        else:
+            low, high = self.min_quality, self.max_quality - 1
+            while low <= high:
+                candidate = (low + high) // 2
+                if len(self._encode(image, candidate, fast=True)) <= self.target_bytes:
+                    quality = candidate
+                    low = candidate + 1
+                else:
+                    high = candidate - 1
+
+        return self._encode(image, quality), quality
+
+def create_image_normalizer(config):
+    """
+    Crea el normalizador de fotos según la configuración
+
+    Args:
+        config (dict): IMAGE_NORMALIZE_CONFIG
+    """
+    return ImageNormalizer(
+        enabled=config['enabled'],
+        max_dimension=config['max_dimension'],
+        target_bytes=config['target_bytes'],
+        min_quality=config['min_quality'],
+        max_quality=config['max_quality'],
+        output_format=config['format'],
+        progressive=config['progressive']
+    )
@@ -0,0 +1,82 @@
+"""
+Módulo para manejar la imagen de una foto a lo largo del envío a Business Central:
+los bytes se decodifican una sola vez y el base64 se genera solo cuando hace falta.
+"""
+
+import base64
+import binascii
+
+# Marcador que ocupa el lugar del base64 al serializar el JSON que se envía
+IMAGE_PLACEHOLDER = '__IMAGE_BASE64__'
+
+class ImagePayload:
+    """Bytes de una imagen con su base64 calculado una sola vez y bajo demanda"""
+
+    def __init__(self, data):
+        self.data = data
+        self._base64 = None
+
+    @classmethod
+    def from_base64(cls, image_data):
+        """
+        Crea la imagen a partir de base64 puro o de una data URL, validándolo al decodificar
+
+        Raises:
+            ValueError: Si el base64 no es válido
+        """
+        if not image_data:
+            raise ValueError('No se proporcionó imagen')
+        if image_data.startswith('data:'):
+            image_data = image_data.split(',', 1)[1]
+        try:
+            return cls(base64.b64decode(image_data))
+        except (binascii.Error, ValueError) as e:
+            raise ValueError(f'Base64 inválido: {str(e)}')
+
+    @classmethod
+    def from_file(cls, filepath):
+        """Crea la imagen leyendo un archivo"""
+        with open(filepath, 'rb') as f:
+            return cls(f.read())
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def size_mb(self):
+        return self.size / (1024 * 1024)
+
+    @property
+    def base64_bytes(self):
+        """Base64 de la imagen en bytes ASCII (se calcula la primera vez)"""
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data)
+        return self._base64
+
+    @property
+    def base64_length(self):
+        """Longitud del base64 sin necesidad de generarlo"""
+        return 4 * ((self.size + 2) // 3)
+
+    def save(self, filepath):
+        """Guarda la imagen en disco"""
+        with open(filepath, 'wb') as f:
+            f.write(self.data)
+
+    def embed_in_json(self, json_text):
+        """
+        Sustituye IMAGE_PLACEHOLDER por el base64 de la imagen
+
+        El JSON se serializa con el marcador (pocos bytes) y el base64 se
+        inserta al final, sin escaparlo ni copiarlo en cadenas intermedias.
+        Los caracteres del base64 no necesitan escape en JSON.
+
+        Args:
+            json_text (str): JSON ya serializado que contiene el marcador una vez
+
+        Returns:
+            bytes: Cuerpo de la petición en UTF-8
+        """
+        prefix, suffix = json_text.split(IMAGE_PLACEHOLDER, 1)
+        return b''.join((prefix.encode('utf-8'), self.base64_bytes, suffix.encode('utf-8')))
@@ -10,6 +10,7 @@ python.exe -m pip install --upgrade pip setuptools wheel
 echo.
 echo Instalando dependencias necesarias para Whisper...
 pip install ffmpeg-python
+pip install av
 
 echo.
 echo Instalando PyTorch (CPU version, compatible con Python 3.13)...
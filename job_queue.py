@@ -0,0 +1,381 @@
+"""
+Módulo para la cola persistente de trabajos en segundo plano (envíos a Business Central)
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# Estados en los que un trabajo ya no volverá a ejecutarse
+FINAL_STATES = ('done', 'failed')
+
+# Estados intermedios habituales: queued -> running -> converting -> posting_to_bc -> done/failed
+
+# Segundos entre búsquedas de trabajos con la concesión caducada (worker caído)
+RECOVERY_INTERVAL = 60
+
+# Trabajos pendientes que se intentan reclamar en cada pasada (si otro worker se adelanta con uno)
+CLAIM_BATCH = 10
+
+class JobQueue:
+    """
+    Cola de trabajos en SQLite compartida por todos los procesos
+
+    Quien reclama un trabajo lo marca con su identificador (claimed_by) y una
+    concesión (lease_until) que se renueva en cada cambio de estado. Solo se
+    vuelven a poner en cola los trabajos cuya concesión ha caducado (el proceso
+    que los tenía se cayó), nunca los que otro worker sigue enviando.
+    """
+
+    def __init__(self, db_path, workers=4, max_attempts=3, poll_interval=5, lease_seconds=600):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._last_recovery = time.monotonic()
+        self.handlers = {}
+        self.threads = []
+        self.started = False
+        self.stopping = False
+        self._db_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._changes = threading.Condition()  # Se notifica en cada cambio de estado
+        self._conn = self._connect()
+        self._create_schema()
+
+    def _connect(self):
+        """Abre la base de datos SQLite en modo WAL"""
+        folder = os.path.dirname(self.db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _create_schema(self):
+        """Crea la tabla de trabajos si no existe"""
+        with self._db_lock:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    timestamps TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at)')
+
+            # Bases de datos creadas antes de registrar la hora de cada estado
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(jobs)').fetchall()]
+            if 'timestamps' not in columns:
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN timestamps TEXT')
+            # ... y antes de las concesiones por proceso
+            if 'claimed_by' not in columns:
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN claimed_by TEXT')
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN lease_until REAL')
+
+    def register_handler(self, kind, handler):
+        """
+        Registra la función que procesa un tipo de trabajo
+
+        Args:
+            kind (str): Tipo de trabajo
+            handler (callable): Función handler(job_id, payload) que devuelve un dict con 'success'
+        """
+        self.handlers[kind] = handler
+
+    def start(self):
+        """Recupera los trabajos pendientes y arranca los hilos de trabajo"""
+        with self._start_lock:
+            if self.started:
+                return
+
+            self.stopping = False
+            replayed = self._replay_unfinished()
+            if replayed:
+                print(f"♻️ {replayed} trabajo(s) interrumpido(s) devuelto(s) a la cola")
+
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+            self.started = True
+            print(f"🧵 Cola de trabajos iniciada con {self.workers} hilo(s): {self.db_path}")
+
+    def stop(self, timeout=10):
+        """Detiene los hilos de trabajo (los trabajos en curso se recuperan cuando caduque su concesión)"""
+        self.stopping = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+        self.started = False
+
+    def _replay_unfinished(self):
+        """
+        Devuelve a la cola los trabajos que quedaron a medias porque su proceso
+        se cayó o se reinició (concesión caducada o de antes de las concesiones)
+
+        Returns:
+            int: Trabajos devueltos a la cola
+        """
+        now = datetime.now().isoformat()
+        expired = "state NOT IN ('queued', 'done', 'failed') AND (lease_until IS NULL OR lease_until < ?)"
+        with self._db_lock:
+            self._conn.execute(
+                f"UPDATE jobs SET state = 'failed', error = ?, lease_until = NULL, updated_at = ? "
+                f"WHERE {expired} AND attempts >= ?",
+                ('Trabajo interrumpido demasiadas veces', now, time.time(), self.max_attempts)
+            )
+            return self._conn.execute(
+                f"UPDATE jobs SET state = 'queued', lease_until = NULL, updated_at = ? WHERE {expired}",
+                (now, time.time())
+            ).rowcount
+
+    def _recover_expired(self):
+        """Recupera cada RECOVERY_INTERVAL segundos los trabajos de workers caídos (sin reiniciar este)"""
+        if time.monotonic() - self._last_recovery < RECOVERY_INTERVAL:
+            return
+        self._last_recovery = time.monotonic()
+        recovered = self._replay_unfinished()
+        if recovered:
+            print(f"♻️ {recovered} trabajo(s) con la concesión caducada devuelto(s) a la cola")
+            with self._wakeup:
+                self._wakeup.notify_all()
+
+    def enqueue(self, kind, payload, job_id=None):
+        """
+        Añade un trabajo a la cola
+
+        Args:
+            kind (str): Tipo de trabajo (debe tener un handler registrado)
+            payload (dict): Datos serializables a JSON del trabajo
+            job_id (str): ID del trabajo (se genera uno si no se indica). Encolar
+                otra vez un ID existente no crea otro trabajo: se devuelve el que
+                ya hay (p. ej. el cliente reintenta con el mismo upload_id), salvo
+                que haya fallado, que se vuelve a poner en cola con el nuevo payload
+
+        Returns:
+            str: ID del trabajo
+        """
+        if kind not in self.handlers:
+            raise ValueError(f'Tipo de trabajo no registrado: {kind}')
+
+        self.start()
+        job_id = job_id or str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        queued = json.dumps({'queued': now})
+        with self._db_lock:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (id, kind, payload, state, attempts, timestamps, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', 0, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), queued, now, now)
+            ).rowcount
+            requeued = not inserted and self._conn.execute(
+                "UPDATE jobs SET payload = ?, state = 'queued', attempts = 0, result = NULL, error = NULL, "
+                "timestamps = ?, updated_at = ? WHERE id = ? AND kind = ? AND state = 'failed'",
+                (json.dumps(payload, ensure_ascii=False), queued, now, job_id, kind)
+            ).rowcount
+
+        if not inserted and not requeued:
+            print(f"♻️ Trabajo ya encolado: {job_id} ({kind})")
+            return job_id
+
+        print(f"📥 Trabajo {'encolado' if inserted else 'reintentado'}: {job_id} ({kind})")
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def _claim_next(self):
+        """
+        Reclama el trabajo pendiente más antiguo y lo devuelve
+
+        El paso a 'running' se hace en la misma sentencia que comprueba que el
+        trabajo sigue en 'queued', así que si otro hilo u otro proceso (varios
+        workers de gunicorn comparten la base de datos) lo reclama antes, este
+        no lo ejecuta y prueba con el siguiente.
+        """
+        now = datetime.now().isoformat()
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, payload, timestamps FROM jobs WHERE state = 'queued' "
+                "ORDER BY created_at LIMIT ?",
+                (CLAIM_BATCH,)
+            ).fetchall()
+            for row in rows:
+                timestamps = json.loads(row['timestamps']) if row['timestamps'] else {}
+                timestamps['running'] = now
+                claimed = self._conn.execute(
+                    "UPDATE jobs SET state = 'running', attempts = attempts + 1, claimed_by = ?, lease_until = ?, "
+                    "timestamps = ?, updated_at = ? WHERE id = ? AND state = 'queued'",
+                    (self.owner, time.time() + self.lease_seconds, json.dumps(timestamps), now, row['id'])
+                ).rowcount
+                if claimed == 1:
+                    break
+            else:
+                return None
+
+        with self._changes:
+            self._changes.notify_all()
+        return row['id'], row['kind'], json.loads(row['payload'])
+
+    def _worker_loop(self):
+        """Bucle de cada hilo de trabajo"""
+        while not self.stopping:
+            job = self._claim_next()
+            if not job:
+                self._recover_expired()
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+
+            job_id, kind, payload = job
+            try:
+                result = self.handlers[kind](job_id, payload)
+                if result and result.get('success'):
+                    self._finish(job_id, 'done', result=result)
+                else:
+                    error = result.get('error') if result else 'El trabajo no devolvió resultado'
+                    self._finish(job_id, 'failed', result=result, error=error)
+            except Exception as e:
+                print(f"❌ Error en trabajo {job_id} ({kind}): {str(e)}")
+                self._finish(job_id, 'failed', error=str(e))
+
+    def set_state(self, job_id, state, result=None, error=None):
+        """
+        Actualiza el estado de un trabajo, registra la hora del cambio y renueva
+        la concesión (o la libera en un estado final)
+
+        Si otro proceso se ha quedado el trabajo porque la concesión caducó, el
+        cambio se descarta para no pisar su resultado.
+
+        Args:
+            job_id (str): ID del trabajo
+            state (str): Nuevo estado (p. ej. 'converting', 'posting_to_bc')
+            result (dict): Resultado a guardar (respuesta de BC)
+            error (str): Mensaje de error a guardar
+        """
+        now = datetime.now().isoformat()
+        with self._db_lock:
+            row = self._conn.execute("SELECT timestamps FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if not row:
+                return
+            timestamps = json.loads(row['timestamps']) if row['timestamps'] else {}
+            timestamps[state] = now
+            lease_until = None if state in FINAL_STATES else time.time() + self.lease_seconds
+            updated = self._conn.execute(
+                "UPDATE jobs SET state = ?, timestamps = ?, result = COALESCE(?, result), "
+                "error = COALESCE(?, error), lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND (claimed_by IS NULL OR claimed_by = ?)",
+                (state, json.dumps(timestamps),
+                 json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                 error, lease_until, now, job_id, self.owner)
+            ).rowcount
+        if not updated:
+            print(f"⚠️ Trabajo {job_id} reclamado por otro proceso: se descarta el estado '{state}'")
+            return
+
+        with self._changes:
+            self._changes.notify_all()
+
+    def _finish(self, job_id, state, result=None, error=None):
+        """Guarda el resultado final de un trabajo y avisa a quien lo espera"""
+        self.set_state(job_id, state, result=result, error=error)
+        print(f"{'✅' if state == 'done' else '❌'} Trabajo {job_id} finalizado: {state}")
+
+    def get_job(self, job_id):
+        """
+        Obtiene el estado de un trabajo
+
+        Returns:
+            dict: Estado del trabajo (sin el payload) o None si no existe
+        """
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT id, kind, state, attempts, result, error, timestamps, created_at, updated_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['timestamps'] = json.loads(job['timestamps']) if job['timestamps'] else {}
+        return job
+
+    def wait_for_change(self, job_id, since_state, timeout):
+        """
+        Espera (long-poll) a que un trabajo salga del estado indicado
+
+        Args:
+            job_id (str): ID del trabajo
+            since_state (str): Último estado conocido por el cliente (None para no esperar)
+            timeout (float): Segundos máximos de espera
+
+        Returns:
+            dict: Estado del trabajo o None si no existe
+        """
+        deadline = time.monotonic() + timeout
+        with self._changes:
+            while True:
+                job = self.get_job(job_id)
+                if not job or job['state'] != since_state or job['state'] in FINAL_STATES:
+                    return job
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return job
+                self._changes.wait(remaining)
+
+    def wait_for(self, job_id, timeout):
+        """
+        Espera a que un trabajo termine
+
+        Returns:
+            dict: Estado del trabajo, que puede seguir sin terminar si se agota el tiempo
+        """
+        deadline = time.monotonic() + timeout
+        job = self.get_job(job_id)
+        while job and job['state'] not in FINAL_STATES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            job = self.wait_for_change(job_id, job['state'], remaining)
+        return job
+
+    def get_stats(self):
+        """
+        Obtiene la profundidad de la cola y el número de trabajos por estado
+
+        Returns:
+            dict: Estadísticas de la cola
+        """
+        with self._db_lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        by_state = {row[0]: row[1] for row in rows}
+        return {
+            'depth': by_state.get('queued', 0),
+            'in_progress': sum(count for state, count in by_state.items() if state not in FINAL_STATES + ('queued',)),
+            'by_state': by_state,
+            'workers': self.workers,
+            'started': self.started
+        }
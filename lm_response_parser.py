@@ -0,0 +1,284 @@
+"""
+Módulo para interpretar las respuestas de LM Studio en una sola pasada:
+localiza el JSON (aunque venga en un bloque markdown, rodeado de texto o
+truncado), normaliza los nombres de campo y devuelve el número de parada y la
+descripción de la incidencia. Todos los patrones están precompilados.
+"""
+
+import json
+import re
+import unicodedata
+
+# Caracteres relevantes dentro de un objeto JSON (el resto se salta de golpe)
+JSON_SIGNIFICANT = re.compile(r'[{}"\\]')
+
+# Código de parada en texto libre: P seguido de al menos 3 cifras
+STOP_CODE_PATTERN = re.compile(r'\bP\s*(\d{3,})\b', re.IGNORECASE)
+
+# Campos sueltos en JSON mal formado o truncado (el valor puede no tener comilla de cierre)
+STOP_FIELD_PATTERN = re.compile(
+    r'"(?:stop_number|n[uú]mero[ _]de[ _]parada|parada)"\s*:\s*"?([^",}\n]*)', re.IGNORECASE)
+DESCRIPTION_FIELD_PATTERN = re.compile(
+    r'"(?:description|descripci[oó]n de la incidencia|descripci[oó]n|incidencia)"\s*:\s*"((?:[^"\\]|\\.)*)',
+    re.IGNORECASE)
+
+# Formato markdown: **Número de parada:** P1171 / **Descripción de la incidencia o pintada:** ...
+MARKDOWN_STOP_PATTERN = re.compile(r'\*\*N[uú]mero de parada:\*\*\s*\**\s*(P?\s*\d+)', re.IGNORECASE)
+MARKDOWN_DESCRIPTION_PATTERN = re.compile(
+    r'\*\*Descripci[oó]n de la incidencia(?: o pintada)?:\*\*\s*(.+?)(?=\*\*|Nota adicional|$)',
+    re.IGNORECASE | re.DOTALL)
+
+# Texto que el modelo añade y no forma parte de la descripción
+DESCRIPTION_NOISE_PATTERN = re.compile(
+    r'\**Nota adicional:?\**.*|El número.*que ves.*es.*número de línea.*', re.IGNORECASE | re.DOTALL)
+JSON_FIELD_NOISE_PATTERN = re.compile(r'"[^"\n]{1,40}"\s*:\s*(?:"[^"]*"|\[[^\]]*\]|[^,}\n]*)[,}]?')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Nombres de campo normalizados (minúsculas, sin tildes, "_" como espacio)
+STOP_KEYS = ('stop number', 'numero de parada', 'parada')
+DESCRIPTION_KEYS = ('descripcion de la incidencia', 'description', 'descripcion', 'incidencia')
+
+# Valores que el modelo usa para "sin dato"
+NULL_VALUES = {'', 'null', 'none', 'n/a', 'texto en español', 'texto en espanol'}
+
+# Frases con las que el modelo indica que no ha podido ver la imagen
+REFUSAL_PHRASES = (
+    'necesito una descripción de la imagen',
+    'necesito una descripción',
+    'no puedo ver la imagen',
+    'no tengo acceso a la imagen',
+    'la imagen no está disponible',
+    'no puedo analizar la imagen',
+    'proporciona la descripción',
+    'esperaré tu texto',
+    'sin información disponible'
+)
+
+class JsonObjectScanner:
+    """
+    Localiza los objetos JSON de primer nivel de un texto que puede llegar por trozos
+
+    Solo se detiene en llaves, comillas y barras invertidas, por lo que recorre
+    la respuesta una única vez sin backtracking. Si el texto termina con un
+    objeto sin cerrar, partial() devuelve lo recibido de él.
+    """
+
+    def __init__(self):
+        self.objects = []
+        self._parts = []
+        self._depth = 0
+        self._in_string = False
+        self._skip_next = False
+
+    def feed(self, chunk):
+        """Procesa el siguiente trozo de texto"""
+        position = 1 if self._skip_next and chunk else 0
+        if position:
+            self._skip_next = False
+        segment_start = 0
+        length = len(chunk)
+        while position < length:
+            if self._depth == 0:
+                start = chunk.find('{', position)
+                if start < 0:
+                    return
+                self._depth = 1
+                self._parts = []
+                segment_start = start
+                position = start + 1
+                continue
+
+            match = JSON_SIGNIFICANT.search(chunk, position)
+            if match is None:
+                break
+            char = match.group(0)
+            position = match.end()
+            if self._in_string:
+                if char == '\\':
+                    # Saltar el carácter escapado (puede estar en el siguiente trozo)
+                    position += 1
+                    if position > length:
+                        self._skip_next = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(chunk[segment_start:position])
+                    self.objects.append(''.join(self._parts))
+
+        if self._depth > 0:
+            self._parts.append(chunk[segment_start:])
+
+    def partial(self):
+        """
+        Objeto sin cerrar al final del texto, completado lo justo para poder parsearlo
+
+        Returns:
+            str: JSON reparado, o None si no hay objeto abierto
+        """
+        if self._depth == 0:
+            return None
+        text = ''.join(self._parts)
+        if self._in_string:
+            text += '"'
+        text = text.rstrip().rstrip(',')
+        if text.endswith(':'):
+            text += ' null'
+        return text + '}' * self._depth
+
+def normalize_key(key):
+    """Nombre de campo en minúsculas, sin tildes y con espacios en lugar de "_" """
+    decomposed = unicodedata.normalize('NFKD', str(key).lower().replace('_', ' '))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).strip()
+
+def clean_value(value):
+    """Valor de texto limpio, o None si está vacío o es un marcador de "sin dato" """
+    if value is None or isinstance(value, (dict, list, bool)):
+        return None
+    value = WHITESPACE_PATTERN.sub(' ', str(value)).strip()
+    return None if value.lower() in NULL_VALUES else value
+
+def normalize_stop_number(value):
+    """Código de parada sin espacios y con la P inicial (625 → P625)"""
+    value = clean_value(value)
+    if not value:
+        return None
+    value = value.replace(' ', '').upper()
+    return value if value.startswith('P') else f'P{value}'
+
+def find_stop_code(text):
+    """Primer código P + 3 o más cifras del texto, o None"""
+    match = STOP_CODE_PATTERN.search(text)
+    return f'P{match.group(1)}' if match else None
+
+def clean_description(text):
+    """Quita notas añadidas por el modelo y campos JSON sueltos de una descripción"""
+    text = DESCRIPTION_NOISE_PATTERN.sub('', text)
+    text = JSON_FIELD_NOISE_PATTERN.sub('', text)
+    return WHITESPACE_PATTERN.sub(' ', text).strip(' {}\n')
+
+class ParsedResponse:
+    """
+    Resultado de interpretar una respuesta de LM Studio
+
+    source indica de dónde salieron los datos: 'json', 'partial_json'
+    (JSON truncado o mal formado), 'markdown', 'text' o 'none'.
+    """
+
+    def __init__(self, stop_number, description, source, refusal=False):
+        self.stop_number = stop_number
+        self.description = description
+        self.source = source
+        self.refusal = refusal
+
+    @property
+    def has_json(self):
+        return self.source in ('json', 'partial_json')
+
+    def to_dict(self):
+        return {
+            'stop_number': self.stop_number,
+            'description': self.description,
+            'source': self.source
+        }
+
+def _fields_from_dict(data):
+    """(parada, descripción) de un dict con cualquiera de los nombres de campo conocidos"""
+    fields = {normalize_key(key): value for key, value in data.items()}
+    stop_number = next((fields[key] for key in STOP_KEYS if clean_value(fields.get(key))), None)
+    description = next((fields[key] for key in DESCRIPTION_KEYS if clean_value(fields.get(key))), None)
+    return stop_number, description
+
+def _fields_from_text(text):
+    """(parada, descripción) de un JSON que no se puede parsear, campo a campo"""
+    stop_match = STOP_FIELD_PATTERN.search(text)
+    description_match = DESCRIPTION_FIELD_PATTERN.search(text)
+    stop_number = stop_match.group(1) if stop_match else None
+    description = description_match.group(1).replace('\\n', ' ').replace('\\"', '"') if description_match else None
+    return stop_number, description
+
+def _extract_json_fields(content):
+    """
+    Busca el JSON de la respuesta y extrae sus campos
+
+    Returns:
+        tuple: (parada, descripción, origen) u (None, None, None) si no hay JSON con datos
+    """
+    scanner = JsonObjectScanner()
+    scanner.feed(content)
+
+    unparsed = []
+    for text in scanner.objects:
+        if ':' not in text:
+            # Llaves de texto libre ("{paso}"), no es JSON con campos
+            continue
+        try:
+            data = json.loads(text)
+        except ValueError:
+            unparsed.append(text)
+            continue
+        if isinstance(data, dict):
+            stop_number, description = _fields_from_dict(data)
+            if stop_number is not None or description is not None:
+                return stop_number, description, 'json'
+
+    partial = scanner.partial()
+    if partial:
+        try:
+            data = json.loads(partial)
+            if isinstance(data, dict):
+                stop_number, description = _fields_from_dict(data)
+                if stop_number is not None or description is not None:
+                    return stop_number, description, 'partial_json'
+        except ValueError:
+            unparsed.append(partial)
+
+    for text in unparsed:
+        stop_number, description = _fields_from_text(text)
+        if stop_number or description:
+            return stop_number, description, 'partial_json'
+    return None, None, None
+
+def parse_lm_response(content, default_description='Sin incidencia visible'):
+    """
+    Interpreta la respuesta de texto del modelo
+
+    Args:
+        content (str): Contenido del mensaje de LM Studio
+        default_description (str): Descripción cuando no se encuentra ninguna
+
+    Returns:
+        ParsedResponse: Número de parada (con P inicial) y descripción
+    """
+    content = content or ''
+    stop_number, description, source = _extract_json_fields(content)
+
+    if source:
+        stop_number = normalize_stop_number(stop_number) or find_stop_code(content)
+        description = clean_value(description)
+        description = clean_description(description) if description else None
+    else:
+        markdown_stop = MARKDOWN_STOP_PATTERN.search(content)
+        markdown_description = MARKDOWN_DESCRIPTION_PATTERN.search(content)
+        if markdown_stop or markdown_description:
+            source = 'markdown'
+            stop_number = normalize_stop_number(markdown_stop.group(1)) if markdown_stop else find_stop_code(content)
+            description = clean_description(markdown_description.group(1)) if markdown_description else None
+        else:
+            stop_number = find_stop_code(content)
+            source = 'text' if stop_number else 'none'
+            description = clean_description(STOP_CODE_PATTERN.sub('', content)) if content.strip() else None
+
+    refusal = False
+    if source == 'none':
+        content_lower = content.lower()
+        refusal = any(phrase in content_lower for phrase in REFUSAL_PHRASES)
+
+    if not description or len(description) < 5:
+        description = default_description
+    return ParsedResponse(stop_number, description, source, refusal)
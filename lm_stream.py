@@ -0,0 +1,130 @@
+"""
+Módulo para las respuestas en streaming de LM Studio (`stream: true`): lee
+los eventos SSE de chat/completions, extrae el número de parada y la
+descripción a medida que el modelo los escribe y mide el tiempo hasta el
+primer token.
+"""
+
+import json
+import re
+import threading
+
+from lm_response_parser import DESCRIPTION_FIELD_PATTERN, normalize_stop_number
+
+# Parada completa en el texto recibido hasta ahora: el valor ya tiene su
+# comilla de cierre, o el código va seguido de algo que no es una cifra
+STREAM_STOP_FIELD_PATTERN = re.compile(
+    r'"(?:stop_number|n[uú]mero[ _]de[ _]parada|parada)"\s*:\s*(?:"([^"\n]+)"|(\d+)\s*[,}\n])', re.IGNORECASE)
+STREAM_STOP_CODE_PATTERN = re.compile(r'\bP\s*(\d{3,})(?=\D)', re.IGNORECASE)
+
+def iter_completion_deltas(response):
+    """
+    Recorre una respuesta de chat/completions con stream: true
+
+    Args:
+        response: Respuesta de requests abierta con stream=True
+
+    Yields:
+        str: Cada trozo de texto (delta.content) que envía el modelo
+    """
+    # text/event-stream sin charset: requests usaría ISO-8859-1
+    response.encoding = 'utf-8'
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            break
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            continue
+        choices = chunk.get('choices') or [{}]
+        content = (choices[0].get('delta') or {}).get('content')
+        if content:
+            yield content
+
+def format_sse(event, data):
+    """Evento Server-Sent Events con datos JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class StreamingResponseParser:
+    """
+    Extrae la parada y la descripción mientras llega la respuesta
+
+    feed() devuelve True cuando cambia alguno de los dos valores, para enviar
+    al navegador un resultado parcial. El resultado final se obtiene con
+    parse_lm_response sobre el texto completo (content).
+    """
+
+    def __init__(self):
+        self._parts = []
+        self.content = ''
+        self.stop_number = None
+        self.description = None
+
+    def feed(self, delta):
+        self._parts.append(delta)
+        self.content = ''.join(self._parts)
+        changed = False
+
+        if self.stop_number is None:
+            field = STREAM_STOP_FIELD_PATTERN.search(self.content)
+            if field:
+                stop_number = normalize_stop_number(field.group(1) or field.group(2))
+            else:
+                code = STREAM_STOP_CODE_PATTERN.search(self.content)
+                stop_number = f'P{code.group(1)}' if code else None
+            if stop_number:
+                self.stop_number = stop_number
+                changed = True
+
+        description = DESCRIPTION_FIELD_PATTERN.search(self.content)
+        if description:
+            text = description.group(1).replace('\\n', ' ').replace('\\"', '"').rstrip('\\').strip()
+            if text and text != self.description:
+                self.description = text
+                changed = True
+        return changed
+
+    def partial(self):
+        return {'stop_number': self.stop_number, 'description': self.description}
+
+class StreamMetrics:
+    """Tiempo hasta el primer token y duración total de las respuestas en streaming"""
+
+    def __init__(self):
+        self.requests = 0
+        self.first_tokens = 0
+        self.total_first_token = 0.0
+        self.total_duration = 0.0
+        self.last_first_token = None
+        self.max_first_token = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, first_token, duration):
+        """
+        Registra una respuesta
+
+        Args:
+            first_token (float): Segundos hasta el primer token (None si no llegó ninguno)
+            duration (float): Segundos hasta el final de la respuesta
+        """
+        with self._lock:
+            self.requests += 1
+            self.total_duration += duration
+            if first_token is not None:
+                self.first_tokens += 1
+                self.total_first_token += first_token
+                self.last_first_token = first_token
+                self.max_first_token = max(self.max_first_token, first_token)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'avg_time_to_first_token': round(self.total_first_token / self.first_tokens, 3) if self.first_tokens else 0.0,
+                'last_time_to_first_token': round(self.last_first_token, 3) if self.last_first_token is not None else None,
+                'max_time_to_first_token': round(self.max_first_token, 3),
+                'avg_duration': round(self.total_duration / self.requests, 3) if self.requests else 0.0
+            }
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Script para importar los archivos mobile_storage_<device_id>.json de versiones
+anteriores a la base de datos del almacenamiento móvil
+(MOBILE_STORAGE_CONFIG['sqlite_file']).
+
+Los dispositivos que ya están en la base de datos no se sobrescriben. Con
+--delete se borran los archivos JSON importados (o ya presentes en la base
+de datos); sin él se conservan.
+
+Uso: python migrate_mobile_storage.py [carpeta] [--delete]
+"""
+
+import glob
+import json
+import os
+import sys
+
+from config import MOBILE_STORAGE_CONFIG
+from mobile_storage import MobileStorageDatabase
+
+FILE_PREFIX = 'mobile_storage_'
+FILE_SUFFIX = '.json'
+
+def device_id_from_path(path):
+    """ID del dispositivo a partir del nombre del archivo"""
+    return os.path.basename(path)[len(FILE_PREFIX):-len(FILE_SUFFIX)]
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    delete_files = '--delete' in sys.argv
+    folder = args[0] if args else '.'
+
+    database = MobileStorageDatabase(MOBILE_STORAGE_CONFIG['sqlite_file'])
+    paths = sorted(glob.glob(os.path.join(folder, f'{FILE_PREFIX}*{FILE_SUFFIX}')))
+
+    print(f"📦 Importando almacenamiento móvil a {database.db_path}")
+    print(f"📁 {len(paths)} archivos en {os.path.abspath(folder)}")
+    print("=" * 50)
+
+    imported = skipped = failed = deleted = 0
+    for path in paths:
+        device_id = device_id_from_path(path)
+        if database.exists(device_id):
+            print(f"⏭️ {device_id}: ya está en la base de datos")
+            skipped += 1
+        else:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                database.save(device_id, data)
+                user = ((data.get('user_session') or {}).get('user') or {}).get('username', 'sin sesión')
+                print(f"✅ {device_id}: importado ({user})")
+                imported += 1
+            except (OSError, ValueError) as e:
+                print(f"❌ {device_id}: {e}")
+                failed += 1
+                continue
+
+        if delete_files:
+            os.remove(path)
+            deleted += 1
+
+    print("=" * 50)
+    print(f"📊 Importados: {imported}, ya existentes: {skipped}, con error: {failed}, archivos borrados: {deleted}")
+    print(f"📊 Dispositivos en la base de datos: {database.count()}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,168 @@
 Módulo para manejar almacenamiento local en el móvil
 """
 
+import copy
 import json
 import os
+import sqlite3
+import tempfile
+import threading
 from datetime import datetime, timedelta
 
+def get_user_id_from_data(data):
+    """ID del usuario con sesión guardada en los datos de un dispositivo, o None"""
+    user_session = data.get('user_session') or {}
+    return (user_session.get('user') or {}).get('_id')
+
+def write_json_atomic(path, data):
+    """
+    Escribe un archivo JSON de forma atómica
+
+    Se escribe en un archivo temporal de la misma carpeta, se fuerza a disco
+    (fsync) y se renombra sobre el original: quien lea el archivo ve la
+    versión anterior o la nueva completa, nunca una a medias.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.json', dir=folder)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    # Guardar también la entrada de la carpeta (el renombrado); no existe en Windows
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+class MobileStorageDatabase:
+    """
+    Almacenamiento móvil de todos los dispositivos en un único archivo SQLite
+
+    Cada dispositivo es una fila (upsert atómico), con índices por ID de
+    dispositivo y por ID de usuario, en lugar de un archivo JSON por dispositivo.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS mobile_storage (
+                device_id TEXT PRIMARY KEY,
+                user_id TEXT,
+                data TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_mobile_storage_user ON mobile_storage (user_id)')
+
+    def load(self, device_id):
+        """Datos de un dispositivo, o None si no tiene"""
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM mobile_storage WHERE device_id = ?', (device_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, device_id, data):
+        """Guarda (inserta o reemplaza) los datos de un dispositivo en una sola sentencia"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO mobile_storage (device_id, user_id, data, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(device_id) DO UPDATE SET user_id = excluded.user_id, data = excluded.data, '
+                'updated_at = excluded.updated_at',
+                (device_id, get_user_id_from_data(data), json.dumps(data, ensure_ascii=False),
+                 datetime.now().isoformat())
+            )
+
+    def exists(self, device_id):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT 1 FROM mobile_storage WHERE device_id = ?', (device_id,)).fetchone() is not None
+
+    def delete(self, device_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM mobile_storage WHERE device_id = ?', (device_id,))
+
+    def find_devices_by_user(self, user_id):
+        """IDs de los dispositivos con sesión guardada del usuario"""
+        with self._lock:
+            rows = self._conn.execute('SELECT device_id FROM mobile_storage WHERE user_id = ?', (user_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def data_size(self, device_id):
+        """Bytes que ocupan los datos de un dispositivo"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT length(data) FROM mobile_storage WHERE device_id = ?', (device_id,)).fetchone()
+        return row[0] if row else 0
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM mobile_storage').fetchone()[0]
+
+def create_mobile_storage_database(config):
+    """
+    Crea la base de datos del almacenamiento móvil según la configuración
+
+    Args:
+        config (dict): MOBILE_STORAGE_CONFIG
+
+    Returns:
+        MobileStorageDatabase: None si 'backend' es 'json' (un archivo por dispositivo)
+    """
+    if config['backend'] == 'sqlite':
+        return MobileStorageDatabase(config['sqlite_file'])
+    return None
+
 class MobileStorage:
-    def __init__(self, storage_file='mobile_storage.json'):
+    def __init__(self, storage_file='mobile_storage.json', database=None, device_id=None, writer=None):
+        """
+        Args:
+            storage_file (str): Archivo JSON del dispositivo (sin database, o para importarlo a ella)
+            database (MobileStorageDatabase): Base de datos compartida; None = usar storage_file
+            device_id (str): ID del dispositivo en la base de datos
+            writer (WriteBehindBuffer): Escrituras diferidas; None = escribir en cada save_data.
+                No usar con una database compartida por varios procesos: cada uno escribiría su
+                copia completa y se perderían los cambios de los demás
+        """
         self.storage_file = storage_file
+        self.database = database
+        self.device_id = device_id
+        self.writer = writer
+        self.dirty = False  # Hay cambios sin guardar
         self.data = self.load_data()
     
+    @property
+    def storage_key(self):
+        """Clave del dispositivo en las escrituras diferidas"""
+        if self.database is not None:
+            return f'db:{self.device_id}'
+        return f'file:{os.path.abspath(self.storage_file)}'
+    
     def load_data(self):
         """Carga los datos del almacenamiento local"""
+        if self.writer is not None:
+            # Cambios aún no escritos (de esta u otra instancia del mismo dispositivo)
+            pending = self.writer.get_pending(self.storage_key)
+            if pending is not None:
+                return copy.deepcopy(pending)
+        if self.database is not None:
+            return self.load_from_database()
         try:
             if os.path.exists(self.storage_file):
                 with open(self.storage_file, 'r', encoding='utf-8') as f:
@@ -26,6 +177,24 @@ class MobileStorage:
             print(f"⚠️ Error al cargar almacenamiento local: {e}")
             return self.get_default_data()
     
+    def load_from_database(self):
+        """Carga los datos del dispositivo desde la base de datos"""
+        try:
+            data = self.database.load(self.device_id)
+            if data is not None:
+                return data
+            # Dispositivo con archivo JSON de una versión anterior: se importa la primera vez
+            if self.storage_file and os.path.exists(self.storage_file):
+                with open(self.storage_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.database.save(self.device_id, data)
+                print(f"📦 {self.storage_file} importado a la base de datos del almacenamiento móvil")
+                return data
+            return self.get_default_data()
+        except Exception as e:
+            print(f"⚠️ Error al cargar almacenamiento local de {self.device_id}: {e}")
+            return self.get_default_data()
+    
     def get_default_data(self):
         """Retorna la estructura de datos por defecto"""
         return {
@@ -41,20 +210,37 @@ class MobileStorage:
         }
     
     def save_data(self):
-        """Guarda los datos en el almacenamiento local"""
+        """
+        Guarda los datos en el almacenamiento local si hay cambios (dirty)
+
+        Con writer la escritura se hace en segundo plano y varios cambios
+        seguidos se guardan juntos; sin él se escribe en el momento.
+        """
+        if not self.dirty:
+            return True
         try:
             # Actualizar timestamp de modificación
             self.data['last_modified'] = datetime.now().isoformat()
             
-            with open(self.storage_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=2, ensure_ascii=False)
-            
-            print(f"💾 Datos guardados en almacenamiento local: {self.storage_file}")
+            if self.writer is not None:
+                self.writer.schedule(self.storage_key, copy.deepcopy(self.data), self.write_data)
+            else:
+                self.write_data(self.data)
+            self.dirty = False
             return True
         except Exception as e:
             print(f"❌ Error al guardar almacenamiento local: {e}")
             return False
     
+    def write_data(self, data):
+        """Escribe los datos en la base de datos o, de forma atómica, en el archivo JSON"""
+        if self.database is not None:
+            self.database.save(self.device_id, data)
+            print(f"💾 Datos guardados en almacenamiento local: {self.device_id}")
+        else:
+            write_json_atomic(self.storage_file, data)
+            print(f"💾 Datos guardados en almacenamiento local: {self.storage_file}")
+    
     def save_user_session(self, user_data, access_token, token_expiry):
         """
         Guarda la sesión del usuario
@@ -73,6 +259,7 @@ class MobileStorage:
             }
             
             self.data['last_login'] = datetime.now().isoformat()
+            self.dirty = True
             
             if self.save_data():
                 print(f"✅ Sesión de usuario guardada: {user_data.get('username', 'Usuario')}")
@@ -111,7 +298,10 @@ class MobileStorage:
     
     def clear_user_session(self):
         """Limpia la sesión del usuario"""
+        if self.data.get('user_session') is None:
+            return
         self.data['user_session'] = None
+        self.dirty = True
         self.save_data()
         print("🗑️ Sesión de usuario limpiada")
     
@@ -124,6 +314,7 @@ class MobileStorage:
         """
         self.data['users_list'] = users_list
         self.data['users_last_update'] = datetime.now().isoformat()
+        self.dirty = True
         
         if self.save_data():
             print(f"✅ Lista de usuarios guardada: {len(users_list)} usuarios")
@@ -162,7 +353,11 @@ class MobileStorage:
             key (str): Clave de la configuración
             value: Valor de la configuración
         """
+        settings = self.data['app_settings']
+        if key in settings and settings[key] == value:
+            return
         self.data['app_settings'][key] = value
+        self.dirty = True
         self.save_data()
         print(f"⚙️ Configuración actualizada: {key} = {value}")
     
@@ -220,9 +415,15 @@ class MobileStorage:
         Returns:
             dict: Información del almacenamiento
         """
+        if self.database is not None:
+            storage_file = self.database.db_path
+            file_size = self.database.data_size(self.device_id)
+        else:
+            storage_file = self.storage_file
+            file_size = os.path.getsize(self.storage_file) if os.path.exists(self.storage_file) else 0
         return {
-            'storage_file': self.storage_file,
-            'file_size': os.path.getsize(self.storage_file) if os.path.exists(self.storage_file) else 0,
+            'storage_file': storage_file,
+            'file_size': file_size,
             'created_at': self.data.get('created_at'),
             'last_modified': self.data.get('last_modified'),
             'user_logged_in': self.is_user_logged_in(),
@@ -0,0 +1,90 @@
+"""
+Módulo para la caché de resultados de IA (LM Studio y Whisper) por hash del
+contenido: la misma foto o la misma nota de voz reenviada tras un fallo de
+red devuelve el resultado anterior sin volver a ejecutar el modelo.
+"""
+
+import hashlib
+import threading
+
+from task_cache import MemoryCacheBackend, SQLiteCacheBackend
+
+class ResultCache:
+    """
+    Caché de resultados por SHA-256 del contenido y la versión del modelo/prompt
+
+    La versión forma parte de la clave, así que al cambiar de modelo o de
+    prompt las entradas antiguas dejan de coincidir sin tener que borrarlas.
+    """
+
+    def __init__(self, backend, ttl=86400, enabled=True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(kind, media_bytes, version):
+        """
+        Clave de caché de un contenido
+
+        Args:
+            kind (str): Tipo de resultado ('image', 'audio')
+            media_bytes (bytes): Contenido ya decodificado (sin data URL ni base64)
+            version (str): Modelo, prompt y parámetros que afectan al resultado
+        """
+        digest = hashlib.sha256()
+        digest.update(f'{kind}|{version}|'.encode('utf-8'))
+        digest.update(media_bytes)
+        return f'{kind}:{digest.hexdigest()}'
+
+    def get(self, kind, key):
+        """
+        Obtiene un resultado de la caché
+
+        Returns:
+            dict: Copia del resultado guardado, o None si no está (o la caché está desactivada)
+        """
+        if not self.enabled:
+            return None
+        result = self.backend.get(key)
+        with self._lock:
+            counter = self.misses if result is None else self.hits
+            counter[kind] = counter.get(kind, 0) + 1
+        return dict(result) if result is not None else None
+
+    def set(self, key, result):
+        """Guarda un resultado (dict serializable a JSON)"""
+        if self.enabled:
+            self.backend.set(key, result, self.ttl)
+
+    def get_stats(self):
+        """
+        Contadores de la caché
+
+        Returns:
+            dict: Backend, tamaño y aciertos/fallos por tipo de resultado
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'backend': type(self.backend).__name__,
+                'size': self.backend.size(),
+                'hits': dict(self.hits),
+                'misses': dict(self.misses)
+            }
+
+def create_result_cache(config):
+    """
+    Crea la caché de resultados de IA según la configuración
+
+    Args:
+        config (dict): AI_RESULT_CACHE_CONFIG ('backend' es 'memory' o 'sqlite' para persistir en disco)
+    """
+    if config['backend'] == 'sqlite':
+        backend = SQLiteCacheBackend(config['sqlite_file'], config['max_entries'])
+    else:
+        backend = MemoryCacheBackend(config['max_entries'])
+    return ResultCache(backend, ttl=config['ttl'], enabled=config['enabled'])
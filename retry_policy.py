@@ -0,0 +1,291 @@
+"""
+Módulo con la política de reintentos compartida para los servicios externos:
+backoff exponencial con jitter, plazo máximo por petición, presupuesto global
+de reintentos, circuit breaker por servicio e idempotencia de las subidas.
+"""
+
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from config import RETRY_CONFIG
+
+class RetryableError(Exception):
+    """Error que indica que la operación puede reintentarse (p. ej. respuesta 5xx)"""
+    pass
+
+class CircuitOpenError(Exception):
+    """El servicio está marcado como caído y no se le envían peticiones"""
+    pass
+
+class RetryError(Exception):
+    """La operación falló después de agotar los intentos, el plazo o el presupuesto"""
+
+    def __init__(self, message, last_error=None):
+        super().__init__(message)
+        self.last_error = last_error
+
+class RetryBudget:
+    """
+    Presupuesto global de reintentos (token bucket)
+
+    Cada petición aporta `ratio` fichas y cada reintento consume una, de forma
+    que los reintentos no pueden superar ese porcentaje del tráfico cuando un
+    servicio está caído.
+    """
+
+    def __init__(self, ratio=0.2, max_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.retries_denied = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        """Registra una petición nueva"""
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        """Intenta consumir una ficha para un reintento"""
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.retries_denied += 1
+            return False
+
+class CircuitBreaker:
+    """
+    Circuit breaker de un servicio
+
+    Tras `failure_threshold` fallos seguidos se abre y rechaza las peticiones
+    durante `reset_timeout` segundos; después deja pasar una de prueba. Si la
+    prueba no informa de su resultado en `reset_timeout` segundos se da por
+    perdida y se deja pasar otra.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Indica si se puede enviar una petición al servicio"""
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = 'half_open'
+                self.probe_started_at = time.monotonic()
+                print(f"🔌 Circuito {self.name}: probando de nuevo el servicio")
+                return True
+            if self.state == 'half_open':
+                # Solo una petición de prueba a la vez, salvo que la anterior no haya respondido
+                if time.monotonic() - self.probe_started_at < self.reset_timeout:
+                    return False
+                self.probe_started_at = time.monotonic()
+                print(f"🔌 Circuito {self.name}: la prueba anterior no respondió, probando otra vez")
+                return True
+            return True
+
+    def record_success(self):
+        """Registra una respuesta correcta"""
+        with self._lock:
+            if self.state != 'closed':
+                print(f"✅ Circuito {self.name}: servicio recuperado")
+            self.state = 'closed'
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started_at = None
+
+    def record_failure(self):
+        """Registra un fallo del servicio"""
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print(f"⛔ Circuito {self.name} abierto tras {self.failures} fallo(s)")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.probe_started_at = None
+
+    def release_probe(self):
+        """
+        Libera la petición de prueba sin contar un resultado (el error no venía
+        del servicio): el circuito vuelve a abierto y la siguiente petición prueba
+        """
+        with self._lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+                self.probe_started_at = None
+
+    def get_status(self):
+        """Estado actual del circuito"""
+        return {
+            'state': self.state,
+            'failures': self.failures
+        }
+
+class RetryPolicy:
+    """Política de reintentos de una operación contra un servicio externo"""
+
+    def __init__(self, name, breaker, budget, max_attempts=3, base_delay=0.5, max_delay=4,
+                 deadline=45, attempt_timeout=30):
+        self.name = name
+        self.breaker = breaker
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+
+    def get_delay(self, attempt):
+        """Backoff exponencial con jitter completo para el intento indicado (1, 2, ...)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def execute(self, operation):
+        """
+        Ejecuta una operación con reintentos
+
+        Args:
+            operation (callable): Función operation(timeout) que hace la petición.
+                Debe lanzar RetryableError (o un error de conexión/timeout de
+                requests) cuando el fallo se pueda reintentar. Solo esos errores
+                y los HTTPError 5xx cuentan como fallo del servicio en el circuito;
+                un HTTPError 4xx cuenta como respuesta correcta del servicio.
+
+        Returns:
+            El valor devuelto por la operación
+        """
+        deadline = time.monotonic() + self.deadline
+        self.budget.record_request()
+        last_error = None
+
+        for attempt in range(1, self.max_attempts + 1):
+            if not self.breaker.allow_request():
+                raise CircuitOpenError(f'Servicio {self.breaker.name} no disponible temporalmente (circuito abierto)')
+
+            remaining = deadline - time.monotonic()
+            try:
+                result = operation(min(self.attempt_timeout, remaining))
+                self.breaker.record_success()
+                return result
+            except (RetryableError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.breaker.record_failure()
+                last_error = e
+                print(f"⚠️ {self.name}: error en intento {attempt}/{self.max_attempts}: {str(e)}")
+            except requests.exceptions.HTTPError as e:
+                # El servicio respondió: un 4xx es un error de la petición, no una caída
+                status = e.response.status_code if e.response is not None else None
+                if status is not None and status < 500:
+                    self.breaker.record_success()
+                elif status is not None:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release_probe()
+                raise
+            except Exception:
+                # Error nuestro (JSON inválido, fallo de programación...): no cuenta como
+                # fallo del servicio, pero libera la prueba para no dejar el circuito a medias
+                self.breaker.release_probe()
+                raise
+
+            if attempt >= self.max_attempts:
+                break
+
+            delay = self.get_delay(attempt)
+            if time.monotonic() + delay >= deadline:
+                raise RetryError(f'{self.name}: plazo de {self.deadline}s agotado: {str(last_error)}', last_error)
+            if not self.budget.try_spend():
+                raise RetryError(f'{self.name}: presupuesto de reintentos agotado: {str(last_error)}', last_error)
+            time.sleep(delay)
+
+        raise RetryError(f'{self.name}: error después de {self.max_attempts} intentos: {str(last_error)}', last_error)
+
+class IdempotencyCache:
+    """
+    Resultados de las subidas ya completadas, por clave de idempotencia
+
+    Evita volver a guardar el mismo archivo cuando se reintenta una subida
+    que ya terminó (p. ej. al reintentar el envío de una incidencia).
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        """Clave de idempotencia a partir del contenido"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode('utf-8') if isinstance(part, str) else part)
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def remove_if(self, predicate):
+        """Elimina los resultados que cumplen la condición (p. ej. un archivo ya borrado)"""
+        with self._lock:
+            for key in [key for key, value in self._entries.items() if predicate(value)]:
+                del self._entries[key]
+
+# Presupuesto global y circuitos por servicio, compartidos por todas las políticas
+retry_budget = RetryBudget(RETRY_CONFIG['budget_ratio'], RETRY_CONFIG['budget_max_tokens'])
+_breakers = {}
+_policies = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(upstream):
+    """Obtiene el circuit breaker de un servicio"""
+    with _registry_lock:
+        if upstream not in _breakers:
+            _breakers[upstream] = CircuitBreaker(upstream, **RETRY_CONFIG['circuit_breaker'])
+        return _breakers[upstream]
+
+def get_policy(name):
+    """
+    Obtiene la política de reintentos configurada en RETRY_CONFIG['policies']
+
+    Args:
+        name (str): Nombre de la política (p. ej. 'base64_save')
+    """
+    if name not in _policies:
+        settings = dict(RETRY_CONFIG['policies'][name])
+        breaker = get_breaker(settings.pop('upstream'))
+        with _registry_lock:
+            _policies.setdefault(name, RetryPolicy(name, breaker, retry_budget, **settings))
+    return _policies[name]
+
+def get_retry_stats():
+    """Estado de los circuitos y del presupuesto de reintentos"""
+    return {
+        'budget_tokens': round(retry_budget.tokens, 2),
+        'retries_denied': retry_budget.retries_denied,
+        'circuits': {name: breaker.get_status() for name, breaker in list(_breakers.items())}
+    }
@@ -0,0 +1,170 @@
+"""
+Módulo para guardar las sesiones de los dispositivos (usuario y token de
+GTask) fuera del proceso: en memoria para una sola instancia o en un archivo
+SQLite compartido para varios workers o instancias. Cada sesión caduca por
+TTL desde su última actividad.
+"""
+
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class MemorySessionStore:
+    """
+    Sesiones en memoria del proceso (solo sirve con un único worker)
+
+    Las caducidades se indexan en un montículo (heap) con invalidación
+    perezosa: renovar una sesión solo cambia su caducidad en el diccionario y,
+    al limpiar, una entrada del montículo que ya no coincide se descarta (sesión
+    borrada) o se vuelve a insertar con la caducidad actual. La limpieza solo
+    recorre las entradas que han vencido, no todas las sesiones.
+    """
+
+    def __init__(self, touch_granularity=60):
+        self.touch_granularity = touch_granularity
+        self._sessions = {}  # {device_id: (expira_en, estado)}
+        self._expiry_heap = []  # [(expira_en, device_id)], puede tener entradas obsoletas
+        self._lock = threading.Lock()
+
+    def get(self, device_id):
+        with self._lock:
+            entry = self._sessions.get(device_id)
+            if entry is None:
+                return None
+            expires_at, state = entry
+            if time.time() >= expires_at:
+                del self._sessions[device_id]
+                return None
+            return json.loads(state)
+
+    def set(self, device_id, state, ttl):
+        # Se guarda serializado, igual que en SQLite, para no compartir objetos entre peticiones
+        expires_at = time.time() + ttl
+        with self._lock:
+            if device_id not in self._sessions:
+                heapq.heappush(self._expiry_heap, (expires_at, device_id))
+                self._compact_heap()
+            self._sessions[device_id] = (expires_at, json.dumps(state, ensure_ascii=False))
+
+    def touch(self, device_id, ttl):
+        """Alarga la caducidad de una sesión existente (como mucho una vez cada touch_granularity segundos)"""
+        expires_at = time.time() + ttl
+        with self._lock:
+            entry = self._sessions.get(device_id)
+            if entry is not None and expires_at - entry[0] >= self.touch_granularity:
+                self._sessions[device_id] = (expires_at, entry[1])
+
+    def _compact_heap(self):
+        """Reconstruye el montículo si acumula demasiadas entradas obsoletas (sesiones borradas)"""
+        if len(self._expiry_heap) > 2 * len(self._sessions) + 64:
+            self._expiry_heap = [(expires_at, device_id) for device_id, (expires_at, _) in self._sessions.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def delete(self, device_id):
+        with self._lock:
+            self._sessions.pop(device_id, None)
+
+    def purge_expired(self):
+        """Elimina las sesiones caducadas y devuelve cuántas había"""
+        now = time.time()
+        expired = 0
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                _, device_id = heapq.heappop(heap)
+                entry = self._sessions.get(device_id)
+                if entry is None:
+                    continue  # Sesión ya borrada
+                if entry[0] > now:
+                    # Renovada después de indexarla: vuelve al montículo con su caducidad actual
+                    heapq.heappush(heap, (entry[0], device_id))
+                    continue
+                del self._sessions[device_id]
+                expired += 1
+        return expired
+
+    def size(self):
+        return len(self._sessions)
+
+class SQLiteSessionStore:
+    """
+    Sesiones en un archivo SQLite compartido (modo WAL)
+
+    Todos los workers y las instancias de la misma máquina ven las mismas
+    sesiones, así que un dispositivo sigue logueado aunque su siguiente
+    petición la atienda otro proceso.
+    """
+
+    def __init__(self, db_path, touch_granularity=60):
+        self.db_path = db_path
+        self.touch_granularity = touch_granularity
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS device_sessions (
+                device_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_device_sessions_expiry ON device_sessions (expires_at)')
+
+    def get(self, device_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT state, expires_at FROM device_sessions WHERE device_id = ?', (device_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            if time.time() >= row[1]:
+                self._conn.execute('DELETE FROM device_sessions WHERE device_id = ?', (device_id,))
+                return None
+        return json.loads(row[0])
+
+    def set(self, device_id, state, ttl):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO device_sessions (device_id, state, expires_at) VALUES (?, ?, ?)',
+                (device_id, json.dumps(state, ensure_ascii=False), time.time() + ttl)
+            )
+
+    def touch(self, device_id, ttl):
+        """Alarga la caducidad de una sesión existente (como mucho una vez cada touch_granularity segundos)"""
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._conn.execute('UPDATE device_sessions SET expires_at = ? WHERE device_id = ? AND expires_at <= ?',
+                               (expires_at, device_id, expires_at - self.touch_granularity))
+
+    def delete(self, device_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM device_sessions WHERE device_id = ?', (device_id,))
+
+    def purge_expired(self):
+        """Elimina las sesiones caducadas (por índice) y devuelve cuántas había"""
+        with self._lock:
+            return self._conn.execute('DELETE FROM device_sessions WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM device_sessions').fetchone()[0]
+
+def create_session_store(config):
+    """
+    Crea el almacén de sesiones según la configuración
+
+    Args:
+        config (dict): SESSION_STORE_CONFIG ('backend' es 'memory' o 'sqlite' para compartirlo entre procesos)
+    """
+    if config['backend'] == 'sqlite':
+        return SQLiteSessionStore(config['sqlite_file'], touch_granularity=config['touch_granularity'])
+    return MemorySessionStore(touch_granularity=config['touch_granularity'])
@@ -0,0 +1,79 @@
+"""
+Módulo para agrupar peticiones concurrentes idénticas (single-flight):
+si varias peticiones piden lo mismo a la vez, solo una llega al servidor
+y el resto espera y recibe el mismo resultado.
+"""
+
+import threading
+
+class _Call:
+    """Petición en curso compartida por varios llamantes"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self, name='single-flight'):
+        self.name = name
+        self.requests = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self._calls = {}  # {clave: _Call}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        Ejecuta func() una sola vez para todas las llamadas concurrentes con la misma clave
+
+        Args:
+            key: Clave de la petición (p. ej. el QR ID)
+            func (callable): Función sin argumentos que hace la petición real
+
+        Returns:
+            El resultado de func(); los dict se copian para cada llamante que espera
+        """
+        with self._lock:
+            self.requests += 1
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.upstream_calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            print(f"🔗 {self.name}: esperando la petición en curso para {key}")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return dict(call.result) if isinstance(call.result, dict) else call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def get_stats(self):
+        """
+        Métricas de agrupación
+
+        Returns:
+            dict: Peticiones recibidas, llamadas reales y llamadas ahorradas
+        """
+        return {
+            'requests': self.requests,
+            'upstream_calls': self.upstream_calls,
+            'saved_calls': self.coalesced,
+            'in_flight': len(self._calls)
+        }
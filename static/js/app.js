@@ -1679,6 +1679,62 @@ async function uploadPhoto() {
 }
 
 // Procesar imagen con IA cuando no hay QR ni audio
+// Leer la respuesta SSE de /api/process-image-ai/stream
+// Los eventos 'partial' rellenan el formulario según llegan; devuelve el evento 'result' o 'error'
+async function readAIStream(response) {
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.includes('text/event-stream') || !response.body) {
+        // Errores de validación (400) y navegadores sin ReadableStream
+        return await response.json();
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let finalResult = null;
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let separator;
+        while ((separator = buffer.indexOf('\n\n')) >= 0) {
+            const frame = buffer.slice(0, separator);
+            buffer = buffer.slice(separator + 2);
+            
+            let eventName = 'message';
+            let data = '';
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (!data) continue;
+            
+            const payload = JSON.parse(data);
+            if (eventName === 'partial') {
+                showPartialAIResults(payload);
+            } else if (eventName === 'result' || eventName === 'error') {
+                finalResult = payload;
+            }
+        }
+    }
+    
+    return finalResult || { success: false, error: 'La conexión se cerró antes de recibir el resultado' };
+}
+
+// Mostrar en el formulario los resultados parciales del modelo
+function showPartialAIResults(partial) {
+    if (!elements.aiResultsForm) return;
+    elements.aiResultsForm.style.display = 'block';
+    if (partial.stop_number && elements.aiStopNumber) {
+        elements.aiStopNumber.value = String(partial.stop_number);
+    }
+    if (partial.description && elements.aiDescription) {
+        elements.aiDescription.value = String(partial.description);
+    }
+}
+
 async function processImageWithAI() {
     try {
         // Usar solo la foto principal para la IA
@@ -1705,7 +1761,8 @@ async function processImageWithAI() {
         console.log('📸 Primeros 100 caracteres:', photoForAI ? photoForAI.substring(0, 100) : 'N/A');
         //const timeoutId = setTimeout(() => controller.abort(), 200000);
         // Enviar imagen principal al backend para procesar con LM Studio
-        const response = await fetch('/api/process-image-ai', {
+        // Versión en streaming: los campos se rellenan mientras el modelo responde
+        const response = await fetch('/api/process-image-ai/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -1719,7 +1776,7 @@ async function processImageWithAI() {
         
         console.log('📡 Respuesta recibida del servidor, status:', response.status);
         
-        const result = await response.json();
+        const result = await readAIStream(response);
         
         if (!result.success) {
             showStatus('Error al procesar imagen con IA: ' + result.error, 'error');
@@ -1728,8 +1785,12 @@ async function processImageWithAI() {
             // Ocultar modal de procesamiento
             elements.aiProcessingStatus.style.display = 'none';
             
-            // Mostrar mensaje de error
-            alert('Error al procesar imagen con IA:\n' + result.error + '\n\nAsegúrate de que LM Studio esté corriendo en http://localhost:1234');
+            // Mostrar mensaje de error (503: LM Studio ocupado, el mensaje indica cuándo reintentar)
+            if (response.status === 503) {
+                alert('LM Studio está ocupado:\n' + result.error);
+            } else {
+                alert('Error al procesar imagen con IA:\n' + result.error + '\n\nAsegúrate de que LM Studio esté corriendo en http://localhost:1234');
+            }
             closeAIResultsModal();
             return;
         }
@@ -3974,16 +4035,24 @@ async function sendIncidenceFromPreview() {
 }
 
 // Verificar estado de la subida en segundo plano
+// Usa long-poll: el servidor mantiene la petición abierta hasta que el estado cambia
 async function checkUploadStatus(filename) {
-    let attempts = 0;
-    const maxAttempts = 60; // Máximo 5 minutos (60 * 5 segundos)
+    const deadline = Date.now() + 5 * 60 * 1000; // Máximo 5 minutos
+    let lastStatus = '';
+    let errors = 0;
     
-    const checkStatus = async () => {
+    while (Date.now() < deadline) {
         try {
-            const response = await fetch(`/api/upload-status/${filename}`);
+            const url = `/api/upload-status/${encodeURIComponent(filename)}?since=${encodeURIComponent(lastStatus)}&wait=25`;
+            const response = await fetch(url);
             const result = await response.json();
             
-            if (result.success && result.status === 'file_processed') {
+            if (!result.success) {
+                showStatus(result.message || 'No se encontró la subida', 'warning');
+                return;
+            }
+            
+            if (result.status === 'done') {
                 showStatus('Foto enviada a Business Central correctamente', 'success');
                 
                 // Limpiar datos
@@ -4005,32 +4074,33 @@ async function checkUploadStatus(filename) {
                     defaultImageContainer.style.display = 'block';
                 }
                 
-                return; // Salir del loop
+                return;
             }
             
-            attempts++;
-            if (attempts >= maxAttempts) {
-                showStatus('Tiempo de espera agotado. Verifica el estado manualmente.', 'warning');
+            if (result.status === 'failed') {
+                showStatus('Error al enviar a Business Central: ' + (result.error || 'Error desconocido'), 'error');
                 return;
             }
             
-            // Verificar nuevamente en 5 segundos
-            setTimeout(checkStatus, 5000);
+            if (result.status !== lastStatus) {
+                showStatus(result.message, 'info');
+            }
+            lastStatus = result.status;
+            errors = 0;
             
         } catch (error) {
             console.error('Error al verificar estado:', error);
-            attempts++;
-            
-            if (attempts < maxAttempts) {
-                setTimeout(checkStatus, 5000);
-            } else {
+            errors++;
+            if (errors >= 5) {
                 showStatus('Error al verificar estado de la subida', 'error');
+                return;
             }
+            // Esperar antes de reintentar tras un error de red
+            await new Promise(resolve => setTimeout(resolve, 5000));
         }
-    };
+    }
     
-    // Iniciar verificación
-    checkStatus();
+    showStatus('Tiempo de espera agotado. Verifica el estado manualmente.', 'warning');
 }
 
 // Detener cámara QR
@@ -4858,19 +4928,30 @@ function populateTaskList(tasks) {
     });
 }
 
+// Convertir una foto en data URL a Blob para enviarla en binario
+async function dataUrlToBlob(dataUrl) {
+    const response = await fetch(dataUrl);
+    return await response.blob();
+}
+
 // Seleccionar tarea
 async function selectTask(selectedTask) {
     try {
         showStatus('Procesando con la tarea seleccionada...', 'info');
         
-        // Enviar foto con la tarea seleccionada
+        // Enviar foto con la tarea seleccionada (imagen en binario, sin base64)
+        const formData = new FormData();
+        formData.append('image', await dataUrlToBlob(currentPhotoData), 'photo.jpg');
+        formData.append('qr_data', pendingQRData);
+        formData.append('selected_task', JSON.stringify(selectedTask));
+        formData.append('device_id', deviceId);
+        
         const response = await fetch('/api/process-photo-with-task', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/x-www-form-urlencoded',
                 'X-Device-ID': deviceId
             },
-            body: `image_data=${encodeURIComponent(currentPhotoData)}&qr_data=${pendingQRData}&selected_task=${encodeURIComponent(JSON.stringify(selectedTask))}&device_id=${deviceId}`
+            body: formData
         });
         
         const result = await response.json();
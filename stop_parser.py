@@ -0,0 +1,381 @@
+"""
+Módulo para extraer el número de parada (P1171) y la incidencia de una nota de
+voz transcrita con reglas precompiladas, incluida la conversión de números
+dichos en español a dígitos ("mil ciento setenta y uno" → 1171). El LLM solo
+se consulta cuando las reglas no dan un resultado fiable.
+"""
+
+import re
+import threading
+import time
+import unicodedata
+
+DEFAULT_DESCRIPTION = 'Incidencia reportada por audio'
+
+# Palabras numéricas (sin tildes): (tipo, valor)
+NUMBER_WORDS = {
+    'cero': ('zero', 0),
+    'uno': ('unit', 1), 'dos': ('unit', 2), 'tres': ('unit', 3), 'cuatro': ('unit', 4),
+    'cinco': ('unit', 5), 'seis': ('unit', 6), 'siete': ('unit', 7), 'ocho': ('unit', 8),
+    'nueve': ('unit', 9),
+    'diez': ('teen', 10), 'once': ('teen', 11), 'doce': ('teen', 12), 'trece': ('teen', 13),
+    'catorce': ('teen', 14), 'quince': ('teen', 15), 'dieciseis': ('teen', 16),
+    'diecisiete': ('teen', 17), 'dieciocho': ('teen', 18), 'diecinueve': ('teen', 19),
+    'veintiuno': ('teen', 21), 'veintiun': ('teen', 21), 'veintidos': ('teen', 22),
+    'veintitres': ('teen', 23), 'veinticuatro': ('teen', 24), 'veinticinco': ('teen', 25),
+    'veintiseis': ('teen', 26), 'veintisiete': ('teen', 27), 'veintiocho': ('teen', 28),
+    'veintinueve': ('teen', 29),
+    'veinte': ('ten', 20), 'treinta': ('ten', 30), 'cuarenta': ('ten', 40), 'cincuenta': ('ten', 50),
+    'sesenta': ('ten', 60), 'setenta': ('ten', 70), 'ochenta': ('ten', 80), 'noventa': ('ten', 90),
+    'cien': ('hundred', 100), 'ciento': ('hundred', 100), 'doscientos': ('hundred', 200),
+    'doscientas': ('hundred', 200), 'trescientos': ('hundred', 300), 'trescientas': ('hundred', 300),
+    'cuatrocientos': ('hundred', 400), 'cuatrocientas': ('hundred', 400), 'quinientos': ('hundred', 500),
+    'quinientas': ('hundred', 500), 'seiscientos': ('hundred', 600), 'seiscientas': ('hundred', 600),
+    'setecientos': ('hundred', 700), 'setecientas': ('hundred', 700), 'ochocientos': ('hundred', 800),
+    'ochocientas': ('hundred', 800), 'novecientos': ('hundred', 900), 'novecientas': ('hundred', 900),
+    'mil': ('thousand', 1000)
+}
+
+# "un"/"una" solo cuentan como número dentro de otro ("treinta y un")
+ARTICLE_NUMBERS = {'un': 1, 'una': 1}
+
+# Palabras que introducen el número de parada
+STOP_MARKERS = {'p', 'pe', 'parada'}
+
+# Palabras que pueden ir entre el marcador y el número ("parada número 1171")
+STOP_FILLERS = {'numero', 'num', 'n', 'no', 'de', 'la', 'el', 'es'}
+MAX_FILLERS = 2
+
+# Cifras que se unen como mucho al leer un número dicho por partes (P625, P1171)
+MAX_STOP_DIGITS = 4
+
+# Palabras delante del marcador que se quitan con él ("en la parada 625")
+MARKER_PREFIXES = {'en', 'la', 'de', 'el'}
+
+# Confianza de cada tipo de resultado
+CONFIDENCE_MARKED = 0.95  # Número precedido de P/parada
+CONFIDENCE_SPLIT = 0.7  # Número con P/parada seguido de otro que no se ha unido ("P1171 tres ...")
+CONFIDENCE_UNMARKED = 0.6  # Un único número de 3 o más cifras sin marcador
+CONFIDENCE_AMBIGUOUS = 0.4  # Varias paradas distintas
+CONFIDENCE_NONE = 0.0
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+GLUED_CODE_PATTERN = re.compile(r'^p(\d+)$')
+
+def normalize_word(word):
+    """Minúsculas y sin tildes"""
+    decomposed = unicodedata.normalize('NFKD', word.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+def tokenize(text):
+    """
+    Divide el texto en palabras
+
+    Returns:
+        list: (palabra original, palabra normalizada); "P1171" se separa en P + 1171
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        word = match.group(0)
+        normalized = normalize_word(word)
+        glued = GLUED_CODE_PATTERN.match(normalized)
+        if glued:
+            tokens.append((word[0], 'p'))
+            tokens.append((word[1:], glued.group(1)))
+        else:
+            tokens.append((word, normalized))
+    return tokens
+
+def _read_spoken_number(words, start):
+    """
+    Lee un número dicho con palabras ("mil ciento setenta y uno")
+
+    Returns:
+        tuple: (índice siguiente, valor); el índice es start si no hay número
+    """
+    thousands = 0
+    current = 0
+    last = None
+    index = start
+    while index < len(words):
+        word = words[index]
+        if word == 'y' and last == 'ten' and index + 1 < len(words):
+            following = words[index + 1]
+            if NUMBER_WORDS.get(following, (None,))[0] == 'unit' or following in ARTICLE_NUMBERS:
+                last = 'y'
+                index += 1
+                continue
+            break
+
+        if last == 'y' and word in ARTICLE_NUMBERS:
+            kind, value = 'unit', ARTICLE_NUMBERS[word]
+        elif word in NUMBER_WORDS:
+            kind, value = NUMBER_WORDS[word]
+        else:
+            break
+
+        if kind == 'zero':
+            if index == start:
+                return index + 1, 0
+            break
+        if kind == 'unit':
+            if not (last == 'y' or current % 100 == 0):
+                break
+        elif kind in ('teen', 'ten'):
+            if current % 100 != 0:
+                break
+        elif kind == 'hundred':
+            if current != 0:
+                break
+        elif kind == 'thousand':
+            if thousands:
+                break
+            thousands = max(current, 1) * 1000
+            current = 0
+            last = kind
+            index += 1
+            continue
+
+        current += value
+        last = kind
+        index += 1
+
+    return index, thousands + current
+
+def _starts_number(words, index, digits):
+    """Indica si en index empieza otro número del mismo tipo (dígitos o palabras)"""
+    if index >= len(words):
+        return False
+    if digits:
+        return words[index].isdigit()
+    return _read_spoken_number(words, index)[0] > index
+
+def _read_number_run(words, start):
+    """
+    Lee una secuencia de números seguidos y los concatena como cifras
+
+    "once setenta y uno", "uno uno siete uno" y "11 71" dan "1171". Solo se
+    unen grupos de una o dos cifras y hasta MAX_STOP_DIGITS cifras: un número
+    completo ("mil ciento setenta y uno", "1171") no se une con el siguiente,
+    que suele empezar la descripción ("... y uno tres farolas"). Una secuencia
+    es toda de dígitos o toda de palabras.
+
+    Returns:
+        tuple: (índice siguiente, cifras, cortada); cifras es None si no hay número
+            y cortada indica que detrás viene otro número que no se ha unido
+    """
+    digits = words[start].isdigit()
+    index = start
+    parts = []
+    length = 0
+    while index < len(words):
+        if digits:
+            if not words[index].isdigit():
+                break
+            following, group = index + 1, words[index]
+        else:
+            following, value = _read_spoken_number(words, index)
+            if following == index:
+                break
+            group = str(value)
+
+        complete = len(group) > 2
+        if parts and (complete or length + len(group) > MAX_STOP_DIGITS):
+            break
+        parts.append(group)
+        length += len(group)
+        index = following
+        if complete:
+            break
+
+    if not parts:
+        return index, None, False
+    return index, ''.join(parts), _starts_number(words, index, digits)
+
+def words_to_digits(text):
+    """
+    Convierte los números dichos con palabras en dígitos
+
+    Args:
+        text (str): Texto transcrito
+
+    Returns:
+        str: Texto con los números en cifras, sin puntuación
+    """
+    tokens = tokenize(text)
+    words = [normalized for _, normalized in tokens]
+    output = []
+    index = 0
+    while index < len(words):
+        following, digits, _ = _read_number_run(words, index)
+        if digits is None:
+            output.append(tokens[index][0])
+            index += 1
+        else:
+            output.append(digits)
+            index = following
+    return ' '.join(output)
+
+class StopParseResult:
+    """Resultado del parser de reglas"""
+
+    def __init__(self, stop_number, description, confidence):
+        self.stop_number = stop_number
+        self.description = description
+        self.confidence = confidence
+
+    def to_dict(self):
+        return {
+            'stop_number': self.stop_number,
+            'description': self.description
+        }
+
+def _find_marker(words, number_start):
+    """Indica dónde empieza el marcador (P/parada) que precede a un número, o None"""
+    index = number_start - 1
+    fillers = 0
+    while index >= 0:
+        if words[index] in STOP_MARKERS:
+            prefixes = 0
+            while index > 0 and words[index - 1] in MARKER_PREFIXES and prefixes < MAX_FILLERS:
+                index -= 1
+                prefixes += 1
+            return index
+        if words[index] not in STOP_FILLERS or fillers >= MAX_FILLERS:
+            return None
+        fillers += 1
+        index -= 1
+    return None
+
+def parse_stop_info(text):
+    """
+    Extrae el número de parada y la descripción con reglas
+
+    Args:
+        text (str): Texto transcrito
+
+    Returns:
+        StopParseResult: Con confianza CONFIDENCE_MARKED si el número va precedido
+            de "P" o "parada", menor si es ambiguo o no hay marcador
+    """
+    tokens = tokenize(text or '')
+    words = [normalized for _, normalized in tokens]
+
+    marked = []  # (inicio del marcador, fin del número, cifras, cortada)
+    unmarked = []
+    index = 0
+    while index < len(words):
+        following, digits, cut = _read_number_run(words, index)
+        if digits is None:
+            index += 1
+            continue
+        marker = _find_marker(words, index)
+        if marker is not None:
+            marked.append((marker, following, digits, cut))
+        elif len(digits) >= 3:
+            unmarked.append((index, following, digits, cut))
+        index = following
+
+    candidates = marked or unmarked
+    distinct = {digits for _, _, digits, _ in candidates}
+    if not candidates:
+        return StopParseResult(None, ' '.join(word for word, _ in tokens) or DEFAULT_DESCRIPTION, CONFIDENCE_NONE)
+
+    if len(distinct) > 1:
+        confidence = CONFIDENCE_AMBIGUOUS
+    elif marked:
+        # Si detrás viene otro número no se sabe si es parte del código: que decida el LLM
+        confidence = CONFIDENCE_SPLIT if candidates[0][3] else CONFIDENCE_MARKED
+    else:
+        confidence = CONFIDENCE_UNMARKED
+
+    start, end, digits, _ = candidates[0]
+    description = ' '.join(word for word, _ in tokens[:start] + tokens[end:])
+    return StopParseResult(f'P{digits}', description or DEFAULT_DESCRIPTION, confidence)
+
+class TieredStopExtractor:
+    """
+    Extractor por niveles: primero las reglas (milisegundos) y, solo si su
+    confianza no llega a min_confidence, el LLM
+
+    Cada resultado indica en 'tier' qué nivel respondió ('rules' o 'llm').
+    """
+
+    def __init__(self, llm_extract, min_confidence=0.8, llm_fallback=True):
+        self.llm_extract = llm_extract
+        self.min_confidence = min_confidence
+        self.llm_fallback = llm_fallback
+        self.requests = 0
+        self.tier_counts = {'rules': 0, 'llm': 0}
+        self.tier_time = {'rules': 0.0, 'llm': 0.0}
+        self._lock = threading.Lock()
+
+    def extract(self, text, llm_fallback=True):
+        """
+        Extrae el número de parada y la descripción
+
+        Args:
+            text (str): Texto transcrito
+            llm_fallback (bool): False = solo reglas en esta llamada (p. ej. si ya se
+                ocupa la plaza de LM Studio)
+
+        Returns:
+            dict: stop_number, description, tier, confidence y elapsed (segundos)
+        """
+        start = time.perf_counter()
+        parsed = parse_stop_info(text)
+        tier = 'rules'
+        result = parsed.to_dict()
+
+        if parsed.confidence < self.min_confidence and self.llm_fallback and llm_fallback:
+            print(f"🤔 Reglas con confianza baja ({parsed.confidence}): consultando al LLM")
+            llm_result = self.llm_extract(text)
+            # Sin respuesta válida del LLM se queda el resultado de las reglas
+            if isinstance(llm_result, dict) and llm_result and \
+                    (llm_result.get('stop_number') or not parsed.stop_number):
+                tier = 'llm'
+                result = llm_result
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.requests += 1
+            self.tier_counts[tier] += 1
+            self.tier_time[tier] += elapsed
+
+        print(f"🚏 Parada extraída por '{tier}' en {elapsed * 1000:.1f} ms: {result.get('stop_number')}")
+        return dict(result, tier=tier, confidence=parsed.confidence, elapsed=round(elapsed, 4))
+
+    def get_stats(self):
+        """
+        Contadores por nivel
+
+        Returns:
+            dict: Peticiones, respuestas de cada nivel y tiempo medio en ms
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'min_confidence': self.min_confidence,
+                'llm_fallback': self.llm_fallback,
+                'tiers': {
+                    tier: {
+                        'count': count,
+                        'avg_ms': round(self.tier_time[tier] / count * 1000, 2) if count else 0.0
+                    }
+                    for tier, count in self.tier_counts.items()
+                }
+            }
+
+def create_stop_extractor(config, llm_extract):
+    """
+    Crea el extractor por niveles según la configuración
+
+    Args:
+        config (dict): STOP_EXTRACTION_CONFIG
+        llm_extract (callable): Extracción con el LLM, recibe el texto y devuelve el dict
+    """
+    return TieredStopExtractor(
+        llm_extract,
+        min_confidence=config['min_confidence'],
+        llm_fallback=config['llm_fallback']
+    )
@@ -0,0 +1,197 @@
+"""
+Módulo para la caché de tareas de Business Central por QR ID
+(respuestas de GtaskMalla_devuelveidqr ya parseadas)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class MemoryCacheBackend:
+    """Caché en memoria del proceso con TTL y límite de tamaño (LRU)"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {clave: (expira_en, valor)}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+class SQLiteCacheBackend:
+    """
+    Caché compartida en un archivo SQLite (modo WAL)
+
+    Varios procesos o instancias de la aplicación en la misma máquina
+    comparten las entradas a través del archivo.
+    """
+
+    def __init__(self, db_path, max_entries=1000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_access ON cache (last_access)')
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if now >= row[1]:
+                self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                return None
+            self._conn.execute('UPDATE cache SET last_access = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), now + ttl, now)
+            )
+            # Mantener el límite eliminando las entradas caducadas y las menos usadas
+            self._conn.execute('DELETE FROM cache WHERE expires_at <= ?', (now,))
+            self._conn.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache')
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+class TaskCache:
+    """
+    Caché de listas de tareas por QR ID
+
+    Las listas vacías ("no hay tareas") se guardan con un TTL más corto
+    (caché negativa) para no consultar a BC en cada escaneo de una parada
+    sin tareas, pero enterarse pronto cuando se le asigne una.
+    """
+
+    def __init__(self, backend, ttl=300, negative_ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, qr_id):
+        """
+        Obtiene las tareas de un QR de la caché
+
+        Returns:
+            list: Tareas (puede ser una lista vacía cacheada) o None si no está en caché
+        """
+        tasks = self.backend.get(qr_id)
+        if tasks is None:
+            self.misses += 1
+            return None
+
+        if tasks:
+            self.hits += 1
+        else:
+            self.negative_hits += 1
+        return tasks
+
+    def set(self, qr_id, tasks):
+        """Guarda las tareas de un QR"""
+        self.backend.set(qr_id, tasks, self.ttl if tasks else self.negative_ttl)
+
+    def invalidate(self, qr_id=None):
+        """Elimina un QR de la caché, o toda la caché si no se indica"""
+        if qr_id is None:
+            self.backend.clear()
+        else:
+            self.backend.delete(qr_id)
+        self.invalidations += 1
+
+    def get_stats(self):
+        """
+        Contadores de la caché
+
+        Returns:
+            dict: Aciertos, fallos y tamaño actual
+        """
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'size': self.backend.size(),
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_ratio': round((self.hits + self.negative_hits) / lookups, 3) if lookups else 0.0
+        }
+
+def create_task_cache(config):
+    """
+    Crea la caché de tareas según la configuración
+
+    Args:
+        config (dict): TASK_CACHE_CONFIG ('backend' es 'memory' o 'sqlite')
+    """
+    if config['backend'] == 'sqlite':
+        backend = SQLiteCacheBackend(config['sqlite_file'], config['max_entries'])
+    else:
+        backend = MemoryCacheBackend(config['max_entries'])
+    return TaskCache(backend, ttl=config['ttl'], negative_ttl=config['negative_ttl'])
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para la cola de trabajos: un trabajo pendiente solo lo
+reclama un hilo, aunque varios procesos (varias instancias de JobQueue sobre
+la misma base de datos, como con varios workers de gunicorn) lo intenten a la vez
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from job_queue import JobQueue
+
+THREADS_PER_QUEUE = 8
+ROUNDS = 30  # Carreras repetidas: un fallo de atomicidad no siempre se ve en la primera
+
+def test_claim_is_exclusive():
+    """Muchos hilos de dos colas reclaman a la vez el único trabajo pendiente"""
+    print("🧪 Probando que un trabajo solo se reclama una vez...")
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Cambiar de hilo lo más a menudo posible para provocar la carrera
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            db_path = os.path.join(folder, 'jobs.db')
+            queues = [JobQueue(db_path, workers=0), JobQueue(db_path, workers=0)]
+            for queue in queues:
+                queue.register_handler('photo', lambda job_id, payload: {'success': True})
+
+            for round_number in range(ROUNDS):
+                job_id = f'job-{round_number}'
+                queues[0].enqueue('photo', {'filename': 'foto.jpg'}, job_id=job_id)
+                claims = race_claims(queues)
+                assert len(claims) == 1, f'{job_id} reclamado {len(claims)} veces'
+                job = queues[1].get_job(job_id)
+                assert job['state'] == 'running' and job['attempts'] == 1
+    finally:
+        sys.setswitchinterval(switch_interval)
+    print(f"   {ROUNDS} carreras, una reclamación en cada una")
+
+def race_claims(queues):
+    """Lanza THREADS_PER_QUEUE hilos por cola llamando a la vez a _claim_next"""
+    barrier = threading.Barrier(THREADS_PER_QUEUE * len(queues))
+    claims = []
+
+    def claim(queue):
+        barrier.wait()
+        job = queue._claim_next()
+        if job:
+            claims.append(job)
+
+    threads = [threading.Thread(target=claim, args=(queue,))
+               for queue in queues for _ in range(THREADS_PER_QUEUE)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return claims
+
+def test_job_runs_once():
+    """Dos colas con sus hilos de trabajo ejecutan el handler una sola vez"""
+    print("🧪 Probando que el handler se ejecuta una vez...")
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, 'jobs.db')
+        calls = []
+
+        def handler(job_id, payload):
+            calls.append(job_id)
+            time.sleep(0.2)
+            return {'success': True}
+
+        queues = [JobQueue(db_path, workers=4, poll_interval=0.01) for _ in range(2)]
+        for queue in queues:
+            queue.register_handler('photo', handler)
+            queue.start()
+        try:
+            queues[0].enqueue('photo', {'filename': 'foto.jpg'}, job_id='job-1')
+            job = queues[0].wait_for('job-1', 5)
+            time.sleep(0.3)
+        finally:
+            for queue in queues:
+                queue.stop()
+
+        print(f"   Estado: {job['state']}, llamadas al handler: {len(calls)}")
+        assert job['state'] == 'done'
+        assert calls == ['job-1']
+
+def test_replay_keeps_live_leases():
+    """Un proceso que arranca tarde no devuelve a la cola los trabajos que otro sigue enviando"""
+    print("🧪 Probando que solo se recuperan las concesiones caducadas...")
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, 'jobs.db')
+        busy = JobQueue(db_path, workers=0, lease_seconds=0.5)
+        busy.register_handler('photo', lambda job_id, payload: {'success': True})
+        busy.enqueue('photo', {'filename': 'foto.jpg'}, job_id='job-1')
+        assert busy._claim_next()[0] == 'job-1'
+        busy.set_state('job-1', 'posting_to_bc')
+
+        # Otro worker de gunicorn arranca mientras el primero sigue enviando
+        late = JobQueue(db_path, workers=0)
+        assert late._replay_unfinished() == 0
+        assert late.get_job('job-1')['state'] == 'posting_to_bc'
+
+        # El primero se cae: al caducar la concesión el trabajo vuelve a la cola
+        time.sleep(0.6)
+        assert late._replay_unfinished() == 1
+        assert late.get_job('job-1')['state'] == 'queued'
+        assert late._claim_next()[0] == 'job-1'
+
+        # El primero ya no puede pisar el estado del trabajo que ha recuperado otro
+        busy.set_state('job-1', 'done', result={'success': True})
+        job = late.get_job('job-1')
+        print(f"   Estado tras recuperar: {job['state']}, intentos: {job['attempts']}")
+        assert job['state'] == 'running' and job['attempts'] == 2
+
+if __name__ == "__main__":
+    test_claim_is_exclusive()
+    test_job_runs_once()
+    test_replay_keeps_live_leases()
+    print("✅ Cola de trabajos correcta")
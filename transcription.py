@@ -0,0 +1,409 @@
+"""
+Módulo para transcribir audio con modelos cargados una sola vez y reutilizados
+entre peticiones (pool de modelos en memoria), agrupando en lotes las notas de
+voz que llegan a la vez. El motor se elige en TRANSCRIPTION_CONFIG['engine']:
+openai-whisper o faster-whisper (CTranslate2 cuantizado para CPU).
+"""
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# Importar whisper de forma opcional (puede no estar instalado)
+try:
+    import whisper
+    WHISPER_AVAILABLE = True
+except ImportError:
+    whisper = None
+    WHISPER_AVAILABLE = False
+
+# faster-whisper también es opcional
+try:
+    from faster_whisper import WhisperModel as FasterWhisperModel
+    FASTER_WHISPER_AVAILABLE = True
+except ImportError:
+    FasterWhisperModel = None
+    FASTER_WHISPER_AVAILABLE = False
+
+# Frecuencia de muestreo que espera Whisper
+SAMPLE_RATE = 16000
+
+# Ventana que procesa el codificador de Whisper en una pasada (30 s)
+WINDOW_SAMPLES = 30 * SAMPLE_RATE
+
+class WhisperBackend:
+    """Motor openai-whisper (PyTorch, FP32 en CPU)"""
+
+    name = 'whisper'
+    supports_batching = True
+    install_hint = 'Whisper no está instalado. Por favor, ejecuta install_whisper.bat para instalarlo.'
+
+    def __init__(self, model_name='base'):
+        self.model_name = model_name
+
+    @property
+    def available(self):
+        return WHISPER_AVAILABLE
+
+    def load_model(self):
+        return whisper.load_model(self.model_name)
+
+    def transcribe(self, model, audio, language, **options):
+        """
+        Transcribe un audio completo
+
+        Returns:
+            dict: {'text', 'language'}
+        """
+        result = model.transcribe(audio, language=language, **options)
+        return {'text': result['text'], 'language': result.get('language', language)}
+
+    def decode_batch(self, model, batch, language):
+        """
+        Transcribe en una sola pasada del modelo varias notas de hasta 30 segundos
+
+        Cada audio se rellena hasta la ventana de 30 s y sus espectrogramas se
+        apilan para que el codificador y el decodificador procesen el lote a la vez.
+
+        Args:
+            model: Modelo Whisper cargado
+            batch (list): Arrays float32 a 16 kHz
+            language (str): Idioma de las notas
+
+        Returns:
+            list: Un dict {'text', 'language'} por audio, en el mismo orden
+        """
+        import torch
+
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(samples)), n_mels=model.dims.n_mels)
+            for samples in batch
+        ]).to(model.device)
+        options = whisper.DecodingOptions(language=language, fp16=model.device.type == 'cuda', without_timestamps=True)
+        results = model.decode(mels, options)
+        return [{'text': result.text, 'language': result.language} for result in results]
+
+class FasterWhisperBackend:
+    """
+    Motor faster-whisper (CTranslate2) con pesos cuantizados para CPU
+
+    Con compute_type 'int8' el modelo ocupa cerca de la cuarta parte y la
+    inferencia en CPU es varias veces más rápida que openai-whisper en FP32.
+    """
+
+    name = 'faster-whisper'
+    supports_batching = False
+    install_hint = 'faster-whisper no está instalado. Ejecuta: pip install faster-whisper'
+
+    def __init__(self, model_name='base', compute_type='int8', cpu_threads=0):
+        self.model_name = model_name
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+
+    @property
+    def available(self):
+        return FASTER_WHISPER_AVAILABLE
+
+    def load_model(self):
+        return FasterWhisperModel(self.model_name, device='cpu', compute_type=self.compute_type,
+                                  cpu_threads=self.cpu_threads)
+
+    def transcribe(self, model, audio, language, **options):
+        """
+        Transcribe un audio completo
+
+        Returns:
+            dict: {'text', 'language'}
+        """
+        segments, info = model.transcribe(audio, language=language, **options)
+        # Los segmentos se generan bajo demanda: recorrerlos mientras se tiene el modelo
+        return {'text': ''.join(segment.text for segment in segments), 'language': info.language}
+
+# Motores disponibles por nombre de configuración
+TRANSCRIPTION_BACKENDS = {
+    'whisper': WhisperBackend,
+    'faster-whisper': FasterWhisperBackend
+}
+
+def create_transcription_backend(config):
+    """
+    Crea el motor de transcripción según la configuración
+
+    Args:
+        config (dict): TRANSCRIPTION_CONFIG ('engine' es 'whisper' o 'faster-whisper')
+    """
+    engine = config['engine']
+    if engine not in TRANSCRIPTION_BACKENDS:
+        raise ValueError(f'Motor de transcripción no soportado: {engine}')
+    if engine == 'faster-whisper':
+        return FasterWhisperBackend(config['model'], compute_type=config['compute_type'],
+                                    cpu_threads=config['cpu_threads'])
+    return WhisperBackend(config['model'])
+
+class TranscriptionPool:
+    """
+    Pool de modelos de transcripción residentes en memoria
+
+    Los modelos se cargan una vez (al arrancar o en el primer uso) y cada
+    transcripción toma uno del pool, de forma que como mucho `workers`
+    transcripciones se ejecutan a la vez y el resto espera su turno.
+    """
+
+    def __init__(self, backend, workers=1, language='es', warmup=True):
+        self.backend = backend
+        self.workers = workers
+        self.language = language
+        self.warmup = warmup
+        self.loaded = False
+        self.load_time = None
+        self.requests = 0
+        self.waiting = 0
+        self.total_queue_wait = 0.0
+        self.total_inference = 0.0
+        self._models = queue.Queue()
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def load(self):
+        """Carga los modelos si aún no están cargados (se puede llamar varias veces)"""
+        if self.loaded:
+            return
+        with self._load_lock:
+            if self.loaded:
+                return
+            if not self.backend.available:
+                raise RuntimeError(self.backend.install_hint)
+
+            start = time.perf_counter()
+            for index in range(self.workers):
+                print(f"🔄 Cargando modelo {self.backend.name} '{self.backend.model_name}' ({index + 1}/{self.workers})...")
+                model = self.backend.load_model()
+                if self.warmup:
+                    # Primera inferencia con un segundo de silencio para inicializar todo
+                    self.backend.transcribe(model, np.zeros(SAMPLE_RATE, dtype=np.float32), self.language)
+                self._models.put(model)
+
+            self.load_time = time.perf_counter() - start
+            self.loaded = True
+            print(f"✅ Modelo {self.backend.name} '{self.backend.model_name}' listo en {self.load_time:.1f}s "
+                  f"({self.workers} en memoria)")
+
+    def preload(self):
+        """Carga los modelos en segundo plano para no retrasar el arranque"""
+        def load_in_background():
+            try:
+                self.load()
+            except Exception as e:
+                print(f"⚠️ No se pudo precargar {self.backend.name}: {str(e)}")
+
+        threading.Thread(target=load_in_background, name='transcription-preload', daemon=True).start()
+
+    def timed_load(self):
+        """Carga los modelos si hace falta y devuelve los segundos que se ha esperado"""
+        if self.loaded:
+            return 0.0
+        start = time.perf_counter()
+        self.load()
+        return time.perf_counter() - start
+
+    @contextmanager
+    def acquire(self):
+        """Toma un modelo del pool (esperando turno) y lo devuelve al terminar"""
+        self.load()
+        model = self._models.get()
+        try:
+            yield model
+        finally:
+            self._models.put(model)
+
+    def transcribe(self, audio, **options):
+        """
+        Transcribe un audio con uno de los modelos del pool
+
+        Args:
+            audio: Ruta del archivo o array float32 a 16 kHz
+            **options: Opciones adicionales del transcribe del motor
+
+        Returns:
+            tuple: (resultado {'text', 'language'}, tiempos en segundos: load, queue_wait, inference)
+        """
+        load_time = self.timed_load()
+
+        with self._stats_lock:
+            self.requests += 1
+            self.waiting += 1
+        wait_start = time.perf_counter()
+        with self.acquire() as model:
+            queue_wait = time.perf_counter() - wait_start
+            with self._stats_lock:
+                self.waiting -= 1
+
+            inference_start = time.perf_counter()
+            result = self.backend.transcribe(model, audio, self.language, **options)
+            inference = time.perf_counter() - inference_start
+
+        with self._stats_lock:
+            self.total_queue_wait += queue_wait
+            self.total_inference += inference
+
+        return result, {
+            'load': round(load_time, 3),
+            'queue_wait': round(queue_wait, 3),
+            'inference': round(inference, 3)
+        }
+
+    def get_stats(self):
+        """
+        Estado del pool
+
+        Returns:
+            dict: Motor, modelo, carga, peticiones en espera y tiempos medios
+        """
+        return {
+            'engine': self.backend.name,
+            'available': self.backend.available,
+            'model': self.backend.model_name,
+            'loaded': self.loaded,
+            'load_time': round(self.load_time, 3) if self.load_time is not None else None,
+            'workers': self.workers,
+            'requests': self.requests,
+            'waiting': self.waiting,
+            'avg_queue_wait': round(self.total_queue_wait / self.requests, 3) if self.requests else 0.0,
+            'avg_inference': round(self.total_inference / self.requests, 3) if self.requests else 0.0
+        }
+
+class _PendingTranscription:
+    """Nota de voz esperando a entrar en un lote"""
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.submitted = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.timings = None
+        self.error = None
+
+class BatchingTranscriber:
+    """
+    Agrupa en lotes las notas de voz que llegan a la vez (micro-batching)
+
+    La primera nota que llega abre un lote que espera como mucho `max_wait`
+    segundos a que lleguen más, hasta `max_batch_size`. El lote se transcribe
+    con un modelo del pool y cada petición recibe su resultado. Hay un hilo
+    formando lotes por cada modelo del pool. Las notas de más de 30 segundos
+    no caben en una ventana y se transcriben por separado, igual que todas
+    las notas si el motor no admite lotes.
+    """
+
+    def __init__(self, pool, max_batch_size=8, max_wait=0.05):
+        self.pool = pool
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.batched_requests = 0
+        self.largest_batch = 0
+        self._pending = queue.Queue()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def _start(self):
+        """Arranca los hilos que forman los lotes (la primera vez)"""
+        with self._start_lock:
+            if self._threads:
+                return
+            for index in range(self.pool.workers):
+                thread = threading.Thread(target=self._batch_loop, name=f'transcription-batch-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def transcribe(self, samples):
+        """
+        Transcribe una nota de voz, compartiendo pasada del modelo con las que lleguen a la vez
+
+        Args:
+            samples (numpy.ndarray): Audio float32 a 16 kHz
+
+        Returns:
+            tuple: (resultado {'text', 'language'}, tiempos en segundos:
+                load, queue_wait, inference y batch_size)
+        """
+        if self.max_batch_size <= 1 or not self.pool.backend.supports_batching or len(samples) > WINDOW_SAMPLES:
+            result, timings = self.pool.transcribe(samples)
+            timings['batch_size'] = 1
+            return result, timings
+
+        load_time = self.pool.timed_load()
+        self._start()
+        pending = _PendingTranscription(samples)
+        self._pending.put(pending)
+        pending.done.wait()
+
+        if pending.error is not None:
+            raise pending.error
+        pending.timings['load'] = round(load_time, 3)
+        return pending.result, pending.timings
+
+    def _batch_loop(self):
+        """Bucle de cada hilo: formar un lote y transcribirlo"""
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        """Transcribe un lote y entrega a cada petición su resultado"""
+        try:
+            with self.pool.acquire() as model:
+                start = time.perf_counter()
+                results = self.pool.backend.decode_batch(model, [pending.samples for pending in batch], self.pool.language)
+                inference = time.perf_counter() - start
+
+            for pending, result in zip(batch, results):
+                pending.result = result
+                pending.timings = {
+                    'queue_wait': round(start - pending.submitted, 3),
+                    'inference': round(inference, 3),
+                    'batch_size': len(batch)
+                }
+            with self._stats_lock:
+                self.batches += 1
+                self.batched_requests += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+            if len(batch) > 1:
+                print(f"🎤 Lote de {len(batch)} notas de voz transcrito en {inference:.2f}s")
+        except Exception as e:
+            print(f"❌ Error transcribiendo un lote de {len(batch)} notas de voz: {str(e)}")
+            for pending in batch:
+                pending.error = e
+        finally:
+            for pending in batch:
+                pending.done.set()
+
+    def get_stats(self):
+        """
+        Métricas de los lotes
+
+        Returns:
+            dict: Lotes transcritos, notas en lotes y tamaño medio y máximo
+        """
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait': self.max_wait,
+            'pending': self._pending.qsize(),
+            'batches': self.batches,
+            'batched_requests': self.batched_requests,
+            'avg_batch_size': round(self.batched_requests / self.batches, 2) if self.batches else 0.0,
+            'largest_batch': self.largest_batch
+        }
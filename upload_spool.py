@@ -0,0 +1,104 @@
+"""
+Módulo para guardar en disco las fotos subidas en binario, por bloques,
+calculando el tamaño y el hash SHA-256 mientras se reciben.
+"""
+
+import hashlib
+import os
+
+# Firmas de los formatos de imagen aceptados
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png', '.png')
+)
+
+class UploadError(ValueError):
+    """La subida no es una imagen válida o supera el tamaño máximo"""
+    pass
+
+class SpooledUpload:
+    """Foto guardada en disco con su tamaño y hash"""
+
+    def __init__(self, path, size, sha256, image_type):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.image_type = image_type
+
+    @property
+    def filename(self):
+        return os.path.basename(self.path)
+
+    def open(self):
+        """Abre el archivo en modo binario para leerlo"""
+        return open(self.path, 'rb')
+
+    def to_dict(self):
+        return {
+            'upload_id': self.filename,
+            'size': self.size,
+            'sha256': self.sha256,
+            'image_type': self.image_type
+        }
+
+def detect_image_type(header):
+    """
+    Detecta el formato de imagen por sus primeros bytes
+
+    Returns:
+        tuple: (formato, extensión) o (None, None) si no es JPEG ni PNG
+    """
+    for signature, image_type, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_type, extension
+    return None, None
+
+def spool_to_disk(stream, folder, basename, max_size, chunk_size=64 * 1024):
+    """
+    Copia un stream de imagen a disco por bloques
+
+    El archivo se escribe primero con extensión .part y se renombra al
+    terminar, de forma que nunca queda a medias con su nombre definitivo.
+
+    Args:
+        stream: Objeto con read(n) (request.stream o el stream de un FileStorage)
+        folder (str): Carpeta de destino
+        basename (str): Nombre del archivo sin extensión (se añade según el formato)
+        max_size (int): Tamaño máximo en bytes
+        chunk_size (int): Tamaño de cada bloque leído
+
+    Returns:
+        SpooledUpload: Archivo guardado
+
+    Raises:
+        UploadError: Si no es JPEG/PNG, está vacío o supera max_size
+    """
+    header = stream.read(chunk_size)
+    image_type, extension = detect_image_type(header)
+    if not header:
+        raise UploadError('No se recibió ninguna imagen')
+    if image_type is None:
+        raise UploadError('Formato de imagen no soportado (solo JPEG o PNG)')
+
+    path = os.path.join(folder, basename + extension)
+    temp_path = path + '.part'
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(temp_path, 'wb') as f:
+            chunk = header
+            while chunk:
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadError(f'La imagen supera el tamaño máximo de {max_size // (1024 * 1024)} MB')
+                digest.update(chunk)
+                f.write(chunk)
+                chunk = stream.read(chunk_size)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return SpooledUpload(path, size, digest.hexdigest(), image_type)
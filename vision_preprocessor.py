@@ -0,0 +1,136 @@
+"""
+Módulo para preparar las fotos antes de enviarlas al modelo de visión:
+orientación EXIF aplicada, reducción al tamaño de entrada del modelo, JPEG
+sin metadatos y caché del resultado por hash del contenido (los reintentos
+de la misma foto no la vuelven a procesar).
+"""
+
+import base64
+import hashlib
+import io
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+from task_cache import MemoryCacheBackend
+
+class PreparedImage:
+    """Foto lista para el modelo de visión"""
+
+    def __init__(self, data, width, height, original_size, original_width, original_height, elapsed):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.original_size = original_size
+        self.original_width = original_width
+        self.original_height = original_height
+        self.elapsed = elapsed
+        self.base64 = base64.b64encode(data).decode('ascii')
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def describe(self):
+        """Resumen para los logs"""
+        return (f"{self.original_width}x{self.original_height} ({self.original_size / 1024:.0f} KB) → "
+                f"{self.width}x{self.height} ({self.size / 1024:.0f} KB), {self.elapsed * 1000:.0f} ms")
+
+class VisionPreprocessor:
+    """
+    Reduce y limpia las fotos para el modelo de visión
+
+    Todas las fotos se vuelven a codificar (aunque sean pequeñas) para que
+    el modelo reciba siempre el mismo tamaño de entrada y ningún metadato.
+    """
+
+    def __init__(self, max_dimension=1024, quality=85, cache_size=32, cache_ttl=600):
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.cache_ttl = cache_ttl
+        self.cache = MemoryCacheBackend(max_entries=cache_size)
+        self.hits = 0
+        self.misses = 0
+        self.total_time = 0.0
+        self._lock = threading.Lock()
+
+    def prepare(self, image_bytes):
+        """
+        Prepara una foto para el modelo de visión
+
+        Args:
+            image_bytes (bytes): Contenido original de la foto
+
+        Returns:
+            tuple: (PreparedImage, True si venía de la caché)
+
+        Raises:
+            OSError: Si los bytes no son una imagen válida
+        """
+        key = hashlib.sha256(image_bytes).hexdigest()
+        prepared = self.cache.get(key)
+        if prepared is not None:
+            with self._lock:
+                self.hits += 1
+            return prepared, True
+
+        prepared = self._process(image_bytes)
+        self.cache.set(key, prepared, self.cache_ttl)
+        with self._lock:
+            self.misses += 1
+            self.total_time += prepared.elapsed
+        return prepared, False
+
+    def _process(self, image_bytes):
+        start = time.perf_counter()
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            original_width, original_height = image.size
+            # Los JPEG grandes se decodifican ya reducidos (escalado DCT)
+            if image.format == 'JPEG':
+                image.draft('RGB', (self.max_dimension, self.max_dimension))
+
+            # Aplicar la orientación antes de descartar el EXIF
+            image = ImageOps.exif_transpose(image)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            if max(image.size) > self.max_dimension:
+                image.thumbnail((self.max_dimension, self.max_dimension), Image.Resampling.LANCZOS)
+
+            # Sin EXIF, GPS, perfil ICC ni comentarios
+            image.info = {}
+            output = io.BytesIO()
+            image.save(output, format='JPEG', quality=self.quality, optimize=True)
+
+        return PreparedImage(output.getvalue(), image.width, image.height, len(image_bytes),
+                             original_width, original_height, time.perf_counter() - start)
+
+    def get_stats(self):
+        """
+        Contadores de la caché y tiempo medio de preparación
+
+        Returns:
+            dict: max_dimension, entradas, aciertos, fallos y ms medios por foto procesada
+        """
+        with self._lock:
+            return {
+                'max_dimension': self.max_dimension,
+                'cache_entries': self.cache.size(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'avg_prepare_ms': round(self.total_time / self.misses * 1000, 1) if self.misses else 0.0
+            }
+
+def create_vision_preprocessor(config):
+    """
+    Crea el preprocesador de fotos para el modelo de visión según la configuración
+
+    Args:
+        config (dict): VISION_PREPROCESS_CONFIG
+    """
+    return VisionPreprocessor(
+        max_dimension=config['max_dimension'],
+        quality=config['quality'],
+        cache_size=config['cache_size'],
+        cache_ttl=config['cache_ttl']
+    )
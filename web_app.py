@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, send_file, session
+from flask import Flask, render_template, request, jsonify, send_file, session, Response, stream_with_context, g
 from flask_cors import CORS
 import cv2
 import numpy as np
@@ -9,24 +9,41 @@ import json
 import os
 import io
 from pyzbar.pyzbar import decode
-import tempfile
 from datetime import datetime
 import uuid
-from threading import Thread
 import re
-
-# Importar whisper de forma opcional (puede no estar instalado)
-try:
-    import whisper
-    WHISPER_AVAILABLE = True
-except ImportError:
-    WHISPER_AVAILABLE = False
-    print("⚠️ Whisper no está instalado. La funcionalidad de audio estará limitada.")
+import time
+import hashlib
+import threading
+import atexit
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Los motores de transcripción son opcionales (pueden no estar instalados)
+from transcription import TranscriptionPool, BatchingTranscriber, create_transcription_backend
+from audio_decoder import AudioDecoder
+from stop_parser import create_stop_extractor
+from lm_response_parser import parse_lm_response
+from vision_preprocessor import create_vision_preprocessor
+from result_cache import create_result_cache
+from lm_stream import iter_completion_deltas, format_sse, StreamingResponseParser, StreamMetrics
+from admission import BackendSaturatedError, create_admission_controller
 
 # Importar configuración
 from config import *
 from gtask_auth import GTaskAuth
-from mobile_storage import MobileStorage
+from mobile_storage import MobileStorage, create_mobile_storage_database
+from write_behind import WriteBehindBuffer
+from session_store import create_session_store
+from job_queue import JobQueue
+from task_cache import create_task_cache
+from single_flight import SingleFlight
+from image_payload import ImagePayload, IMAGE_PLACEHOLDER
+from image_normalizer import create_image_normalizer
+from upload_spool import spool_to_disk, SpooledUpload, UploadError
+import http_client
+from retry_policy import (get_policy, get_retry_stats, IdempotencyCache, RetryableError,
+                          RetryError, CircuitOpenError)
 
 app = Flask(__name__)
 CORS(app, resources={
@@ -57,49 +74,242 @@ def log_request_info():
 # SISTEMA DE GESTIÓN DE SESIONES POR DISPOSITIVO
 # ========================================
 
+class DeviceSession(dict):
+    """
+    Sesión de un dispositivo (user_data, gtask_auth, mobile_storage, created_at, last_activity)
+
+    El almacenamiento móvil se abre la primera vez que se accede a
+    session['mobile_storage'], no al crear la sesión.
+    """
+    
+    def __init__(self, device_id, manager, **fields):
+        super().__init__(**fields)
+        self.device_id = device_id
+        self.manager = manager
+    
+    def __missing__(self, key):
+        if key != 'mobile_storage':
+            raise KeyError(key)
+        storage = self.manager.get_mobile_storage(self.device_id)
+        self['mobile_storage'] = storage
+        return storage
+
 class DeviceSessionManager:
-    """Gestor de sesiones por dispositivo"""
+    """
+    Gestor de sesiones por dispositivo
+
+    Las sesiones con usuario logueado (usuario y GTaskAuth serializado) viven
+    en un almacén con TTL (session_store), de forma que cualquier worker puede
+    atender a cualquier dispositivo. Las sesiones anónimas (sin login) solo se
+    guardan en memoria del proceso, con un máximo y descartando la menos usada
+    (LRU): clientes sin X-Device-ID, bots o monitores de salud no llenan el
+    almacén ni el disco. Cada petición reconstruye la sesión y la vuelve a
+    guardar solo si ha cambiado.
+    """
+    
+    def __init__(self, store, ttl=24 * 3600, storage_cache_size=1000, storage_database=None, storage_writer=None,
+                 max_anonymous_sessions=1000):
+        self.store = store
+        self.ttl = ttl
+        self.storage_cache_size = storage_cache_size
+        self.storage_database = storage_database  # None = un archivo JSON por dispositivo
+        self.storage_writer = storage_writer  # Escrituras diferidas (solo con un archivo JSON por dispositivo)
+        self.max_anonymous_sessions = max_anonymous_sessions
+        self.sessions_created = 0
+        self.sessions_promoted = 0
+        self.anonymous_evicted = 0
+        self.storages_opened = 0
+        self.generated_device_ids = 0
+        self.expired_sessions = 0
+        self.last_cleanup_ms = None
+        self._cleanup_thread = None
+        self._cleanup_stop = threading.Event()
+        self._anonymous = OrderedDict()  # {device_id: estado} de este proceso (LRU)
+        self._anonymous_lock = threading.Lock()
+        self._storages = OrderedDict()  # {device_id: MobileStorage} de este proceso (LRU)
+        self._storages_lock = threading.Lock()
+    
+    def get_mobile_storage(self, device_id):
+        """Almacenamiento móvil del dispositivo"""
+        with self._storages_lock:
+            self.storages_opened += 1
+        if self.storage_database is not None:
+            # Base de datos compartida: se lee en cada petición por si otro worker lo ha cambiado y
+            # se escribe en el momento (con escritura diferida un worker pisaría los cambios de otro)
+            return MobileStorage(f'mobile_storage_{device_id}.json', database=self.storage_database,
+                                 device_id=device_id)
+        
+        # Un archivo JSON por dispositivo: se abre una vez por proceso
+        with self._storages_lock:
+            storage = self._storages.get(device_id)
+            if storage is None:
+                storage = MobileStorage(f'mobile_storage_{device_id}.json', writer=self.storage_writer)
+                self._storages[device_id] = storage
+                while len(self._storages) > self.storage_cache_size:
+                    self._storages.popitem(last=False)
+            else:
+                self._storages.move_to_end(device_id)
+            return storage
+    
+    def serialize_session(self, device_session):
+        """Estado de una sesión tal como se guarda en el almacén"""
+        return {
+            'user_data': device_session['user_data'],
+            'gtask_auth': device_session['gtask_auth'].to_dict(),
+            'created_at': device_session['created_at'].isoformat()
+        }
+    
+    @staticmethod
+    def is_authenticated(state):
+        """Indica si una sesión serializada tiene usuario logueado (y debe ir al almacén)"""
+        return bool(state['user_data'] or state['gtask_auth'].get('access_token'))
     
-    def __init__(self):
-        self.sessions = {}  # {device_id: {user_data, gtask_auth, mobile_storage}}
+    def _remember_anonymous(self, device_id, state):
+        """Guarda una sesión anónima en la LRU del proceso, descartando las más antiguas"""
+        with self._anonymous_lock:
+            self._anonymous[device_id] = state
+            self._anonymous.move_to_end(device_id)
+            while len(self._anonymous) > self.max_anonymous_sessions:
+                self._anonymous.popitem(last=False)
+                self.anonymous_evicted += 1
     
     def create_device_session(self, device_id):
-        """Crear una nueva sesión para un dispositivo"""
-        if device_id not in self.sessions:
-            self.sessions[device_id] = {
-                'user_data': None,
-                'gtask_auth': GTaskAuth(),
-                'mobile_storage': MobileStorage(f'mobile_storage_{device_id}.json'),
-                'created_at': datetime.now(),
-                'last_activity': datetime.now()
-            }
-            print(f"📱 Nueva sesión creada para dispositivo: {device_id}")
-        return self.sessions[device_id]
+        """Crear una nueva sesión (anónima hasta que el dispositivo hace login)"""
+        state = {
+            'user_data': None,
+            'gtask_auth': GTaskAuth().to_dict(),
+            'created_at': datetime.now().isoformat()
+        }
+        self._remember_anonymous(device_id, state)
+        with self._anonymous_lock:
+            self.sessions_created += 1
+        print(f"📱 Nueva sesión creada para dispositivo: {device_id}")
+        return state
+    
+    def _load_state(self, device_id):
+        """Estado guardado de un dispositivo (almacén o anónimas de este proceso), o None"""
+        state = self.store.get(device_id)
+        with self._anonymous_lock:
+            if state is not None:
+                # Logueado (quizá desde otro worker): ya no es anónima en este proceso
+                self._anonymous.pop(device_id, None)
+            else:
+                state = self._anonymous.get(device_id)
+                if state is not None:
+                    self._anonymous.move_to_end(device_id)
+        return state
     
     def get_device_session(self, device_id):
-        """Obtener la sesión de un dispositivo"""
-        if device_id not in self.sessions:
-            return self.create_device_session(device_id)
-        return self.sessions[device_id]
+        """Obtener la sesión de un dispositivo (se crea si no existe)"""
+        state = self._load_state(device_id)
+        if state is None:
+            state = self.create_device_session(device_id)
+        return self._build_session(device_id, state)
+    
+    def find_device_session(self, device_id):
+        """Obtener la sesión de un dispositivo sin crearla (p. ej. desde un trabajo en segundo plano)"""
+        state = self._load_state(device_id)
+        return self._build_session(device_id, state) if state is not None else None
+    
+    def _build_session(self, device_id, state):
+        """DeviceSession a partir de su estado serializado"""
+        return DeviceSession(
+            device_id, self,
+            user_data=state['user_data'],
+            gtask_auth=GTaskAuth.from_dict(state['gtask_auth']),
+            created_at=datetime.fromisoformat(state['created_at']),
+            last_activity=datetime.now()
+        )
+    
+    def save_device_session(self, device_id, device_session, loaded_state=None):
+        """
+        Guarda la sesión si ha cambiado desde que se cargó
+
+        Con login pasa al almacén; sin usuario (logout, token caducado) se
+        elimina de él y vuelve a ser anónima.
+
+        Args:
+            device_id (str): ID del dispositivo
+            device_session (dict): Sesión obtenida con get_device_session
+            loaded_state (dict): serialize_session() de la sesión al cargarla
+        """
+        state = self.serialize_session(device_session)
+        if state == loaded_state:
+            return
+        if self.is_authenticated(state):
+            self.store.set(device_id, state, self.ttl)
+            with self._anonymous_lock:
+                if self._anonymous.pop(device_id, None) is not None:
+                    self.sessions_promoted += 1
+        else:
+            self.store.delete(device_id)
+            self._remember_anonymous(device_id, state)
     
     def update_activity(self, device_id):
-        """Actualizar la última actividad de un dispositivo"""
-        if device_id in self.sessions:
-            self.sessions[device_id]['last_activity'] = datetime.now()
+        """Actualizar la última actividad de un dispositivo (renueva su TTL)"""
+        with self._anonymous_lock:
+            if device_id in self._anonymous:
+                self._anonymous.move_to_end(device_id)
+                return
+        self.store.touch(device_id, self.ttl)
     
-    def cleanup_expired_sessions(self, max_age_hours=24):
-        """Limpiar sesiones expiradas"""
-        now = datetime.now()
-        expired_devices = []
-        
-        for device_id, session_data in self.sessions.items():
-            age = now - session_data['last_activity']
-            if age.total_seconds() > (max_age_hours * 3600):
-                expired_devices.append(device_id)
+    def get_stats(self):
+        """
+        Tamaño de las tablas de sesiones
+
+        Returns:
+            dict: Sesiones en el almacén y anónimas, límite, descartadas, creadas,
+                  promovidas a logueadas, almacenamientos abiertos e IDs generados
+        """
+        with self._anonymous_lock:
+            anonymous = len(self._anonymous)
+        return {
+            'stored_sessions': self.store.size(),
+            'anonymous_sessions': anonymous,
+            'max_anonymous_sessions': self.max_anonymous_sessions,
+            'anonymous_evicted': self.anonymous_evicted,
+            'sessions_created': self.sessions_created,
+            'sessions_promoted': self.sessions_promoted,
+            'storages_opened': self.storages_opened,
+            'open_storage_files': len(self._storages),
+            'generated_device_ids': self.generated_device_ids,
+            'expired_sessions': self.expired_sessions,
+            'last_cleanup_ms': self.last_cleanup_ms
+        }
+    
+    def cleanup_expired_sessions(self):
+        """Limpiar sesiones expiradas (las caducadas ya no se devuelven aunque sigan en el almacén)"""
+        start = time.perf_counter()
+        expired = self.store.purge_expired()
+        self.last_cleanup_ms = round((time.perf_counter() - start) * 1000, 3)
+        self.expired_sessions += expired
+        if expired:
+            print(f"🗑️ {expired} sesiones expiradas eliminadas en {self.last_cleanup_ms} ms")
+    
+    def start_cleanup(self, interval=60):
+        """Arranca el hilo que limpia las sesiones expiradas cada `interval` segundos"""
+        if self._cleanup_thread is not None:
+            return
+        self._cleanup_stop.clear()
+        
+        def cleanup_loop():
+            # wait() devuelve True en cuanto se llama a stop_cleanup()
+            while not self._cleanup_stop.wait(interval):
+                try:
+                    self.cleanup_expired_sessions()
+                except Exception as e:
+                    print(f"Error en limpieza de sesiones: {e}")
         
-        for device_id in expired_devices:
-            del self.sessions[device_id]
-            print(f"🗑️ Sesión expirada eliminada para dispositivo: {device_id}")
+        self._cleanup_thread = threading.Thread(target=cleanup_loop, name='session-cleanup', daemon=True)
+        self._cleanup_thread.start()
+    
+    def stop_cleanup(self, timeout=5):
+        """Detiene el hilo de limpieza (al apagar la aplicación)"""
+        if self._cleanup_thread is None:
+            return
+        self._cleanup_stop.set()
+        self._cleanup_thread.join(timeout)
+        self._cleanup_thread = None
     
     def get_device_id_from_request(self, request):
         """Obtener el ID del dispositivo desde la petición"""
@@ -120,19 +330,46 @@ class DeviceSessionManager:
         if device_id:
             return device_id
         
-        # Generar un ID único si no se proporciona
-        device_id = str(uuid.uuid4())
-        print(f"🆔 ID de dispositivo generado: {device_id}")
-        return device_id
+        # Generar un ID único si no se proporciona (el mismo durante toda la petición)
+        if 'generated_device_id' not in g:
+            g.generated_device_id = str(uuid.uuid4())
+            self.generated_device_ids += 1
+            print(f"🆔 ID de dispositivo generado: {g.generated_device_id}")
+        return g.generated_device_id
+
+# Escrituras diferidas del almacenamiento móvil (se guardan juntas y al apagar)
+mobile_storage_writer = WriteBehindBuffer('Almacenamiento móvil', MOBILE_STORAGE_CONFIG['flush_delay'])
+atexit.register(mobile_storage_writer.stop)
 
 # Instancia global del gestor de sesiones
-session_manager = DeviceSessionManager()
+session_manager = DeviceSessionManager(
+    create_session_store(SESSION_STORE_CONFIG),
+    ttl=SESSION_STORE_CONFIG['ttl'],
+    storage_cache_size=SESSION_STORE_CONFIG['storage_cache_size'],
+    storage_database=create_mobile_storage_database(MOBILE_STORAGE_CONFIG),
+    storage_writer=mobile_storage_writer,
+    max_anonymous_sessions=SESSION_STORE_CONFIG['max_anonymous_sessions']
+)
 
 def get_current_device_session():
-    """Obtener la sesión del dispositivo actual"""
-    device_id = session_manager.get_device_id_from_request(request)
-    session_manager.update_activity(device_id)
-    return session_manager.get_device_session(device_id)
+    """Obtener la sesión del dispositivo actual (se carga una vez por petición)"""
+    if 'device_session' not in g:
+        device_id = session_manager.get_device_id_from_request(request)
+        session_manager.update_activity(device_id)
+        g.device_id = device_id
+        g.device_session = session_manager.get_device_session(device_id)
+        g.device_session_state = session_manager.serialize_session(g.device_session)
+    return g.device_session
+
+@app.after_request
+def save_current_device_session(response):
+    """Guardar en el almacén los cambios de la sesión del dispositivo (login, logout...)"""
+    if 'device_session' in g:
+        try:
+            session_manager.save_device_session(g.device_id, g.device_session, g.device_session_state)
+        except Exception as e:
+            print(f"❌ Error guardando la sesión del dispositivo {g.device_id}: {e}")
+    return response
 
 def get_current_gtask_auth():
     """Obtener la instancia de GTaskAuth del dispositivo actual"""
@@ -157,69 +394,167 @@ if not os.path.exists(UPLOAD_FOLDER):
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max (aumentado para múltiples imágenes)
 
-def compress_image(image_bytes, quality=85, max_size_mb=10):
-    """Comprime la imagen si es muy grande"""
-    try:
-        from PIL import Image
-        import io
-        
-        # Calcular tamaño en MB
-        size_mb = len(image_bytes) / (1024 * 1024)
-        print(f"📊 Tamaño original de imagen: {size_mb:.2f} MB")
-        
-        # Si la imagen es menor al tamaño máximo, no comprimir
-        if size_mb <= max_size_mb:
-            print(f"✅ Imagen dentro del límite, no se comprime")
-            return image_bytes
-        
-        # Abrir imagen con PIL
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Convertir a RGB si es necesario
-        if image.mode in ('RGBA', 'LA', 'P'):
-            image = image.convert('RGB')
-        
-        # Comprimir imagen
-        output_buffer = io.BytesIO()
-        image.save(output_buffer, format='JPEG', quality=quality, optimize=True)
-        compressed_bytes = output_buffer.getvalue()
-        
-        # Calcular tamaño comprimido
-        compressed_size_mb = len(compressed_bytes) / (1024 * 1024)
-        compression_ratio = (1 - compressed_size_mb / size_mb) * 100
-        
-        print(f"🔄 Imagen comprimida: {size_mb:.2f} MB → {compressed_size_mb:.2f} MB")
-        print(f"📉 Ratio de compresión: {compression_ratio:.1f}%")
-        
-        return compressed_bytes
-        
-    except Exception as e:
-        print(f"Error al comprimir imagen: {str(e)}")
-        print(f"   Usando imagen original sin comprimir")
-        return image_bytes
+# Subidas al servicio base64 ya completadas (para no duplicar archivos al reintentar)
+saved_uploads = IdempotencyCache()
 
-def clean_and_validate_base64(image_data):
-    """Limpia y valida el base64 de la imagen"""
+# Caché de tareas de BC por QR ID
+task_cache = create_task_cache(TASK_CACHE_CONFIG)
+
+# Consultas de tareas en curso, compartidas entre peticiones concurrentes del mismo QR ID
+task_queries = SingleFlight('Consulta de tareas')
+
+# Normalización de fotos (orientación, dimensiones y tamaño objetivo en bytes)
+image_normalizer = create_image_normalizer(IMAGE_NORMALIZE_CONFIG)
+
+# Modelos de transcripción (motor de TRANSCRIPTION_CONFIG['engine']) cargados una
+# sola vez y compartidos por todas las transcripciones
+transcription_backend = create_transcription_backend(TRANSCRIPTION_CONFIG)
+if not transcription_backend.available:
+    print(f"⚠️ {transcription_backend.install_hint} La funcionalidad de audio estará limitada.")
+
+whisper_pool = TranscriptionPool(
+    transcription_backend,
+    workers=TRANSCRIPTION_CONFIG['workers'],
+    language=TRANSCRIPTION_CONFIG['language'],
+    warmup=TRANSCRIPTION_CONFIG['warmup']
+)
+
+# Notas de voz simultáneas transcritas en lotes con los modelos del pool
+whisper_batcher = BatchingTranscriber(
+    whisper_pool,
+    max_batch_size=TRANSCRIPTION_CONFIG['batch_max_size'],
+    max_wait=TRANSCRIPTION_CONFIG['batch_max_wait']
+)
+
+# Fotos reducidas y sin metadatos para el modelo de visión, en caché por hash del contenido
+vision_preprocessor = create_vision_preprocessor(VISION_PREPROCESS_CONFIG)
+
+# Resultados de IA (foto y nota de voz) por hash del contenido, para los reintentos
+ai_result_cache = create_result_cache(AI_RESULT_CACHE_CONFIG)
+
+# Límite de peticiones simultáneas a LM Studio (visión y texto comparten servidor) y a Whisper
+lm_studio_admission = create_admission_controller('LM Studio', ADMISSION_CONFIG['lm_studio'])
+whisper_admission = create_admission_controller('Whisper', ADMISSION_CONFIG['whisper'])
+
+def saturated_response(error):
+    """Respuesta 503 con Retry-After para una petición no admitida por saturación"""
+    return jsonify(error.to_dict()), 503, {'Retry-After': str(error.retry_after)}
+
+# Tiempo hasta el primer token de las respuestas en streaming del modelo de visión
+vision_stream_metrics = StreamMetrics()
+
+# Extracción de la parada por niveles: reglas primero, LM Studio solo si la confianza es baja
+stop_extractor = create_stop_extractor(STOP_EXTRACTION_CONFIG, lambda text: extract_stop_info_with_llm(text))
+
+# Decodificador de notas de voz en memoria (PyAV o FFmpeg por tuberías, sin archivos temporales)
+audio_decoder = AudioDecoder(TRANSCRIPTION_CONFIG['decoder'], ffmpeg_path=TRANSCRIPTION_CONFIG['ffmpeg_path'])
+
+# Cola persistente para los envíos a Business Central en segundo plano
+job_queue = JobQueue(
+    os.path.join(UPLOAD_FOLDER, JOB_QUEUE_CONFIG['db_file']),
+    workers=JOB_QUEUE_CONFIG['workers'],
+    max_attempts=JOB_QUEUE_CONFIG['max_attempts'],
+    poll_interval=JOB_QUEUE_CONFIG['poll_interval'],
+    lease_seconds=JOB_QUEUE_CONFIG['lease_seconds']
+)
+
+def normalize_photo(source):
+    """
+    Normaliza una foto (orientación, dimensiones y tamaño en bytes) antes de enviarla
+    
+    Args:
+        source: Bytes de la imagen o ruta del archivo
+    
+    Returns:
+        NormalizedImage: Foto normalizada, o None si ya cumple los límites o no se pudo normalizar
+    """
     try:
-        # Si viene como data URL, extraer solo el base64
-        if isinstance(image_data, str) and image_data.startswith('data:image'):
-            # Extraer la parte después de la coma
-            base64_part = image_data.split(',', 1)[1]
-            print(f"Data URL detectada, extraído base64 de {len(image_data)} a {len(base64_part)} caracteres")
-            return base64_part
-        elif isinstance(image_data, str):
-            # Si ya es base64 puro, validarlo
-            base64.b64decode(image_data)
-            print(f"✅ Base64 puro válido - Longitud: {len(image_data)} caracteres")
-            return image_data
+        normalized = image_normalizer.normalize(source)
+        if normalized is None:
+            print(f"✅ Imagen dentro de los límites, no se vuelve a codificar")
         else:
-            # Si son bytes, convertirlos a base64
-            base64_data = base64.b64encode(image_data).decode('utf-8')
-            print(f"🔄 Bytes convertidos a base64 - Longitud: {len(base64_data)} caracteres")
-            return base64_data
+            print(f"🔄 Imagen normalizada: {normalized.describe()}")
+        return normalized
     except Exception as e:
-        print(f"❌ Error al procesar base64: {str(e)}")
-        raise ValueError(f"Formato de imagen inválido: {str(e)}")
+        print(f"Error al normalizar imagen: {str(e)}")
+        print(f"   Usando imagen original sin normalizar")
+        return None
+
+def new_photo_basename():
+    """Nombre único (sin extensión) para una foto en temp_uploads"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    unique_id = str(uuid.uuid4())[:8]
+    return f"photo_{timestamp}_{unique_id}"
+
+def save_photo_stream(stream):
+    """
+    Guarda en temp_uploads una foto recibida en binario, por bloques
+    
+    Solo si hay que normalizarla (ver IMAGE_NORMALIZE_CONFIG) se carga en memoria.
+    
+    Returns:
+        SpooledUpload: Foto guardada con su tamaño y hash
+    """
+    upload = spool_to_disk(
+        stream,
+        app.config['UPLOAD_FOLDER'],
+        new_photo_basename(),
+        UPLOAD_STREAM_CONFIG['max_photo_size'],
+        UPLOAD_STREAM_CONFIG['chunk_size']
+    )
+    print(f"📥 Foto recibida en binario: {upload.filename} ({upload.size} bytes, sha256 {upload.sha256[:12]}...)")
+    
+    normalized = normalize_photo(upload.path)
+    if normalized is None:
+        return upload
+    
+    # La foto normalizada sustituye a la original (puede cambiar de formato)
+    os.remove(upload.path)
+    path = os.path.splitext(upload.path)[0] + normalized.extension
+    ImagePayload(normalized.data).save(path)
+    return SpooledUpload(path, normalized.size, hashlib.sha256(normalized.data).hexdigest(), normalized.format.lower())
+
+def is_spooled_photo(upload_id):
+    """Comprueba que upload_id es una foto subida con /api/upload-photo"""
+    return bool(re.match(r'^photo_[0-9_]+_[0-9a-f]{8}\.(jpg|png|webp)$', upload_id or '')) and \
+        os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], upload_id))
+
+def store_request_photo():
+    """
+    Guarda en temp_uploads la foto de la petición actual
+    
+    Acepta, por orden de preferencia: 'upload_id' de una foto ya subida con
+    /api/upload-photo, la parte binaria 'image' (multipart) o 'image_data' en base64.
+    
+    Returns:
+        str: Nombre del archivo guardado
+    
+    Raises:
+        ValueError: Si la imagen no es válida
+    """
+    upload_id = request.form.get('upload_id')
+    if upload_id:
+        if not is_spooled_photo(upload_id):
+            raise UploadError(f'Subida no encontrada: {upload_id}')
+        return upload_id
+    
+    if 'image' in request.files:
+        return save_photo_stream(request.files['image'].stream).filename
+    
+    # Imagen en base64 (se decodifica una sola vez)
+    image = ImagePayload.from_base64(request.form.get('image_data'))
+    
+    # Normalizar la imagen si supera los límites
+    extension = '.jpg'
+    normalized = normalize_photo(image.data)
+    if normalized is not None:
+        image = ImagePayload(normalized.data)
+        extension = normalized.extension
+    
+    # Guardar imagen temporalmente (normalizada si fue necesario); el base64 se genera al enviarla
+    filename = new_photo_basename() + extension
+    image.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    return filename
 
 def extract_qr_id(qr_data):
     """Extrae el ID del QR que viene después de 'IdQr/'"""
@@ -303,7 +638,7 @@ def scan_qr():
 def process_photo():
     """API para procesar fotos y enviarlas al servidor Business Central en segundo plano"""
     try:
-        if 'image' not in request.files and 'image_data' not in request.form:
+        if 'image' not in request.files and 'image_data' not in request.form and 'upload_id' not in request.form:
             return jsonify({'error': 'No se proporcionó imagen'}), 400
         
         qr_data = request.form.get('qr_data', '')
@@ -311,37 +646,11 @@ def process_photo():
         # Extraer el ID del QR (parte después de 'IdQr/')
         qr_id = extract_qr_id(qr_data)
         
-        # Obtener la imagen
-        if 'image' in request.files:
-            file = request.files['image']
-            image_bytes = file.read()
-        else:
-            # Imagen en base64
-            image_data = request.form['image_data']
-            if image_data.startswith('data:image'):
-                image_data = image_data.split(',')[1]
-            image_bytes = base64.b64decode(image_data)
-        
-        # Comprimir imagen si es muy grande
-        from config import BC_CONFIG
-        compressed_image_bytes = compress_image(
-            image_bytes, 
-            quality=BC_CONFIG['compress_quality'],
-            max_size_mb=BC_CONFIG['max_image_size_mb']
-        )
-        
-        # Guardar imagen temporalmente (comprimida si fue necesario)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        unique_id = str(uuid.uuid4())[:8]
-        filename = f"photo_{timestamp}_{unique_id}.jpg"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        with open(filepath, 'wb') as f:
-            f.write(compressed_image_bytes)
-        
-        # Convertir a base64 para el procesamiento
-        image_base64 = base64.b64encode(compressed_image_bytes).decode('utf-8')
-        print(f"Imagen convertida a base64 - Longitud: {len(image_base64)} caracteres")
+        # Guardar la imagen en temp_uploads (binaria por bloques o base64)
+        try:
+            filename = store_request_photo()
+        except ValueError as e:
+            return jsonify({'error': f'Formato de imagen inválido: {str(e)}'}), 400
         
         # Primero consultar las tareas disponibles
         print(f"🔍 Consultando tareas para QR ID: {qr_id}")
@@ -381,15 +690,21 @@ def process_photo():
         selected_task = tasks[0]
         print(f"✅ Tarea única encontrada: {selected_task}")
         
-        # Obtener device_id para pasarlo al hilo
+        # Obtener device_id y usuario para pasarlos al trabajo en cola
         device_id = session_manager.get_device_id_from_request(request)
+        user_id = get_current_gtask_auth().get_current_user_id()
         
-        # Iniciar proceso en segundo plano para enviar a Business Central
-        thread = Thread(target=process_photo_async, args=(qr_id, filename, image_base64, qr_data, device_id))
-        thread.daemon = True
-        thread.start()
+        # Encolar el envío a Business Central (la imagen ya está guardada en disco)
+        job_id = job_queue.enqueue('photo', {
+            'qr_id': qr_id,
+            'filename': filename,
+            'qr_data': qr_data,
+            'device_id': device_id,
+            'user_id': user_id,
+            'selected_task': selected_task
+        }, job_id=filename)
         
-        print(f"Proceso iniciado en segundo plano para archivo: {filename}")
+        print(f"Proceso encolado en segundo plano para archivo: {filename}")
         
         return jsonify({
             'success': True,
@@ -398,23 +713,23 @@ def process_photo():
             'qr_data': qr_data,
             'qr_id_extracted': qr_id,
             'status': 'processing_in_background',
+            'job_id': job_id,
             'task_used': selected_task
         })
         
     except Exception as e:
         return jsonify({'error': f'Error al procesar foto: {str(e)}'}), 500
 
-def process_photo_async(qr_id, filename, image_base64, qr_data, device_id, selected_task=None):
+def process_photo_async(qr_id, filename, image, qr_data, device_id, selected_task=None, user_id=None):
     """Función que se ejecuta en segundo plano para enviar la foto a Business Central"""
     try:
         print(f"Iniciando envío a Business Central en segundo plano para: {filename} (dispositivo: {device_id})")
         
-        # Obtener la sesión del dispositivo específico
-        device_session = session_manager.get_device_session(device_id)
-        gtask_auth = device_session['gtask_auth']
+        # Obtener la autenticación del dispositivo (o del usuario que encoló el trabajo)
+        gtask_auth = get_job_gtask_auth(device_id, user_id)
         
         # Enviar al servidor Business Central usando la sesión del dispositivo
-        bc_response = send_to_business_central_with_session(qr_id, filename, image_base64, selected_task, gtask_auth)
+        bc_response = send_to_business_central_with_session(qr_id, filename, image, selected_task, gtask_auth)
         
         if bc_response['success']:
             print(f"Enviado a BC exitosamente: {filename}")
@@ -425,18 +740,33 @@ def process_photo_async(qr_id, filename, image_base64, qr_data, device_id, selec
             # La lógica de selección se manejará en el frontend
         else:
             print(f"Error al enviar a BC: {filename} - {bc_response['error']}")
+        
+        return bc_response
             
     except Exception as e:
         print(f"Error en proceso en segundo plano: {filename} - {str(e)}")
+        return {
+            'success': False,
+            'error': f'Error en proceso en segundo plano: {str(e)}'
+        }
 
 def convert_base64_to_url(base64_data, filename):
     """
     Convierte un base64 a URL usando el servicio de Malla
     Similar a la función AL FormBase64ToUrl
+    Los reintentos siguen la política 'base64_save' y un mismo archivo ya
+    guardado no se vuelve a subir (idempotencia por contenido)
     """
     try:
         import os
         
+        # Si este mismo archivo ya se guardó, devolver la URL existente
+        idempotency_key = IdempotencyCache.make_key(filename, base64_data)
+        saved = saved_uploads.get(idempotency_key)
+        if saved:
+            print(f"♻️ Archivo ya guardado previamente: {saved[0]} (ID: {saved[1]})")
+            return saved
+        
         # Extraer la extensión del archivo
         file_ext = os.path.splitext(filename)[1].lower().lstrip('.')
         
@@ -453,50 +783,41 @@ def convert_base64_to_url(base64_data, filename):
         }
         
         # URL del servicio de conversión
-        url = 'https://base64-api.deploy.malla.es/save'
+        url = BASE64_API_CONFIG['save_url']
         
-        # Hacer la petición POST con reintentos
-        max_retries = 3
-        retry_delay = 5  # segundos
+        def save_attempt(timeout):
+            response = http_client.post(
+                url,
+                json=payload,
+                timeout=timeout,
+                headers={
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': idempotency_key
+                }
+            )
+            
+            # El servicio devuelve 400 de forma transitoria: se reintenta igual que un 5xx
+            if response.status_code == 400 or response.status_code >= 500:
+                raise RetryableError(f'Request failed with status code {response.status_code}')
+            
+            response.raise_for_status()
+            return response.json()
         
-        for attempt in range(max_retries):
-            try:
-                response = requests.post(
-                    url,
-                    json=payload,
-                    timeout=30,
-                    headers={'Content-Type': 'application/json'}
-                )
-                
-                if response.status_code == 400:
-                    error_msg = 'Request failed with status code 400'
-                    print(f"⚠️ Error al guardar archivo (intento {attempt + 1}/{max_retries}): {error_msg}")
-                    if attempt < max_retries - 1:
-                        import time
-                        time.sleep(retry_delay)
-                        continue
-                    else:
-                        raise Exception('Error al guardar el archivo después de varios intentos')
-                
-                response.raise_for_status()
-                result = response.json()
-                
-                # Extraer la URL y el ID
-                url_result = result.get('url', '')
-                file_id = result.get('_id', None)
-                
-                print(f"✅ Archivo convertido a URL: {url_result} (ID: {file_id})")
-                return url_result, file_id
-                
-            except requests.exceptions.RequestException as e:
-                print(f"⚠️ Error en intento {attempt + 1}/{max_retries}: {str(e)}")
-                if attempt < max_retries - 1:
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    error_msg = f'Error al convertir base64 a URL después de {max_retries} intentos: {str(e)}'
-                    print(f"❌ {error_msg}")
-                    raise Exception(error_msg)
+        # Hacer la petición POST con reintentos (backoff exponencial con jitter)
+        try:
+            result = get_policy('base64_save').execute(save_attempt)
+        except (RetryError, CircuitOpenError) as e:
+            error_msg = f'Error al convertir base64 a URL: {str(e)}'
+            print(f"❌ {error_msg}")
+            raise Exception(error_msg)
+        
+        # Extraer la URL y el ID
+        url_result = result.get('url', '')
+        file_id = result.get('_id', None)
+        saved_uploads.set(idempotency_key, (url_result, file_id))
+        
+        print(f"✅ Archivo convertido a URL: {url_result} (ID: {file_id})")
+        return url_result, file_id
         
     except Exception as e:
         import traceback
@@ -505,8 +826,104 @@ def convert_base64_to_url(base64_data, filename):
         print(f"📋 Traceback completo:\n{error_trace}")
         raise
 
-def send_incidence_to_server_with_session(incidence_payload, gtask_auth):
-    """Envía una incidencia al servidor Business Central usando la sesión específica del dispositivo."""
+def convert_image_entry_to_url(img):
+    """Convierte una imagen de la incidencia a URL; si falla, devuelve la imagen original"""
+    try:
+        img_data = img.get('file', '')
+        img_name = img.get('name', 'image.jpg')
+        file_id = img.get('file_id', '')
+        
+        # Si ya es una URL, usarla directamente
+        if isinstance(img_data, str) and (img_data.startswith('http://') or img_data.startswith('https://')):
+            print(f"✅ Imagen ya es URL: {img_name}")
+            return {
+                'file': img_data,
+                'name': img_name,
+                'file_id': file_id
+            }
+        elif isinstance(img_data, str) and img_data.startswith('data:image'):
+            # Extraer el base64 del data URL
+            # Formato: data:image/jpeg;base64,/9j/4AAQ...
+            if ',' in img_data:
+                base64_data = img_data.split(',')[1]
+            else:
+                # Si no hay coma, intentar extraer después de base64,
+                base64_data = img_data.split('base64,')[1] if 'base64,' in img_data else img_data
+            # Convertir a URL
+            url, file_id = convert_base64_to_url(base64_data, img_name)
+            return {
+                'file': url,
+                'name': img_name,
+                'file_id': file_id
+            }
+        elif isinstance(img_data, str):
+            # Asumir que es base64 puro
+            url, file_id = convert_base64_to_url(img_data, img_name)
+            return {
+                'file': url,
+                'name': img_name,
+                'file_id': file_id
+            }
+        else:
+            print(f"⚠️ Formato de imagen no reconocido para {img_name}, enviando tal cual")
+            return img
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        print(f"❌ Error al convertir imagen {img.get('name', 'desconocida')}: {str(e)}")
+        print(f"📋 Traceback completo:\n{error_trace}")
+        # En caso de error, enviar la imagen original
+        return img
+
+def convert_audio_entry_to_url(audio):
+    """Convierte un audio de la incidencia a URL; si falla, devuelve el audio original"""
+    audio_data = audio.get('file', '') if isinstance(audio, dict) else audio
+    audio_name = audio.get('name', 'audio.mp3') if isinstance(audio, dict) else 'audio.mp3'
+    try:
+        # Si ya es una URL, usarla directamente
+        if isinstance(audio_data, str) and (audio_data.startswith('http://') or audio_data.startswith('https://')):
+            print(f"✅ Audio ya es URL: {audio_name}")
+            return audio if isinstance(audio, dict) else {'file': audio_data, 'name': audio_name}
+        elif isinstance(audio_data, str):
+            # Si es data URL, extraer el base64
+            if audio_data.startswith('data:audio') or audio_data.startswith('data:application'):
+                if ',' in audio_data:
+                    base64_data = audio_data.split(',')[1]
+                else:
+                    base64_data = audio_data.split('base64,')[1] if 'base64,' in audio_data else audio_data
+            else:
+                base64_data = audio_data
+            # Convertir a URL
+            url, file_id = convert_base64_to_url(base64_data, audio_name)
+            return {
+                'file': url,
+                'name': audio_name,
+                'file_id': file_id
+            }
+        else:
+            print(f"⚠️ Formato de audio no reconocido, enviando tal cual")
+            return audio if isinstance(audio, dict) else {'file': audio_data, 'name': audio_name}
+    except Exception as e:
+        print(f"❌ Error al convertir audio: {str(e)}")
+        # En caso de error, enviar el audio original
+        return audio if isinstance(audio, dict) else {'file': audio_data, 'name': audio_name}
+
+def convert_entries_concurrently(entries, convert_entry):
+    """
+    Convierte varios archivos de base64 a URL en paralelo
+    Respeta el orden original y el límite de BASE64_API_CONFIG['max_concurrency']
+    """
+    if len(entries) <= 1:
+        return [convert_entry(entry) for entry in entries]
+    
+    max_workers = min(BASE64_API_CONFIG['max_concurrency'], len(entries))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # map() devuelve los resultados en el mismo orden que las entradas
+        return list(executor.map(convert_entry, entries))
+
+def send_incidence_to_server_with_session(incidence_payload, gtask_auth, progress_callback=None):
+    """Envía una incidencia al servidor Business Central usando la sesión específica del dispositivo.
+    progress_callback (opcional) recibe el estado actual: 'converting' o 'posting_to_bc'."""
     print("=" * 50)
     print("🟢 send_incidence_to_server_with_session() LLAMADA")
     print(f"🟢 Payload keys: {list(incidence_payload.keys()) if incidence_payload else 'None'}")
@@ -537,96 +954,17 @@ def send_incidence_to_server_with_session(incidence_payload, gtask_auth):
         print(f"🟢 Usando endpoint de incidencias: {url}")
 
         # Convertir imágenes base64 a URLs antes de enviar a BC
+        if progress_callback:
+            progress_callback('converting')
         images = incidence_payload.get('image', [])
-        images_with_urls = []
-        
         print(f"📸 Convirtiendo {len(images)} imagen(es) de base64 a URL...")
-        for img in images:
-            try:
-                img_data = img.get('file', '')
-                img_name = img.get('name', 'image.jpg')
-                file_id = img.get('file_id', '')
-                
-                # Si ya es una URL, usarla directamente
-                if isinstance(img_data, str) and (img_data.startswith('http://') or img_data.startswith('https://')):
-                    print(f"✅ Imagen ya es URL: {img_name}")
-                    images_with_urls.append({
-                        'file': img_data,
-                        'name': img_name,
-                        'file_id': file_id
-                    })
-                elif isinstance(img_data, str) and img_data.startswith('data:image'):
-                    # Extraer el base64 del data URL
-                    # Formato: data:image/jpeg;base64,/9j/4AAQ...
-                    if ',' in img_data:
-                        base64_data = img_data.split(',')[1]
-                    else:
-                        # Si no hay coma, intentar extraer después de base64,
-                        base64_data = img_data.split('base64,')[1] if 'base64,' in img_data else img_data
-                    # Convertir a URL
-                    url, file_id = convert_base64_to_url(base64_data, img_name)
-                    images_with_urls.append({
-                        'file': url,
-                        'name': img_name,
-                        'file_id': file_id
-                    })
-                elif isinstance(img_data, str):
-                    # Asumir que es base64 puro
-                    url, file_id = convert_base64_to_url(img_data, img_name)
-                    images_with_urls.append({
-                        'file': url,
-                        'name': img_name,
-                        'file_id': file_id
-                    })
-                else:
-                    print(f"⚠️ Formato de imagen no reconocido para {img_name}, enviando tal cual")
-                    images_with_urls.append(img)
-            except Exception as e:
-                import traceback
-                error_trace = traceback.format_exc()
-                print(f"❌ Error al convertir imagen {img.get('name', 'desconocida')}: {str(e)}")
-                print(f"📋 Traceback completo:\n{error_trace}")
-                # En caso de error, enviar la imagen original
-                images_with_urls.append(img)
+        images_with_urls = convert_entries_concurrently(images, convert_image_entry_to_url)
         
         # Convertir audios base64 a URLs si los hay
         audios = incidence_payload.get('audio', [])
-        audios_with_urls = []
-        
         if audios:
             print(f"🎤 Convirtiendo {len(audios)} audio(s) de base64 a URL...")
-            for audio in audios:
-                try:
-                    audio_data = audio.get('file', '') if isinstance(audio, dict) else audio
-                    audio_name = audio.get('name', 'audio.mp3') if isinstance(audio, dict) else 'audio.mp3'
-                    
-                    # Si ya es una URL, usarla directamente
-                    if isinstance(audio_data, str) and (audio_data.startswith('http://') or audio_data.startswith('https://')):
-                        print(f"✅ Audio ya es URL: {audio_name}")
-                        audios_with_urls.append(audio if isinstance(audio, dict) else {'file': audio_data, 'name': audio_name})
-                    elif isinstance(audio_data, str):
-                        # Si es data URL, extraer el base64
-                        if audio_data.startswith('data:audio') or audio_data.startswith('data:application'):
-                            if ',' in audio_data:
-                                base64_data = audio_data.split(',')[1]
-                            else:
-                                base64_data = audio_data.split('base64,')[1] if 'base64,' in audio_data else audio_data
-                        else:
-                            base64_data = audio_data
-                        # Convertir a URL
-                        url, file_id = convert_base64_to_url(base64_data, audio_name)
-                        audios_with_urls.append({
-                            'file': url,
-                            'name': audio_name,
-                            'file_id': file_id
-                        })
-                    else:
-                        print(f"⚠️ Formato de audio no reconocido, enviando tal cual")
-                        audios_with_urls.append(audio if isinstance(audio, dict) else {'file': audio_data, 'name': audio_name})
-                except Exception as e:
-                    print(f"❌ Error al convertir audio: {str(e)}")
-                    # En caso de error, enviar el audio original
-                    audios_with_urls.append(audio if isinstance(audio, dict) else {'file': audio_data, 'name': audio_name})
+            audios_with_urls = convert_entries_concurrently(audios, convert_audio_entry_to_url)
         else:
             audios_with_urls = audios
         
@@ -711,8 +1049,10 @@ def send_incidence_to_server_with_session(incidence_payload, gtask_auth):
         print(f"🟢 Datos (primeros 200 chars): {json.dumps(datos)[:200]}...")
         url = get_bc_incidences_url()  # Intenta usar GtaskMalla_PostIncidencia, si no existe usa GtaskMalla_PostFijacion
         print(f"🟢 Usando endpoint de incidencias: {url}")
+        if progress_callback:
+            progress_callback('posting_to_bc')
         try:
-            response = requests.post(
+            response = http_client.post(
                 url,
                 params=params,
                 headers=headers,
@@ -783,8 +1123,32 @@ def send_incidence_to_server_with_session(incidence_payload, gtask_auth):
             'error': error_msg
         }
 
-def get_tasks_by_qr_id(qr_id):
-    """Función para consultar tareas por QR ID usando DevuelveArrayTareasxIdQr"""
+def get_tasks_by_qr_id(qr_id, use_cache=True):
+    """
+    Consulta las tareas de un QR ID usando la caché de tareas
+    Solo se guardan en caché las respuestas correctas de BC (incluidas las listas vacías)
+    """
+    if use_cache:
+        cached_tasks = task_cache.get(qr_id)
+        if cached_tasks is not None:
+            print(f"⚡ Tareas de QR ID {qr_id} obtenidas de la caché ({len(cached_tasks)} tareas)")
+            return {
+                'success': True,
+                'tasks': cached_tasks,
+                'cached': True
+            }
+    
+    def load_tasks():
+        tasks_result = fetch_tasks_by_qr_id(qr_id)
+        if tasks_result['success']:
+            task_cache.set(qr_id, tasks_result.get('tasks', []))
+        return tasks_result
+    
+    # Si otro dispositivo ya está consultando este QR, esperar su respuesta en lugar de repetirla
+    return task_queries.do(qr_id, load_tasks)
+
+def fetch_tasks_by_qr_id(qr_id):
+    """Función para consultar tareas por QR ID en BC usando DevuelveArrayTareasxIdQr"""
     try:
         from config import get_bc_url, get_bc_auth_header, BC_CONFIG
         
@@ -822,7 +1186,7 @@ def get_tasks_by_qr_id(qr_id):
         print("====================================")
         
         # Realizar la petición GET a BC
-        response = requests.post(
+        response = http_client.post(
             url,
             params=params,
             headers=headers,
@@ -906,23 +1270,28 @@ def get_tasks_by_qr_id(qr_id):
             'error': error_msg
         }
 
-def send_to_business_central_with_session(qr_id, filename, image_base64, selected_task, gtask_auth):
-    """Función para enviar datos al servidor Business Central usando una sesión específica"""
+def send_to_business_central_with_session(qr_id, filename, image, selected_task, gtask_auth):
+    """
+    Función para enviar datos al servidor Business Central usando una sesión específica
+    
+    Args:
+        image: ImagePayload con la foto (o su base64 como cadena, que se valida aquí)
+    """
     try:
         from config import get_bc_url, get_bc_auth_header, BC_CONFIG
         
-        # Validar que el base64 sea válido
-        try:
-            # Verificar que sea base64 válido
-            base64.b64decode(image_base64)
-            file_id = ''
-            print(f"✅ Base64 válido - Longitud: {len(image_base64)} caracteres")
-        except Exception as e:
-            print(f"❌ Base64 inválido: {str(e)}")
-            return {
-                'success': False,
-                'error': f'Base64 inválido: {str(e)}'
-            }
+        # Validar el base64 si la imagen no viene ya decodificada
+        if not isinstance(image, ImagePayload):
+            try:
+                image = ImagePayload.from_base64(image)
+            except ValueError as e:
+                print(f"❌ {str(e)}")
+                return {
+                    'success': False,
+                    'error': str(e)
+                }
+        file_id = ''
+        print(f"✅ Imagen lista - {image.size} bytes ({image.base64_length} caracteres en base64)")
         
         # Si no se proporciona una tarea seleccionada, consultar las tareas disponibles
         if selected_task is None:
@@ -970,7 +1339,7 @@ def send_to_business_central_with_session(qr_id, filename, image_base64, selecte
         # Crear el documento en el formato esperado por BC
         document_data = {
             "document": {
-                "url": image_base64,  # Solo el base64 puro
+                "url": IMAGE_PLACEHOLDER,  # Solo el base64 puro (se inserta al serializar)
                 "name": filename,
                 "file_id": file_id
             }
@@ -1000,6 +1369,7 @@ def send_to_business_central_with_session(qr_id, filename, image_base64, selecte
         datos = {
             "jsonText": json.dumps(fijacion_data)
         }
+        datos_json = json.dumps(datos)
         
         # URL y parámetros para la petición
         url = get_bc_url()
@@ -1020,24 +1390,25 @@ def send_to_business_central_with_session(qr_id, filename, image_base64, selecte
         print(f"QR ID extraído: {qr_id}")
         print(f"ID Navision: {selected_task['idnavision']}")
         print(f"Empresa: {selected_task['empresa']}")
-        print(f"Base64 longitud: {len(image_base64)} caracteres")
-        print(f"Base64 primeros 50 chars: {image_base64[:50]}...")
-        print(f"Datos enviados: {json.dumps(datos, indent=2)}")
+        print(f"Base64 longitud: {image.base64_length} caracteres")
+        print(f"Base64 primeros 50 chars: {image.base64_bytes[:50].decode('ascii')}...")
+        print(f"Datos enviados: {datos_json}")
         print("=============================================")
         
         # Calcular timeout basado en el tamaño de la imagen
         from config import get_timeout_for_image
-        image_size_mb = len(image_base64) * 0.75 / (1024 * 1024)  # Aproximación del tamaño
+        image_size_mb = image.size_mb
         dynamic_timeout = get_timeout_for_image(image_size_mb)
         
         #print(f"Timeout configurado: {dynamic_timeout} segundos (imagen: {image_size_mb:.2f} MB)")
         
         # Realizar la petición POST a BC
-        response = requests.post(
+        response = http_client.post(
             url,
             params=params,
             headers=headers,
-            data=json.dumps(datos)
+            data=image.embed_in_json(datos_json),
+            timeout=dynamic_timeout
         )
         
         # Verificar si la petición fue exitosa
@@ -1073,6 +1444,88 @@ def send_to_business_central_with_session(qr_id, filename, image_base64, selecte
             'error': error_msg
         }
 
+# ========================================
+# TRABAJOS DE LA COLA EN SEGUNDO PLANO
+# ========================================
+
+class StoredUserAuth:
+    """Autenticación mínima con el usuario que encoló un trabajo (p. ej. tras un reinicio)"""
+    
+    def __init__(self, user_id):
+        self.user_id = user_id
+    
+    def get_current_user_id(self):
+        return self.user_id
+
+def get_job_gtask_auth(device_id, user_id=None):
+    """Obtener la autenticación para un trabajo: la del dispositivo si sigue activa o el usuario guardado"""
+    # Sin crear sesión: el dispositivo pudo hacer logout o caducar mientras el trabajo esperaba
+    device_session = session_manager.find_device_session(device_id)
+    gtask_auth = device_session['gtask_auth'] if device_session is not None else GTaskAuth()
+    if gtask_auth.get_current_user_id() or not user_id:
+        return gtask_auth
+    return StoredUserAuth(user_id)
+
+def run_photo_job(job_id, payload):
+    """Trabajo de la cola: enviar a Business Central una foto guardada en temp_uploads"""
+    job_queue.set_state(job_id, 'converting')
+    image = ImagePayload.from_file(os.path.join(app.config['UPLOAD_FOLDER'], payload['filename']))
+    
+    job_queue.set_state(job_id, 'posting_to_bc')
+    result = process_photo_async(
+        payload['qr_id'],
+        payload['filename'],
+        image,
+        payload.get('qr_data'),
+        payload['device_id'],
+        payload.get('selected_task'),
+        payload.get('user_id')
+    )
+    invalidate_tasks_after_job(payload['qr_id'], result)
+    return result
+
+def run_incidence_job(job_id, payload):
+    """Trabajo de la cola: enviar una incidencia a Business Central"""
+    gtask_auth = get_job_gtask_auth(payload['device_id'], payload.get('user_id'))
+    incidence = payload['incidence']
+    result = send_incidence_to_server_with_session(
+        incidence,
+        gtask_auth,
+        progress_callback=lambda state: job_queue.set_state(job_id, state)
+    )
+    # La incidencia no trae QR ID: se usa el de la parada si lo hay ("PARADA_P1171" -> "P1171")
+    invalidate_tasks_after_job(incidence.get('qr_id') or (incidence.get('resource') or '').replace('PARADA_', ''), result)
+    return result
+
+def invalidate_tasks_after_job(qr_id, result):
+    """Quitar de la caché las tareas de un QR cuando un envío a BC ha ido bien (pueden haber cambiado)"""
+    if qr_id and result and result.get('success'):
+        task_cache.invalidate(qr_id)
+        print(f"🧹 Caché de tareas invalidada para QR ID: {qr_id}")
+
+job_queue.register_handler('photo', run_photo_job)
+job_queue.register_handler('incidence', run_incidence_job)
+
+def wait_for_job_result(job_id):
+    """Esperar el resultado de un trabajo; devuelve None si sigue en cola al agotar el tiempo"""
+    job = job_queue.wait_for(job_id, JOB_QUEUE_CONFIG['wait_timeout'])
+    if job and job['state'] in ('done', 'failed'):
+        return job['result'] or {'success': False, 'error': job['error']}
+    return None
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def jobs_stats():
+    """API para consultar la profundidad de la cola de trabajos"""
+    return jsonify({'success': True, 'queue': job_queue.get_stats()})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """API para consultar el estado de un trabajo en cola"""
+    job = job_queue.get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify({'success': True, 'job': job})
+
 @app.route('/api/upload-to-server', methods=['POST'])
 def upload_to_server():
     """API para subir la foto al servidor principal (mantenido por compatibilidad)"""
@@ -1112,24 +1565,50 @@ def upload_to_server():
     except Exception as e:
         return jsonify({'error': f'Error interno: {str(e)}'}), 500
 
+@app.route('/api/upload-photo', methods=['POST'])
+def upload_photo():
+    """
+    Subida de una foto en binario, sin base64
+    
+    Acepta el cuerpo en bruto (Content-Type: image/jpeg o image/png) o multipart
+    con la parte 'image'. La foto se guarda en disco por bloques y se devuelve su
+    upload_id para usarlo en /api/process-photo y /api/process-photo-with-task.
+    """
+    try:
+        if request.mimetype in ('image/jpeg', 'image/png'):
+            upload = save_photo_stream(request.stream)
+        elif 'image' in request.files:
+            upload = save_photo_stream(request.files['image'].stream)
+        else:
+            return jsonify({'success': False, 'error': 'No se proporcionó imagen'}), 400
+        
+        return jsonify({'success': True, **upload.to_dict()})
+        
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Error al subir la foto: {str(e)}'}), 500
+
 @app.route('/api/get-tasks-by-qr', methods=['POST'])
 def get_tasks_by_qr():
     """API para consultar tareas por QR ID"""
     try:
         data = request.get_json()
         qr_id = data.get('qr_id')
+        refresh = bool(data.get('refresh', False))  # Forzar consulta a BC sin caché
         
         if not qr_id:
             return jsonify({'error': 'QR ID es requerido'}), 400
         
         # Consultar tareas
-        tasks_result = get_tasks_by_qr_id(qr_id)
+        tasks_result = get_tasks_by_qr_id(qr_id, use_cache=not refresh)
         
         if tasks_result['success']:
             return jsonify({
                 'success': True,
                 'tasks': tasks_result.get('tasks', []),
-                'count': len(tasks_result.get('tasks', []))
+                'count': len(tasks_result.get('tasks', [])),
+                'cached': tasks_result.get('cached', False)
             })
         else:
             return jsonify({
@@ -1140,6 +1619,25 @@ def get_tasks_by_qr():
     except Exception as e:
         return jsonify({'error': f'Error interno: {str(e)}'}), 500
 
+@app.route('/api/tasks-cache', methods=['GET'])
+def tasks_cache_stats():
+    """API para consultar los contadores de la caché de tareas"""
+    return jsonify({
+        'success': True,
+        'cache': task_cache.get_stats(),
+        'coalescing': task_queries.get_stats()
+    })
+
+@app.route('/api/tasks-cache/invalidate', methods=['POST'])
+def tasks_cache_invalidate():
+    """API para invalidar la caché de tareas de un QR ID (o toda si no se indica)"""
+    data = request.get_json(silent=True) or {}
+    qr_id = data.get('qr_id')
+    if qr_id:
+        qr_id = extract_qr_id(qr_id)
+    task_cache.invalidate(qr_id)
+    return jsonify({'success': True, 'invalidated': qr_id or 'all'})
+
 @app.route('/api/convert-photo-to-url', methods=['POST'])
 def convert_photo_to_url():
     """
@@ -1157,11 +1655,15 @@ def convert_photo_to_url():
         if not image_data:
             return jsonify({'success': False, 'error': 'No se proporcionó imagen'}), 400
         
-        # Normalizar base64 usando la función helper
-        base64_data = clean_and_validate_base64(image_data)
+        # Decodificar (validando el base64) y normalizar la imagen si supera los límites
+        image = ImagePayload.from_base64(image_data)
+        normalized = normalize_photo(image.data)
+        if normalized is not None:
+            image = ImagePayload(normalized.data)
+            filename = os.path.splitext(filename)[0] + normalized.extension
         
         # Convertir a URL
-        url, file_id = convert_base64_to_url(base64_data, filename)
+        url, file_id = convert_base64_to_url(image.base64_bytes.decode('ascii'), filename)
         
         return jsonify({
             'success': True,
@@ -1201,61 +1703,46 @@ def delete_photo_url():
             print(f"🗑️ URL de la foto: {url}")
         
         # URL del servicio de eliminación
-        delete_url = 'https://base64-api.deploy.malla.es/delete'
+        delete_url = BASE64_API_CONFIG['delete_url']
         
         # Preparar el payload con el file_id
         payload = {
             '_id': file_id
         }
         
-        # Hacer la petición DELETE con reintentos
-        max_retries = 3
-        retry_delay = 5  # segundos
+        def delete_attempt(timeout):
+            response = http_client.delete(
+                delete_url,
+                json=payload,
+                timeout=timeout,
+                headers={'Content-Type': 'application/json'}
+            )
+            if response.status_code not in (200, 204, 404):
+                raise RetryableError(f'Request failed with status code {response.status_code}')
+            return response
         
-        for attempt in range(max_retries):
-            try:
-                response = requests.delete(
-                    delete_url,
-                    json=payload,
-                    timeout=30,
-                    headers={'Content-Type': 'application/json'}
-                )
-                
-                if response.status_code == 200 or response.status_code == 204:
-                    print(f"✅ Foto eliminada exitosamente del servidor (ID: {file_id})")
-                    return jsonify({
-                        'success': True,
-                        'message': 'Foto eliminada exitosamente del servidor'
-                    })
-                elif response.status_code == 404:
-                    # La foto ya no existe, considerar como éxito
-                    print(f"⚠️ Foto no encontrada en el servidor (ID: {file_id}) - ya eliminada")
-                    return jsonify({
-                        'success': True,
-                        'message': 'Foto no encontrada (ya eliminada)'
-                    })
-                else:
-                    error_msg = f'Request failed with status code {response.status_code}'
-                    print(f"⚠️ Error al eliminar foto (intento {attempt + 1}/{max_retries}): {error_msg}")
-                    if attempt < max_retries - 1:
-                        import time
-                        time.sleep(retry_delay)
-                        continue
-                    else:
-                        raise Exception(f'Error al eliminar el archivo después de {max_retries} intentos: {error_msg}')
-                
-            except requests.exceptions.RequestException as e:
-                print(f"⚠️ Error en intento {attempt + 1}/{max_retries}: {str(e)}")
-                if attempt < max_retries - 1:
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    error_msg = f'Error al eliminar foto después de {max_retries} intentos: {str(e)}'
-                    print(f"❌ {error_msg}")
-                    raise Exception(error_msg)
+        # Hacer la petición DELETE con reintentos (backoff exponencial con jitter)
+        try:
+            response = get_policy('base64_delete').execute(delete_attempt)
+        except (RetryError, CircuitOpenError) as e:
+            raise Exception(f'Error al eliminar el archivo: {str(e)}')
         
-        # Si llegamos aquí, algo salió mal
-        raise Exception('Error al eliminar foto: se agotaron los intentos')
+        # El archivo ya no existe: no reutilizar su URL en futuras subidas
+        saved_uploads.remove_if(lambda saved: saved[1] == file_id)
+        
+        # La foto ya eliminada (404) también se considera éxito
+        if response.status_code == 404:
+            print(f"⚠️ Foto no encontrada en el servidor (ID: {file_id}) - ya eliminada")
+            return jsonify({
+                'success': True,
+                'message': 'Foto no encontrada (ya eliminada)'
+            })
+        
+        print(f"✅ Foto eliminada exitosamente del servidor (ID: {file_id})")
+        return jsonify({
+            'success': True,
+            'message': 'Foto eliminada exitosamente del servidor'
+        })
         
     except Exception as e:
         print(f"❌ Error al eliminar foto (rollback): {str(e)}")
@@ -1269,10 +1756,10 @@ def process_photo_with_task():
     """API para procesar foto con tarea seleccionada"""
     try:
         qr_data = request.form.get('qr_data')
-        image_data = request.form.get('image_data')
         selected_task_json = request.form.get('selected_task')
+        has_image = 'image' in request.files or request.form.get('image_data') or request.form.get('upload_id')
         
-        if not all([qr_data, image_data, selected_task_json]):
+        if not all([qr_data, has_image, selected_task_json]):
             return jsonify({'error': 'Faltan datos requeridos'}), 400
         
         # Parsear la tarea seleccionada
@@ -1284,35 +1771,36 @@ def process_photo_with_task():
         # Extraer el ID del QR
         qr_id = extract_qr_id(qr_data)
         
-        # Procesar imagen
-        image_base64 = clean_and_validate_base64(image_data)
-        
-        # Comprimir imagen si es necesario
-        from config import BC_CONFIG
-        image_bytes = base64.b64decode(image_base64)
-        compressed_image_bytes = compress_image(
-            image_bytes, 
-            quality=BC_CONFIG['compress_quality'],
-            max_size_mb=BC_CONFIG['max_image_size_mb']
-        )
-        image_base64 = base64.b64encode(compressed_image_bytes).decode('utf-8')
-        
-        # Generar nombre de archivo
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        unique_id = str(uuid.uuid4())[:8]
-        filename = f"photo_{timestamp}_{unique_id}.jpg"
-        
-        # Guardar imagen temporalmente
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        with open(filepath, 'wb') as f:
-            f.write(compressed_image_bytes)
+        # Guardar la imagen en temp_uploads (binaria por bloques o base64)
+        try:
+            filename = store_request_photo()
+        except ValueError as e:
+            return jsonify({'error': f'Formato de imagen inválido: {str(e)}'}), 400
         
         # Obtener la sesión del dispositivo actual
+        device_id = session_manager.get_device_id_from_request(request)
         device_session = get_current_device_session()
         gtask_auth = device_session['gtask_auth']
         
-        # Enviar a Business Central con la tarea seleccionada
-        bc_response = send_to_business_central_with_session(qr_id, filename, image_base64, selected_task, gtask_auth)
+        # Encolar el envío a Business Central con la tarea seleccionada y esperar el resultado
+        job_id = job_queue.enqueue('photo', {
+            'qr_id': qr_id,
+            'filename': filename,
+            'qr_data': qr_data,
+            'device_id': device_id,
+            'user_id': gtask_auth.get_current_user_id(),
+            'selected_task': selected_task
+        }, job_id=filename)
+        bc_response = wait_for_job_result(job_id)
+        
+        if bc_response is None:
+            return jsonify({
+                'success': True,
+                'message': 'Foto procesada. Se enviará a Business Central en segundo plano.',
+                'filename': filename,
+                'job_id': job_id,
+                'status': 'processing_in_background'
+            }), 202
         
         if bc_response['success']:
             return jsonify({
@@ -1369,10 +1857,24 @@ def process_audio():
         if not audio_base64:
             return jsonify({'success': False, 'error': 'No se proporcionó audio'}), 400
 
+        # Una nota de voz reenviada devuelve el resultado anterior sin transcribir de nuevo
+        cache_key = None
+        try:
+            cache_key = ai_result_cache.make_key('audio', base64.b64decode(audio_base64.split(',')[-1]),
+                                                 AUDIO_RESULT_VERSION)
+        except (ValueError, TypeError):
+            pass
+        if cache_key:
+            cached_result = ai_result_cache.get('audio', cache_key)
+            if cached_result:
+                print(f"⚡ Resultado de audio en caché: {cached_result['stop_number']}")
+                return jsonify(dict(cached_result, success=True, cached=True, timings=None))
+
         print("🎤 Procesando audio con Whisper...")
         
-        # Procesar audio con Whisper
-        whisper_result = process_audio_with_whisper(audio_base64)
+        # Procesar audio con Whisper (con la cola llena se responde 503 sin esperar)
+        with whisper_admission.slot() as ticket:
+            whisper_result = process_audio_with_whisper(audio_base64)
         
         if not whisper_result['success']:
             return jsonify({
@@ -1387,18 +1889,102 @@ def process_audio():
         print(f"🎤 Texto transcrito: {transcribed_text}")
         print(f"🚏 Información extraída: {stop_info}")
         
-        return jsonify({
-            'success': True,
+        result = {
             'transcribed_text': transcribed_text,
             'stop_number': stop_info['stop_number'],
             'description': stop_info['description'],
+            'extraction_tier': stop_info['tier'],
             'language': whisper_result.get('language', 'es')
-        })
+        }
+        # Sin número de parada no se guarda: el siguiente intento vuelve a consultar al modelo
+        if cache_key and result['stop_number']:
+            ai_result_cache.set(cache_key, result)
+        
+        return jsonify(dict(result, success=True, cached=False, timings=whisper_result.get('timings'),
+                            admission=ticket.to_dict()))
 
+    except BackendSaturatedError as e:
+        return saturated_response(e)
     except Exception as e:
         print(f"❌ Error procesando audio: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/transcription/stats', methods=['GET'])
+def transcription_stats():
+    """API para consultar el estado del pool de modelos Whisper y sus tiempos medios"""
+    return jsonify({
+        'success': True,
+        'whisper': whisper_pool.get_stats(),
+        'batching': whisper_batcher.get_stats(),
+        'stop_extraction': stop_extractor.get_stats()
+    })
+
+@app.route('/api/admission/stats', methods=['GET'])
+def admission_stats():
+    """API para consultar la ocupación y las colas de LM Studio y Whisper"""
+    return jsonify({
+        'success': True,
+        'lm_studio': lm_studio_admission.get_stats(),
+        'whisper': whisper_admission.get_stats()
+    })
+
+@app.route('/api/vision/stats', methods=['GET'])
+def vision_stats():
+    """API para consultar la caché de fotos preparadas para el modelo de visión"""
+    return jsonify({
+        'success': True,
+        'preprocess': vision_preprocessor.get_stats(),
+        'result_cache': ai_result_cache.get_stats(),
+        'streaming': vision_stream_metrics.get_stats()
+    })
+
+def image_result_cache_key(image_base64):
+    """Clave de la caché de resultados para una foto en base64, o None si no es válida"""
+    if not isinstance(image_base64, str):
+        return None
+    try:
+        return ai_result_cache.make_key('image', base64.b64decode(image_base64.split(',')[-1]),
+                                        VISION_RESULT_VERSION)
+    except ValueError:
+        return None
+
+@app.route('/api/process-image-ai/stream', methods=['POST'])
+def process_image_ai_stream():
+    """
+    Igual que /api/process-image-ai, pero la respuesta es un stream de Server-Sent Events:
+    'partial' con la parada y la descripción según las escribe el modelo y
+    'result' (o 'error') con el resultado final
+    """
+    if not request.is_json:
+        return jsonify({'success': False, 'error': 'Se requiere JSON en el cuerpo'}), 400
+
+    image_base64 = request.get_json().get('image')
+    if not image_base64 or not isinstance(image_base64, str):
+        return jsonify({'success': False, 'error': 'No se proporcionó imagen'}), 400
+
+    cache_key = image_result_cache_key(image_base64)
+    cached_result = ai_result_cache.get('image', cache_key) if cache_key else None
+    if cached_result:
+        print(f"⚡ Análisis de imagen en caché: {cached_result['stop_number']}")
+        events = [format_sse('result', dict(cached_result, success=True, cached=True))]
+        ticket = None
+    else:
+        # La plaza se pide antes de empezar el stream para poder responder 503
+        try:
+            ticket = lm_studio_admission.acquire()
+        except BackendSaturatedError as e:
+            return saturated_response(e)
+        events = stream_with_context(stream_image_with_lm_studio(image_base64, cache_key, ticket))
+
+    response = Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Que Nginx no acumule los eventos
+    })
+    if ticket:
+        # Se libera al cerrar la respuesta, también si el navegador corta la conexión
+        response.call_on_close(lambda: lm_studio_admission.release(ticket))
+    return response
+
 @app.route('/api/process-image-ai', methods=['POST'])
 def process_image_ai():
     """
@@ -1424,10 +2010,19 @@ def process_image_ai():
         else:
             print(f"⚠️ Imagen recibida en formato no esperado: {type(image_base64)}")
 
+        # Un reintento con la misma foto devuelve el análisis anterior sin llamar al modelo
+        cache_key = image_result_cache_key(image_base64)
+        if cache_key:
+            cached_result = ai_result_cache.get('image', cache_key)
+            if cached_result:
+                print(f"⚡ Análisis de imagen en caché: {cached_result['stop_number']}")
+                return jsonify(dict(cached_result, success=True, cached=True))
+
         print("🤖 Procesando imagen con LM Studio...")
         
-        # Procesar imagen con LM Studio
-        ai_result = process_image_with_lm_studio(image_base64)
+        # Procesar imagen con LM Studio (con la cola llena se responde 503 sin esperar)
+        with lm_studio_admission.slot() as ticket:
+            ai_result = process_image_with_lm_studio(image_base64)
         
         if not ai_result['success']:
             return jsonify({
@@ -1446,13 +2041,19 @@ def process_image_ai():
         if not desc or desc.strip() == '':
             desc = 'Sin incidencia visible'
         
-        return jsonify({
-            'success': True,
+        result = {
             'stop_number': stop_num,
             'description': desc,
             'raw_response': ai_result.get('raw_response', '')
-        })
+        }
+        # Sin número de parada no se guarda: el siguiente intento vuelve a consultar al modelo
+        if cache_key and stop_num:
+            ai_result_cache.set(cache_key, result)
+        
+        return jsonify(dict(result, success=True, cached=False, admission=ticket.to_dict()))
 
+    except BackendSaturatedError as e:
+        return saturated_response(e)
     except Exception as e:
         print(f"❌ Error procesando imagen con IA: {e}")
         import traceback
@@ -1544,9 +2145,23 @@ def create_incidence():
             print(f"📋 Traceback completo:\n{error_trace}")
             return jsonify({'success': False, 'error': f'Error al obtener sesión: {str(e)}'}), 500
         
-        # Enviar incidencia
+        # Encolar incidencia y esperar el resultado
         try:
-            result = send_incidence_to_server_with_session(payload, gtask_auth)
+            device_id = session_manager.get_device_id_from_request(request)
+            job_id = job_queue.enqueue('incidence', {
+                'incidence': payload,
+                'device_id': device_id,
+                'user_id': gtask_auth.get_current_user_id()
+            })
+            result = wait_for_job_result(job_id)
+            if result is None:
+                return jsonify({
+                    'success': True,
+                    'message': 'Incidencia encolada. Se enviará a Business Central en segundo plano.',
+                    'job_id': job_id,
+                    'status': 'processing_in_background'
+                }), 202
+            result['job_id'] = job_id
             status = 200 if result.get('success') else 500
             return jsonify(result), status
         except Exception as e:
@@ -1613,7 +2228,7 @@ def test_bc_connection():
         print("=============================================")
         
         # Realizar la petición POST a BC
-        response = requests.post(
+        response = http_client.post(
             url,
             params=params,
             headers=headers,
@@ -1701,7 +2316,6 @@ def gtask_get_users():
         # Obtener la sesión del dispositivo actual
         device_session = get_current_device_session()
         gtask_auth = device_session['gtask_auth']
-        mobile_storage = device_session['mobile_storage']
         
         # Verificar si hay sesión activa
         if not device_session['user_data']:
@@ -1711,6 +2325,7 @@ def gtask_get_users():
             }), 401
         
         print(f"👥 Obteniendo lista de usuarios para: {device_session['user_data'].get('username')}")
+        mobile_storage = device_session['mobile_storage']
         
         # Intentar obtener del cache local primero
         cached_users = mobile_storage.get_users_list()
@@ -1752,15 +2367,15 @@ def gtask_logout():
         # Obtener la sesión del dispositivo actual
         device_session = get_current_device_session()
         gtask_auth = device_session['gtask_auth']
-        mobile_storage = device_session['mobile_storage']
         
         username = device_session['user_data'].get('username', 'Usuario') if device_session['user_data'] else 'Usuario'
         
         # Limpiar sesión del dispositivo
         device_session['user_data'] = None
         
-        # Limpiar almacenamiento móvil del dispositivo
-        mobile_storage.clear_user_session()
+        # Limpiar almacenamiento móvil del dispositivo (aunque no haya sesión en memoria
+        # puede quedar una guardada que /api/gtask/status restauraría)
+        device_session['mobile_storage'].clear_user_session()
         
         # Limpiar autenticador del dispositivo
         gtask_auth.logout()
@@ -1786,7 +2401,6 @@ def gtask_status():
         # Obtener la sesión del dispositivo actual
         device_session = get_current_device_session()
         gtask_auth = device_session['gtask_auth']
-        mobile_storage = device_session['mobile_storage']
         
         # Verificar si hay sesión activa en el dispositivo
         if device_session['user_data']:
@@ -1804,7 +2418,7 @@ def gtask_status():
             else:
                 # Token expirado, limpiar sesión del dispositivo
                 device_session['user_data'] = None
-                mobile_storage.clear_user_session()
+                device_session['mobile_storage'].clear_user_session()
                 gtask_auth.logout()
                 
                 return jsonify({
@@ -1814,6 +2428,7 @@ def gtask_status():
                 })
         
         # Si no hay sesión activa, verificar en almacenamiento móvil del dispositivo
+        mobile_storage = device_session['mobile_storage']
         user_session = mobile_storage.get_user_session()
         if user_session and user_session.get('user_id') and user_session.get('username'):
             # Verificar si la sesión móvil no ha expirado
@@ -1859,6 +2474,14 @@ def gtask_status():
             'error': f'Error interno: {str(e)}'
         }), 500
 
+@app.route('/api/sessions/stats', methods=['GET'])
+def sessions_stats():
+    """API para consultar el tamaño de las tablas de sesiones por dispositivo"""
+    return jsonify({
+        'success': True,
+        'sessions': session_manager.get_stats()
+    })
+
 @app.route('/api/gtask/storage-info', methods=['GET'])
 def gtask_storage_info():
     """API para obtener información del almacenamiento móvil"""
@@ -1870,7 +2493,8 @@ def gtask_storage_info():
         storage_info = mobile_storage.get_storage_info()
         return jsonify({
             'success': True,
-            'storage_info': storage_info
+            'storage_info': storage_info,
+            'write_behind': mobile_storage_writer.get_stats()
         })
         
     except Exception as e:
@@ -1880,34 +2504,63 @@ def gtask_storage_info():
             'error': f'Error interno: {str(e)}'
         }), 500
 
+# Mensajes de estado de las subidas en segundo plano
+UPLOAD_STATUS_MESSAGES = {
+    'queued': 'En cola para enviar a Business Central',
+    'running': 'Procesando',
+    'converting': 'Preparando archivos',
+    'posting_to_bc': 'Enviando a Business Central',
+    'done': 'Archivo procesado y enviado a Business Central',
+    'failed': 'Error al enviar a Business Central'
+}
+
+# Máximo de segundos que una petición de estado puede quedarse esperando (long-poll)
+UPLOAD_STATUS_MAX_WAIT = 30
+
 @app.route('/health')
 def health_check():
     """Endpoint de verificación de salud"""
-    return jsonify({'status': 'OK', 'timestamp': datetime.now().isoformat()})
+    return jsonify({
+        'status': 'OK',
+        'timestamp': datetime.now().isoformat(),
+        'upstreams': get_retry_stats()
+    })
 
 @app.route('/api/upload-status/<filename>', methods=['GET'])
 def upload_status(filename):
-    """API para verificar el estado de una subida en segundo plano"""
+    """
+    API para verificar el estado de una subida en segundo plano
+    Admite long-poll: ?since=<último estado>&wait=<segundos> espera hasta que el estado cambie
+    """
     try:
-        # Por ahora, solo verificamos si el archivo existe
-        # En una implementación más avanzada, podrías usar Redis o una base de datos
-        # para rastrear el estado real de las subidas
+        since_state = request.args.get('since')
+        wait_seconds = min(request.args.get('wait', 0, type=float), UPLOAD_STATUS_MAX_WAIT)
         
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(filepath):
-            return jsonify({
-                'success': True,
-                'filename': filename,
-                'status': 'file_processed',
-                'message': 'Archivo procesado y enviado a Business Central'
-            })
+        # El ID del trabajo de una foto es su nombre de archivo
+        if since_state and wait_seconds > 0:
+            job = job_queue.wait_for_change(filename, since_state, wait_seconds)
         else:
+            job = job_queue.get_job(filename)
+        
+        if not job:
             return jsonify({
                 'success': False,
                 'filename': filename,
                 'status': 'file_not_found',
-                'message': 'Archivo no encontrado'
+                'message': 'No hay ninguna subida registrada con este nombre'
             })
+        
+        return jsonify({
+            'success': True,
+            'filename': filename,
+            'job_id': job['id'],
+            'status': job['state'],
+            'message': UPLOAD_STATUS_MESSAGES.get(job['state'], job['state']),
+            'error': job['error'],
+            'attempts': job['attempts'],
+            'timestamps': job['timestamps'],
+            'bc_response': job['result']
+        })
             
     except Exception as e:
         return jsonify({
@@ -1917,22 +2570,10 @@ def upload_status(filename):
 
 # Función para limpiar sesiones expiradas periódicamente
 def cleanup_expired_sessions():
-    """Limpiar sesiones expiradas cada hora"""
-    import threading
-    import time
-    
-    def cleanup_loop():
-        while True:
-            try:
-                session_manager.cleanup_expired_sessions()
-                time.sleep(3600)  # Cada hora
-            except Exception as e:
-                print(f"Error en limpieza de sesiones: {e}")
-                time.sleep(3600)
-    
-    # Iniciar hilo de limpieza en segundo plano
-    cleanup_thread = threading.Thread(target=cleanup_loop, daemon=True)
-    cleanup_thread.start()
+    """Limpiar sesiones expiradas cada SESSION_STORE_CONFIG['cleanup_interval'] segundos"""
+    # Iniciar hilo de limpieza en segundo plano; se detiene al apagar
+    session_manager.start_cleanup(SESSION_STORE_CONFIG['cleanup_interval'])
+    atexit.register(session_manager.stop_cleanup)
 
 # Función para procesar audio con Whisper (basada en el script funcional)
 def process_audio_with_whisper(audio_base64):
@@ -1940,51 +2581,26 @@ def process_audio_with_whisper(audio_base64):
     Procesa audio usando Whisper para obtener transcripción
     Basado en el script funcional de transcribe_audio.py
     """
-    if not WHISPER_AVAILABLE:
+    if not transcription_backend.available:
         return {
             'success': False,
-            'error': 'Whisper no está instalado. Por favor, ejecuta install_whisper.bat para instalarlo.'
+            'error': transcription_backend.install_hint
         }
     
-    temp_file_path = None
-    
     try:
-        # Agregar FFmpeg al PATH si no está disponible (como en el script funcional)
-        ffmpeg_path = os.path.join(os.getcwd(), "ffmpeg", "ffmpeg-master-latest-win64-gpl", "bin")
-        if ffmpeg_path not in os.environ["PATH"]:
-            os.environ["PATH"] = ffmpeg_path + os.pathsep + os.environ["PATH"]
-            print(f"🔧 FFmpeg agregado al PATH: {ffmpeg_path}")
-        
-        # Decodificar audio base64
+        # Decodificar audio base64 y después el audio comprimido (webm/ogg/mp4) a 16 kHz en memoria
         audio_data = base64.b64decode(audio_base64.split(',')[1])
-        
-        # Crear archivo temporal con extensión .wav (formato que funciona con Whisper)
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-            temp_file.write(audio_data)
-            temp_file_path = temp_file.name
-        
-        # Verificar que el archivo existe
-        if not os.path.exists(temp_file_path):
-            print(f"❌ Error: El archivo '{temp_file_path}' no existe.")
-            return {
-                'success': False,
-                'error': 'Archivo de audio no encontrado'
-            }
-
-        # Obtener información del archivo
-        file_size = os.path.getsize(temp_file_path)
-        print(f"📁 Archivo encontrado: {temp_file_path} ({file_size} bytes)")
-
-        print(f"🔄 Cargando modelo Whisper 'base'...")
-        # Cargar el modelo
-        model = whisper.load_model("base")
-
-        print(f"🎤 Transcribiendo '{temp_file_path}'...")
-        # Transcribir el audio con initial_prompt para guiar la transcripción de números
-        # El initial_prompt ayuda a Whisper a entender mejor el contexto y transcribir números como dígitos
-        result = model.transcribe(
-            temp_file_path, 
-            language="es")
+        decode_start = time.perf_counter()
+        samples = audio_decoder.decode(audio_data)
+        decode_time = time.perf_counter() - decode_start
+        print(f"🔊 Audio decodificado: {len(audio_data)} bytes → {audio_decoder.duration(samples):.1f}s ({audio_decoder.backend})")
+
+        print(f"🎤 Transcribiendo nota de voz...")
+        # Transcribir con un modelo ya cargado del pool, en lote con las notas que lleguen a la vez
+        result, timings = whisper_batcher.transcribe(samples)
+        timings['decode'] = round(decode_time, 3)
+        print(f"⏱️ {transcription_backend.name} - decodificación: {timings['decode']}s, carga: {timings['load']}s, "
+              f"espera: {timings['queue_wait']}s, inferencia: {timings['inference']}s (lote de {timings['batch_size']})")
 
         # Obtener el texto transcrito
         transcription = result["text"].strip()
@@ -1993,12 +2609,13 @@ def process_audio_with_whisper(audio_base64):
         #transcription = convert_numbers_to_digits(transcription)
         # remplazar , por espacios y guiones por espacios
         transcription = transcription.replace(',', ' ').replace('-', ' ')
-        print(f"🎤 Whisper transcripción: {transcription}")
+        print(f"🎤 Transcripción ({transcription_backend.name}): {transcription}")
         
         return {
             'success': True,
             'text': transcription,
-            'language': result.get('language', 'es')
+            'language': result.get('language', 'es'),
+            'timings': timings
         }
         
     except Exception as e:
@@ -2010,29 +2627,43 @@ def process_audio_with_whisper(audio_base64):
             'success': False,
             'error': str(e)
         }
-    finally:
-        # Limpiar archivo temporal
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-                print(f"🗑️ Archivo temporal eliminado: {temp_file_path}")
-            except Exception as e:
-                print(f"⚠️ Error eliminando archivo temporal {temp_file_path}: {e}")
 
 
 
 # Función para extraer información de parada del texto
-def extract_stop_info(text):
+def extract_stop_info(text, llm_fallback=True):
     """
     Extrae el número de parada y descripción del texto transcrito
+
+    Usa primero el parser de reglas (stop_parser) y solo consulta LM Studio
+    si su confianza es baja; 'tier' indica qué nivel respondió. Con
+    llm_fallback=False solo se usan las reglas.
+    """
+    return stop_extractor.extract(text, llm_fallback=llm_fallback)
+
+# Modelo y prompt de LM Studio para extraer la parada de un texto
+STOP_TEXT_MODEL = "qwen/qwen3-4b-2507"
+STOP_TEXT_PROMPT = 'Puedes devolverme un json con el número de parada (sin espacios) y, la incidencia de este texto: '
+
+# Versión de los resultados de /api/process-audio en la caché (motor, modelo y extracción)
+AUDIO_RESULT_VERSION = '|'.join([
+    TRANSCRIPTION_CONFIG['engine'], TRANSCRIPTION_CONFIG['model'], TRANSCRIPTION_CONFIG['language'],
+    STOP_TEXT_MODEL, hashlib.sha256(STOP_TEXT_PROMPT.encode('utf-8')).hexdigest()[:12],
+    str(STOP_EXTRACTION_CONFIG['min_confidence'])
+])
+
+# Extracción con LM Studio (nivel lento de extract_stop_info)
+def extract_stop_info_with_llm(text):
+    """
+    Extrae el número de parada y descripción del texto transcrito con LM Studio
     """
     import re
      # URL de LM Studio (puerto por defecto)
-    lm_studio_url = "http://192.168.10.253:1234/v1/chat/completions"
+    lm_studio_url = LM_STUDIO_URL
         
         # Prompt para Llava - Versión que FUNCIONÓ (según el usuario)
         # El modelo primero describe lo que ve y luego extrae la información
-    prompt ='Puedes devolverme un json con el número de parada (sin espacios) y, la incidencia de este texto: ' + text
+    prompt = STOP_TEXT_PROMPT + text
     prompt_with_system = prompt
         
     messages = [
@@ -2051,7 +2682,7 @@ def extract_stop_info(text):
     # (algunos modelos de LM Studio pueden no ser multimodales)
     # Ajustes para Gemma 3 27B: modelo más grande requiere más tokens y tiempo
     payload = {
-        "model": "qwen/qwen3-4b-2507",  # LM Studio usa este nombre genérico
+        "model": STOP_TEXT_MODEL,  # LM Studio usa este nombre genérico
         "messages": messages,
         "temperature": 0.2,  # Temperatura más baja para respuestas más consistentes con Gemma
         "max_tokens": 800  # Aumentar tokens para Gemma 3 27B (modelo más grande)
@@ -2071,12 +2702,13 @@ def extract_stop_info(text):
         import time
         start_time = time.time()
         
-        response = requests.post(
-            lm_studio_url,
-            json=payload,
-            timeout=60,  # Timeout aumentado a 60s para modelos grandes que pueden tardar más
-            headers={'Content-Type': 'application/json'}
-        )
+        with lm_studio_admission.slot():
+            response = http_client.post(
+                lm_studio_url,
+                json=payload,
+                timeout=60,  # Timeout aumentado a 60s para modelos grandes que pueden tardar más
+                headers={'Content-Type': 'application/json'}
+            )
         
         elapsed_time = time.time() - start_time
         print(f"⏱️ Tiempo transcurrido: {elapsed_time:.2f} segundos")
@@ -2098,112 +2730,33 @@ def extract_stop_info(text):
             print(f"🤖 Respuesta completa de LM Studio (TEXT): {content}")
             print(f"📏 Longitud de la respuesta: {len(content)} caracteres")
             
-            # Guardar el contenido original
-            original_content = content
-            #"content": "{\n  \"numero_de_parada\": 625,\n  \"incidencia\": \"Cristal roto\"\n}
-            
-            # Intentar extraer JSON del contenido
-            # Buscar JSON dentro de bloques ```json ... ``` o ``` ... ```
-            code_block_match = re.search(r'```(?:json)?\s*(\{[\s\S]*?)\s*```', content, re.DOTALL)
-            if code_block_match:
-                extracted_json = code_block_match.group(1)
-                print(f"✅ JSON extraído de bloque de código markdown")
-                content = extracted_json
-            
-            # Intentar encontrar JSON con stop_number y description
-            json_match = re.search(r'\{[\s\S]*?"(?:stop_number|Numero de parada|numero de parada|Número de parada)"[\s\S]*?"(?:description|descripci[oó]n de la incidencia|descripcion de la incidencia)"[\s\S]*?\}', content, re.DOTALL)
-            
-            if not json_match:
-                # Intentar encontrar JSON que empiece con stop_number
-                json_match = re.search(r'\{[\s\S]*?"(?:stop_number|Numero de parada|numero de parada|Número de parada)"[\s\S]*?\}', content, re.DOTALL)
+            parsed = parse_lm_response(content, default_description='Incidencia reportada por audio')
+            if not parsed.has_json:
+                # Si no se encontró JSON, intentar extraer información con regex del texto original
+                print("⚠️ No se encontró JSON válido, intentando extracción manual del texto...")
+                return extract_stop_info_fallback(content)
             
-            if json_match:
-                json_str = json_match.group(0)
-                print(f"✅ JSON encontrado: {json_str[:500]}...")
-                import json as json_lib
-                ai_data = None
-                try:
-                    # Intentar parsear el JSON
-                    ai_data = json_lib.loads(json_str)
-                    print(f"✅ JSON parseado correctamente")
-                except json_lib.JSONDecodeError as e:
-                    print(f"⚠️ Error parseando JSON: {e}")
-                    print(f"⚠️ Intentando extraer campos manualmente...")
-                    # Extraer campos manualmente con regex
-                    stop_num_match = re.search(r'"(?:stop_number|parada|Numero de parada|numero de parada|Número de parada)"\s*:\s*"([^"]+)"', json_str, re.IGNORECASE)
-                    desc_match = re.search(r'"(?:description|incidencia|descripci[oó]n de la incidencia|descripcion de la incidencia|descripci[oó]n)"\s*:\s*"([^"]*)"', json_str, re.IGNORECASE | re.DOTALL)
-                    
-                    if stop_num_match or desc_match:
-                        ai_data = {}
-                        if stop_num_match:
-                            ai_data['stop_number'] = stop_num_match.group(1)
-                        if desc_match:
-                            ai_data['description'] = desc_match.group(1).strip()
-                        print(f"✅ Campos extraídos manualmente: {ai_data}")
-                    else:
-                        print(f"❌ No se pudieron extraer campos del JSON")
-                        ai_data = None
-                
-                if ai_data:
-                    # Buscar número de parada con diferentes nombres posibles
-                    stop_num = (ai_data.get('stop_number') or 
-                               ai_data.get('Numero de parada') or 
-                               ai_data.get('numero de parada') or 
-                               ai_data.get('Número de parada') or ai_data.get('numero_de_parada') or ai_data.get('parada'))
-                    
-                    # Buscar descripción de la incidencia con diferentes nombres posibles
-                    desc = None
-                    if isinstance(ai_data, dict):
-                        # Buscar específicamente el campo de descripción de la incidencia
-                        for key in ai_data.keys():
-                            if key.lower() in ['descripción de la incidencia', 'descripcion de la incidencia', 'incidencia']:
-                                desc = ai_data[key]
-                                break
-                        
-                        # Si no se encontró, buscar con otros nombres
-                        if not desc:
-                            desc = (ai_data.get('description') or 
-                                   ai_data.get('descripción') or 
-                                   ai_data.get('descripcion') or 
-                                   ai_data.get('incidencia') or 
-                                   '')
-                    
-                    # Validar y limpiar valores
-                    if stop_num and isinstance(stop_num, str):
-                        stop_num = stop_num.strip()
-                        # Asegurar que empieza con P si no lo tiene
-                        if stop_num and not stop_num.upper().startswith('P'):
-                            stop_num = f"P{stop_num}"
-                    
-                    if not desc or not isinstance(desc, str):
-                        desc = ''
-                    else:
-                        desc = desc.strip()
-                    
-                    # Limpiar la descripción de campos JSON no deseados
-                    if desc:
-                        desc = re.sub(r'"(?:pasos seguidos|conclusi[oó]n)"\s*:\s*\[?[^\]]*\]?', '', desc, flags=re.IGNORECASE | re.DOTALL)
-                        desc = re.sub(r'\s+', ' ', desc).strip()
-                    
-                    # Asegurar valores finales
-                    if not stop_num or stop_num == 'null' or stop_num == 'None' or (isinstance(stop_num, str) and stop_num.lower().strip() == 'null'):
-                        stop_num = None
-                    
-                    if not desc or desc == 'null' or desc == 'None' or desc.strip() == '':
-                        desc = 'Incidencia reportada por audio'
-                    
-                    print(f"📤 Resultado extraído del JSON:")
-                    print(f"  - stop_number: {stop_num}")
-                    print(f"  - description: {desc[:100] if desc else 'vacía'}...")
-                    
-                    return {
-                        'stop_number': stop_num,
-                        'description': desc
-                    }
+            print(f"📤 Resultado extraído del JSON ({parsed.source}):")
+            print(f"  - stop_number: {parsed.stop_number}")
+            print(f"  - description: {parsed.description[:100]}...")
             
-            # Si no se encontró JSON, intentar extraer información con regex del texto original
-            print("⚠️ No se encontró JSON válido, intentando extracción manual del texto...")
-            return extract_stop_info_fallback(original_content)
+            return {
+                'stop_number': parsed.stop_number,
+                'description': parsed.description
+            }
+        
+        print(f"❌ LM Studio respondió con error {response.status_code}: {response.text[:200]}")
+        return {
+            'stop_number': None,
+            'description': 'Incidencia reportada por audio'
+        }
+    except BackendSaturatedError as e:
+        # Se queda el resultado de las reglas (si encontraron parada)
+        print(f"⚠️ {str(e)}: no se consulta al LLM")
+        return {
+            'stop_number': None,
+            'description': 'Incidencia reportada por audio'
+        }
     except requests.exceptions.Timeout:
             print("⚠️ Timeout al procesar con LM Studio")
             # Intentar extraer información del texto original si existe
@@ -2321,59 +2874,50 @@ def extract_stop_info_fallback(text):
         'description': description if description else 'Incidencia reportada por audio'
     }
 
-# Función para procesar imagen con LM Studio
-def process_image_with_lm_studio(image_base64):
+# Servidor de LM Studio (API compatible con OpenAI)
+LM_STUDIO_URL = "http://192.168.10.253:1234/v1/chat/completions"
+
+# Modelo de visión de LM Studio y prompt para las fotos de paradas
+VISION_MODEL = "google/gemma-3-27b"
+VISION_PROMPT = 'En esta parada de autobús, me puedes indicar el número de parada que empieza por la letra P seguida de números , busca en toda la imagen, no confundir con el numero de linea que está en un cartel del color de la linea , y la descripción de la incidencia o pintada que ves en la imagen?. Devuelve un json, con Numero de parada, descripción de la incidencia, pasos seguidos y conclusió'
+
+# Versión de los resultados de /api/process-image-ai en la caché (modelo, prompt y tamaño de entrada)
+VISION_RESULT_VERSION = '|'.join([
+    VISION_MODEL, hashlib.sha256(VISION_PROMPT.encode('utf-8')).hexdigest()[:12],
+    str(VISION_PREPROCESS_CONFIG['max_dimension'])
+])
+
+# Petición y resultado del modelo de visión (compartidos por la versión normal y la de streaming)
+def build_vision_payload(image_base64):
     """
-    Procesa imagen con LM Studio para extraer número de parada e incidencia
-    LM Studio debe estar corriendo en http://192.168.10.253:1234
+    Prepara la petición de chat/completions con la foto para el modelo de visión
+
+    Args:
+        image_base64 (str): Foto en base64 (puede venir como data URL)
+
+    Returns:
+        dict: Payload para LM Studio
     """
+    # Limpiar el base64 si viene como data URL
+    if isinstance(image_base64, str) and image_base64.startswith('data:image'):
+        image_base64 = image_base64.split(',')[1]
+    
+    # Verificar tamaño de la imagen base64
+    base64_size_mb = len(image_base64) * 3 / 4 / 1024 / 1024  # Tamaño aproximado en MB
+    print(f"📸 Tamaño de imagen base64: {base64_size_mb:.2f} MB ({len(image_base64)} caracteres)")
+    
+    # Reducir siempre al tamaño de entrada del modelo y quitar los metadatos
+    # (los reintentos de la misma foto reutilizan el resultado de la caché)
     try:
-        import re
-        
-        # Limpiar el base64 si viene como data URL
-        if isinstance(image_base64, str) and image_base64.startswith('data:image'):
-            image_base64 = image_base64.split(',')[1]
-        
-        # Verificar tamaño de la imagen base64
-        base64_size_mb = len(image_base64) * 3 / 4 / 1024 / 1024  # Tamaño aproximado en MB
-        print(f"📸 Tamaño de imagen base64: {base64_size_mb:.2f} MB ({len(image_base64)} caracteres)")
-        
-        # Si la imagen es muy grande (>5MB), reducirla antes de enviar
-        if base64_size_mb > 5:
-            print(f"⚠️ Imagen muy grande ({base64_size_mb:.2f} MB), reduciendo tamaño...")
-            try:
-                from PIL import Image
-                import io
-                
-                # Decodificar base64 a bytes
-                image_bytes = base64.b64decode(image_base64)
-                
-                # Abrir imagen con PIL
-                img = Image.open(io.BytesIO(image_bytes))
-                
-                # Reducir tamaño si es muy grande (max 1024px en el lado más largo)
-                max_size = 1024
-                if img.width > max_size or img.height > max_size:
-                    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                    print(f"✅ Imagen redimensionada a {img.width}x{img.height}")
-                
-                # Convertir de nuevo a base64 con calidad reducida
-                output = io.BytesIO()
-                img.save(output, format='JPEG', quality=85, optimize=True)
-                image_bytes = output.getvalue()
-                image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-                
-                new_size_mb =image_base64# len(image_base64) * 3 / 4 / 1024 / 1024
-                print(f"✅ Imagen reducida a {new_size_mb:.2f} MB ({len(image_base64)} caracteres)")
-            except Exception as e:
-                print(f"⚠️ Error al reducir imagen: {e}, usando imagen original")
-        
-        # URL de LM Studio (puerto por defecto)
-        lm_studio_url = "http://192.168.10.253:1234/v1/chat/completions"
-        
-        # Prompt para Llava - Versión que FUNCIONÓ (según el usuario)
-        # El modelo primero describe lo que ve y luego extrae la información
-        prompt ='En esta parada de autobús, me puedes indicar el número de parada que empieza por la letra P seguida de números , busca en toda la imagen, no confundir con el numero de linea que está en un cartel del color de la linea , y la descripción de la incidencia o pintada que ves en la imagen?. Devuelve un json, con Numero de parada, descripción de la incidencia, pasos seguidos y conclusió'
+        prepared, cached = vision_preprocessor.prepare(base64.b64decode(image_base64))
+        image_base64 = prepared.base64
+        print(f"✅ Imagen preparada para el modelo{' (caché)' if cached else ''}: {prepared.describe()}")
+    except Exception as e:
+        print(f"⚠️ Error al preparar la imagen: {e}, usando imagen original")
+    
+    # Prompt para Llava - Versión que FUNCIONÓ (según el usuario)
+    # El modelo primero describe lo que ve y luego extrae la información
+    prompt = VISION_PROMPT
 #         prompt = """Primero describe detalladamente todo lo que ves en esta imagen de parada de autobús. Luego busca específicamente:
 
 # 1. CUALQUIER número, código o texto que contenga la letra P seguida de números (P1171, P625, P123, etc.). Busca en TODA la imagen: carteles, señales, marcas, estructuras, cualquier lugar. Si encuentras un código con P, escríbelo EXACTAMENTE como aparece. Si después de buscar cuidadosamente no encuentras ningún código con P, usa null.
@@ -2387,67 +2931,191 @@ def process_image_with_lm_studio(image_base64):
 # }
 
 # CRÍTICO: Si ves CUALQUIER código que empiece con P y números, ESCRIBELO. No uses null si ves algo."""
-        
-        # Preparar el mensaje con imagen (formato multimodal)
-        # Si el modelo soporta imágenes, las enviamos en el formato correcto
-        # Para Llava, el formato puede requerir que la imagen esté en PNG o JPEG
-        # Intentar detectar el formato de la imagen
-        image_format = "jpeg"  # Por defecto
-        if isinstance(image_base64, str):
-            # Si ya viene como data URL, extraer el formato
-            if image_base64.startswith('data:image'):
-                format_part = image_base64.split(';')[0].split('/')[1]
-                if format_part in ['png', 'jpeg', 'jpg']:
-                    image_format = format_part if format_part != 'jpg' else 'jpeg'
-        
-        # Llava solo soporta roles "user" y "assistant", no "system"
-        # Incluir las instrucciones del sistema en el prompt del usuario
-        # Usar el prompt exacto que funcionó según los logs
-        prompt_with_system = prompt
-        
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt_with_system
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/{image_format};base64,{image_base64}"
-                        }
+    
+    # Preparar el mensaje con imagen (formato multimodal)
+    # Si el modelo soporta imágenes, las enviamos en el formato correcto
+    # Para Llava, el formato puede requerir que la imagen esté en PNG o JPEG
+    # Intentar detectar el formato de la imagen
+    image_format = "jpeg"  # Por defecto
+    if isinstance(image_base64, str):
+        # Si ya viene como data URL, extraer el formato
+        if image_base64.startswith('data:image'):
+            format_part = image_base64.split(';')[0].split('/')[1]
+            if format_part in ['png', 'jpeg', 'jpg']:
+                image_format = format_part if format_part != 'jpg' else 'jpeg'
+    
+    # Llava solo soporta roles "user" y "assistant", no "system"
+    # Incluir las instrucciones del sistema en el prompt del usuario
+    # Usar el prompt exacto que funcionó según los logs
+    prompt_with_system = prompt
+    
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prompt_with_system
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/{image_format};base64,{image_base64}"
                     }
-                ]
-            }
-        ]
-        
-        # Si el modelo no soporta imágenes, solo enviamos texto
-        # (algunos modelos de LM Studio pueden no ser multimodales)
-        # Ajustes para Gemma 3 27B: modelo más grande requiere más tokens y tiempo
-        payload = {
-            "model": "google/gemma-3-27b",  # LM Studio usa este nombre genérico
-            "messages": messages,
-            "temperature": 0.2,  # Temperatura más baja para respuestas más consistentes con Gemma
-            "max_tokens": 800  # Aumentar tokens para Gemma 3 27B (modelo más grande)
+                }
+            ]
         }
-        
-        print(f"🤖 Enviando imagen a LM Studio en {lm_studio_url}...")
-        print(f"📊 Parámetros: temperature={payload['temperature']}, max_tokens={payload['max_tokens']}")
-        
-        # Verificar el tamaño del payload
-        import json as json_lib
-        payload_str = json_lib.dumps(payload)
-        payload_size_mb = len(payload_str.encode('utf-8')) / 1024 / 1024
-        print(f"📦 Tamaño del payload: {payload_size_mb:.2f} MB")
-        
-        # Verificar que la imagen esté en el payload
-        if 'image_url' in payload_str:
-            image_url_start = payload_str.find('data:image')
-            if image_url_start > 0:
-                print(f"✅ Imagen encontrada en payload (posición: {image_url_start})")
-                print(f"📸 Primeros 100 caracteres del data URL: {payload_str[image_url_start:image_url_start+100]}...")
+    ]
+    
+    # Si el modelo no soporta imágenes, solo enviamos texto
+    # (algunos modelos de LM Studio pueden no ser multimodales)
+    # Ajustes para Gemma 3 27B: modelo más grande requiere más tokens y tiempo
+    payload = {
+        "model": VISION_MODEL,  # LM Studio usa este nombre genérico
+        "messages": messages,
+        "temperature": 0.2,  # Temperatura más baja para respuestas más consistentes con Gemma
+        "max_tokens": 800  # Aumentar tokens para Gemma 3 27B (modelo más grande)
+    }
+    
+    print(f"🤖 Enviando imagen a LM Studio en {LM_STUDIO_URL}...")
+    print(f"📊 Parámetros: temperature={payload['temperature']}, max_tokens={payload['max_tokens']}")
+    
+    # Verificar el tamaño del payload
+    import json as json_lib
+    payload_str = json_lib.dumps(payload)
+    payload_size_mb = len(payload_str.encode('utf-8')) / 1024 / 1024
+    print(f"📦 Tamaño del payload: {payload_size_mb:.2f} MB")
+    
+    # Verificar que la imagen esté en el payload
+    if 'image_url' in payload_str:
+        image_url_start = payload_str.find('data:image')
+        if image_url_start > 0:
+            print(f"✅ Imagen encontrada en payload (posición: {image_url_start})")
+            print(f"📸 Primeros 100 caracteres del data URL: {payload_str[image_url_start:image_url_start+100]}...")
+    return payload
+
+def finish_vision_result(content):
+    """
+    Interpreta la respuesta completa del modelo de visión
+
+    Args:
+        content (str): Texto de la respuesta
+
+    Returns:
+        dict: {'success', 'stop_number', 'description', 'raw_response'} o {'success': False, 'error'}
+    """
+    parsed = parse_lm_response(content, default_description='Sin incidencia visible')
+    
+    # Solo es un error si NO hay información útil y el modelo dice que no ve la imagen
+    if parsed.refusal:
+        print(f"❌ El modelo indicó que no puede procesar la imagen y no hay información útil")
+        print(f"❌ Respuesta: {content[:200]}...")
+        return {
+            'success': False,
+            'error': 'El modelo Gemma 3 27B no es multimodal (no soporta imágenes directamente).\n\nOpciones:\n1. Usa un modelo multimodal como Llava (ej: llava1.6-mistral-7b-instruct)\n2. O usa un modelo de visión como Gemma 2B-IT o Qwen2-VL\n\nEl modelo actual solo puede procesar texto, no imágenes.'
+        }
+    
+    stop_number = parsed.stop_number
+    if not stop_number and parsed.has_json:
+        # El JSON no trae la parada: buscarla en el texto de la respuesta
+        print("⚠️ stop_number es null en JSON, buscando en el texto de la respuesta...")
+        # Solo reglas: quien llama ya ocupa la plaza de LM Studio y pedir otra lo bloquearía
+        stop_number = extract_stop_info(content, llm_fallback=False).get('stop_number')
+    
+    print(f"📤 Resultado final ({parsed.source}):")
+    print(f"  - stop_number: {stop_number}")
+    print(f"  - description: {parsed.description}")
+    
+    return {
+        'success': True,
+        'stop_number': stop_number,
+        'description': parsed.description,
+        'raw_response': content
+    }
+
+# Versión en streaming de process_image_with_lm_studio
+def stream_image_with_lm_studio(image_base64, cache_key=None, ticket=None):
+    """
+    Procesa la imagen con LM Studio en modo streaming (stream: true)
+
+    Args:
+        image_base64 (str): Foto en base64 (puede venir como data URL)
+        cache_key (str): Clave para guardar el resultado en ai_result_cache
+        ticket (AdmissionTicket): Plaza en LM Studio, para devolver la espera en cola
+
+    Yields:
+        str: Eventos SSE 'partial' mientras llega la respuesta y 'result' o 'error' al final
+    """
+    start = time.perf_counter()
+    first_token = None
+    try:
+        payload = dict(build_vision_payload(image_base64), stream=True)
+        print(f"🚀 Enviando petición en streaming a LM Studio (timeout: 180s)...")
+        response = http_client.post(
+            LM_STUDIO_URL,
+            json=payload,
+            timeout=180,  # Máximo entre dos trozos de la respuesta
+            headers={'Content-Type': 'application/json'},
+            stream=True
+        )
+        with response:
+            if response.status_code != 200:
+                print(f"⚠️ LM Studio respondió con código {response.status_code}: {response.text}")
+                yield format_sse('error', {
+                    'success': False,
+                    'error': f'LM Studio respondió con código {response.status_code}: {response.text}'
+                })
+                return
+
+            parser = StreamingResponseParser()
+            for delta in iter_completion_deltas(response):
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                    print(f"⚡ Primer token de LM Studio en {first_token:.2f}s")
+                if parser.feed(delta):
+                    yield format_sse('partial', parser.partial())
+
+        print(f"⏱️ Respuesta completa en {time.perf_counter() - start:.2f} segundos")
+        if not parser.content:
+            yield format_sse('error', {'success': False, 'error': 'Respuesta vacía del modelo multimodal'})
+            return
+
+        print(f"🤖 Respuesta completa de LM Studio (TEXT): {parser.content}")
+        result = finish_vision_result(parser.content)
+        if not result['success']:
+            yield format_sse('error', result)
+            return
+
+        if cache_key and result['stop_number']:
+            ai_result_cache.set(cache_key, {key: result[key] for key in ('stop_number', 'description', 'raw_response')})
+        yield format_sse('result', dict(result, cached=False,
+                                        time_to_first_token=round(first_token, 3) if first_token else None,
+                                        admission=ticket.to_dict() if ticket else None))
+
+    except requests.exceptions.Timeout:
+        yield format_sse('error', {
+            'success': False,
+            'error': 'El modelo tardó demasiado en responder (timeout). Puede que el modelo sea muy grande o esté procesando. Intenta con un modelo más pequeño o espera más tiempo.'
+        })
+    except requests.exceptions.ConnectionError:
+        yield format_sse('error', {
+            'success': False,
+            'error': 'No se puede conectar a LM Studio. Asegúrate de que:\n1. LM Studio esté corriendo\n2. El servidor local esté activo en http://192.168.10.253:1234\n3. Ve a la pestaña "Developer" en LM Studio y asegúrate de que el servidor esté iniciado'
+        })
+    except Exception as e:
+        print(f"❌ Error procesando imagen en streaming: {type(e).__name__}: {str(e)}")
+        yield format_sse('error', {'success': False, 'error': f'Error al procesar imagen con el modelo: {str(e)}'})
+    finally:
+        vision_stream_metrics.record(first_token, time.perf_counter() - start)
+
+# Función para procesar imagen con LM Studio
+def process_image_with_lm_studio(image_base64):
+    """
+    Procesa imagen con LM Studio para extraer número de parada e incidencia
+    LM Studio debe estar corriendo en http://192.168.10.253:1234
+    """
+    try:
+        payload = build_vision_payload(image_base64)
         
         # Intentar con formato multimodal primero
         try:
@@ -2455,8 +3123,8 @@ def process_image_with_lm_studio(image_base64):
             import time
             start_time = time.time()
             
-            response = requests.post(
-                lm_studio_url,
+            response = http_client.post(
+                LM_STUDIO_URL,
                 json=payload,
                 timeout=180,  # Timeout aumentado a 180s para modelos grandes que pueden tardar más
                 headers={'Content-Type': 'application/json'}
@@ -2482,367 +3150,7 @@ def process_image_with_lm_studio(image_base64):
                 print(f"🤖 Respuesta completa de LM Studio (TEXT): {content}")
                 print(f"📏 Longitud de la respuesta: {len(content)} caracteres")
                 
-                # Guardar el contenido original antes de modificarlo
-                original_content = content
-                
-                # Primero intentar extraer información útil (JSON o código de parada)
-                # Antes de determinar si es un error real
-                has_json = False
-                has_stop_number = False
-                
-                # Buscar rápidamente si hay JSON válido
-                json_quick_check = re.search(r'\{[^{}]*"stop_number"[^{}]*\}', content, re.DOTALL)
-                if json_quick_check:
-                    has_json = True
-                
-                # Buscar rápidamente si hay código de parada
-                stop_quick_check = re.search(r'\bP\s*\d{3,}\b', content, re.IGNORECASE)
-                if stop_quick_check:
-                    has_stop_number = True
-                
-                # Solo validar como error si NO hay información útil Y además contiene frases de error
-                if not has_json and not has_stop_number:
-                    error_messages = [
-                        "necesito una descripción de la imagen",
-                        "necesito una descripción",
-                        "no puedo ver la imagen",
-                        "no tengo acceso a la imagen",
-                        "la imagen no está disponible",
-                        "no puedo analizar la imagen",
-                        "proporciona la descripción",
-                        "esperaré tu texto",
-                        "sin información disponible"
-                    ]
-                    
-                    content_lower = content.lower()
-                    if any(error_msg in content_lower for error_msg in error_messages):
-                        print(f"❌ El modelo indicó que no puede procesar la imagen y no hay información útil")
-                        print(f"❌ Respuesta: {content[:200]}...")
-                        return {
-                            'success': False,
-                            'error': 'El modelo Gemma 3 27B no es multimodal (no soporta imágenes directamente).\n\nOpciones:\n1. Usa un modelo multimodal como Llava (ej: llava1.6-mistral-7b-instruct)\n2. O usa un modelo de visión como Gemma 2B-IT o Qwen2-VL\n\nEl modelo actual solo puede procesar texto, no imágenes.'
-                        }
-                
-                # Buscar cualquier código con P en la respuesta completa ANTES de extraer JSON
-                # Esto puede ayudar a encontrar códigos que el modelo menciona pero no pone en el JSON
-                p_code_in_full_text = re.search(r'\bP\s*(\d{3,})\b', original_content, re.IGNORECASE)
-                p_code_found_in_text = None
-                if p_code_in_full_text:
-                    p_code_found_in_text = f"P{p_code_in_full_text.group(1)}"
-                    print(f"🔍 Código de parada encontrado en texto completo ANTES de extraer JSON: {p_code_found_in_text}")
-                
-                # Limpiar el contenido: remover bloques de código markdown si existen
-                # Buscar JSON dentro de bloques ```json ... ``` o ``` ... ```
-                # Usar un patrón más robusto que maneje JSON multilínea y truncado
-                code_block_match = re.search(r'```(?:json)?\s*(\{[\s\S]*?)\s*```', content, re.DOTALL)
-                if code_block_match:
-                    extracted_json = code_block_match.group(1)
-                    print(f"✅ JSON extraído de bloque de código markdown (primeros 300 chars): {extracted_json[:300]}...")
-                    content = extracted_json
-                
-                # Intentar extraer JSON de la respuesta (patrones más flexibles)
-                # Primero intentar con JSON completo que contenga ambos campos
-                json_match = re.search(r'\{[\s\S]*?"stop_number"[\s\S]*?"description"[\s\S]*?\}', content, re.DOTALL)
-                
-                if not json_match:
-                    # Intentar encontrar JSON que empiece con stop_number (puede estar truncado)
-                    json_match = re.search(r'\{[\s\S]*?"stop_number"[\s\S]*?\}', content, re.DOTALL)
-                
-                if not json_match:
-                    # Intentar encontrar cualquier JSON que empiece con {
-                    json_match = re.search(r'\{[\s\S]*?"stop_number"', content, re.DOTALL)
-                    if json_match:
-                        # El JSON está truncado, intentar extraerlo completo hasta donde termine
-                        json_start_pos = json_match.start()
-                        # Buscar hasta el final del contenido o hasta encontrar un cierre válido
-                        json_candidate = content[json_start_pos:]
-                        # Intentar encontrar stop_number y description aunque esté truncado
-                        json_match = re.search(r'\{[\s\S]*?"stop_number"[\s\S]*?"description"[\s\S]*?[^"]"', json_candidate, re.DOTALL)
-                        if not json_match:
-                            # Si no encuentra description completo, tomar hasta donde esté
-                            json_match = re.search(r'\{[\s\S]*?"stop_number"[\s\S]*?"description"[\s\S]*', json_candidate, re.DOTALL)
-                
-                if json_match:
-                    json_str = json_match.group(0)
-                    print(f"✅ JSON encontrado (longitud: {len(json_str)} chars): {json_str[:500]}...")
-                    import json as json_lib
-                    ai_data = None
-                    try:
-                        # Intentar parsear el JSON
-                        ai_data = json_lib.loads(json_str)
-                        print(f"✅ JSON parseado correctamente")
-                    except json_lib.JSONDecodeError as e:
-                        print(f"⚠️ Error parseando JSON completo: {e}")
-                        print(f"⚠️ JSON problemático (puede estar truncado): {json_str}")
-                        # Si el JSON está truncado, intentar extraer campos manualmente
-                        print("🔄 Intentando extraer campos manualmente del JSON truncado...")
-                        # Extraer stop_number - puede estar truncado, así que buscar hasta el final
-                        # Buscar con diferentes nombres posibles (inglés y español)
-                        stop_num_match = re.search(r'"(?:stop_number|Numero de parada|numero de parada|Número de parada)"\s*:\s*"([^"]+)"', json_str, re.IGNORECASE)
-                        # Para description, buscar hasta el final del string (puede estar truncado)
-                        # Buscar con diferentes nombres posibles (inglés y español)
-                        desc_match = re.search(r'"(?:description|descripci[oó]n de la incidencia|descripcion de la incidencia|descripci[oó]n)"\s*:\s*"([^"]*)"', json_str, re.IGNORECASE)
-                        if not desc_match:
-                            # Si no encuentra comilla de cierre, buscar hasta el final del string (truncado)
-                            desc_match = re.search(r'"(?:description|descripci[oó]n de la incidencia|descripcion de la incidencia|descripci[oó]n)"\s*:\s*"([^"]*)', json_str, re.IGNORECASE)
-                        
-                        if stop_num_match or desc_match:
-                            # Crear un objeto parcial con los campos encontrados
-                            ai_data = {}
-                            if stop_num_match:
-                                ai_data['stop_number'] = stop_num_match.group(1)
-                            if desc_match:
-                                ai_data['description'] = desc_match.group(1)
-                            print(f"✅ Campos extraídos manualmente: {ai_data}")
-                        else:
-                            print(f"❌ No se pudieron extraer campos del JSON truncado")
-                            # Continuar con el flujo normal para extraer del texto
-                            ai_data = None
-                    
-                    if ai_data:
-                        # Buscar número de parada con diferentes nombres posibles
-                        stop_num = (ai_data.get('stop_number') or 
-                                   ai_data.get('Numero de parada') or 
-                                   ai_data.get('numero de parada') or 
-                                   ai_data.get('Número de parada'))
-                        
-                        # Buscar descripción de la incidencia con diferentes nombres posibles
-                        # Priorizar "descripción de la incidencia" para evitar confundir con otros campos
-                        desc = None
-                        if isinstance(ai_data, dict):
-                            # Buscar específicamente el campo de descripción de la incidencia
-                            for key in ai_data.keys():
-                                if key.lower() in ['descripción de la incidencia', 'descripcion de la incidencia']:
-                                    desc = ai_data[key]
-                                    break
-                            
-                            # Si no se encontró, buscar con otros nombres
-                            if not desc:
-                                desc = (ai_data.get('description') or 
-                                       ai_data.get('descripción') or 
-                                       ai_data.get('descripcion') or 
-                                       '')
-                        
-                        # Validar que la descripción no sea el JSON completo
-                        if desc and isinstance(desc, str):
-                            # Si la descripción contiene estructuras JSON o parece ser el JSON completo, limpiarla
-                            if desc.strip().startswith('{') or '"pasos seguidos"' in desc or '"conclusión"' in desc or '"conclusion"' in desc:
-                                print("⚠️ La descripción parece contener JSON completo, extrayendo solo el campo...")
-                                # Intentar extraer solo el valor del campo "descripción de la incidencia"
-                                desc_match = re.search(r'"(?:descripción de la incidencia|descripcion de la incidencia|description)"\s*:\s*"([^"]+)"', desc, re.IGNORECASE)
-                                if desc_match:
-                                    desc = desc_match.group(1)
-                                else:
-                                    # Si no se puede extraer, usar el valor del JSON parseado directamente
-                                    desc = (ai_data.get('descripción de la incidencia') or 
-                                           ai_data.get('descripcion de la incidencia') or 
-                                           '')
-                        
-                        # Asegurar que desc es un string válido
-                        if not desc or not isinstance(desc, str):
-                            desc = ''
-                        
-                        print(f"📋 Datos extraídos del JSON:")
-                        print(f"  - stop_number: {stop_num}")
-                        print(f"  - description: {desc[:100] if desc else 'vacía'}...")
-                        
-                        # Si stop_number es null, "null" (string), o None, buscar manualmente en TODO el texto
-                        if not stop_num or stop_num == 'null' or stop_num == 'None' or stop_num == 'null' or (isinstance(stop_num, str) and stop_num.lower().strip() == 'null'):
-                            print("⚠️ stop_number es null en JSON, buscando en TODO el texto de la respuesta...")
-                            
-                            # Usar el código encontrado previamente si existe
-                            if p_code_found_in_text:
-                                print(f"✅ Usando código de parada encontrado previamente: {p_code_found_in_text}")
-                                stop_num = p_code_found_in_text
-                            else:
-                                print(f"📝 Buscando códigos P en: {content[:500]}...")
-                                
-                                # Buscar directamente cualquier P seguido de números (más agresivo)
-                                p_matches = re.findall(r'\bP\s*(\d{3,})\b', content, re.IGNORECASE)
-                                if p_matches:
-                                    # Tomar el primero encontrado
-                                    stop_num = f"P{p_matches[0]}"
-                                    print(f"✅ Número de parada encontrado directamente en texto: {stop_num}")
-                                else:
-                                    # Intentar con extract_stop_info
-                                    stop_info = extract_stop_info(content)
-                                    found_stop = stop_info.get('stop_number')
-                                    if found_stop:
-                                        print(f"✅ Número de parada encontrado con extract_stop_info: {found_stop}")
-                                        stop_num = found_stop
-                                    else:
-                                        # Buscar cualquier P seguido de números (más flexible)
-                                        p_match = re.search(r'P\s*(\d+)', content, re.IGNORECASE)
-                                        if p_match:
-                                            stop_num = f"P{p_match.group(1)}"
-                                            print(f"✅ Número de parada encontrado con regex flexible: {stop_num}")
-                                        else:
-                                            print("❌ No se encontró número de parada en ningún lugar del texto")
-                                            stop_num = None
-                        
-                        # Si description es literal "texto en español" o está vacía, buscar en el texto
-                        if not desc or desc == 'null' or desc == 'None' or desc.strip() == '' or desc.lower().strip() == 'texto en español':
-                            print("⚠️ description es inválida o literal, buscando en el texto...")
-                            # Buscar descripción de la incidencia en el texto (priorizar campo en español)
-                            desc_match = re.search(r'"(?:descripción de la incidencia|descripcion de la incidencia|description)"\s*:\s*"([^"]+)"', content, re.IGNORECASE)
-                            if desc_match:
-                                desc = desc_match.group(1)
-                                # Si es el texto literal "texto en español", buscar en el contenido
-                                if desc.lower().strip() == 'texto en español':
-                                    desc = "Sin incidencia visible"
-                            else:
-                                # Buscar descripción en JSON multilínea (puede tener saltos de línea)
-                                desc_match = re.search(r'"(?:descripción de la incidencia|descripcion de la incidencia|description)"\s*:\s*"([^"]*)"', content, re.IGNORECASE | re.DOTALL)
-                                if desc_match:
-                                    desc = desc_match.group(1).strip()
-                                    # Limpiar saltos de línea múltiples
-                                    desc = re.sub(r'\n+', ' ', desc)
-                                    desc = re.sub(r'\s+', ' ', desc).strip()
-                                else:
-                                    desc = "Sin incidencia visible"
-                        
-                        # Asegurar valores finales
-                        if not stop_num or stop_num == 'null' or stop_num == 'None' or (isinstance(stop_num, str) and stop_num.lower().strip() == 'null'):
-                            stop_num = None
-                        
-                        if not desc or desc == 'null' or desc == 'None' or desc.strip() == '' or desc.lower().strip() == 'texto en español':
-                            desc = 'Sin incidencia visible'
-                        
-                        print(f"📤 Resultado final (con JSON):")
-                        print(f"  - stop_number: {stop_num}")
-                        print(f"  - description: {desc}")
-                        
-                        return {
-                            'success': True,
-                            'stop_number': stop_num,
-                            'description': desc,
-                            'raw_response': content
-                        }
-                
-                # Si no hay JSON, intentar extraer información con regex
-                print("⚠️ No se encontró JSON válido, intentando extracción manual del texto...")
-                stop_number = None
-                description = None
-                
-                # Buscar formato estructurado con títulos markdown
-                # Buscar "**Número de parada:**" seguido del número
-                stop_section = re.search(r'\*\*Número de parada:\*\*\s*\n?\s*\*\*?([P]?\d+)\*\*?', content, re.IGNORECASE | re.MULTILINE)
-                if stop_section:
-                    stop_number = stop_section.group(1).strip()
-                    # Asegurar que empieza con P si no lo tiene
-                    if not stop_number.upper().startswith('P'):
-                        stop_number = f"P{stop_number}"
-                    print(f"✅ Número de parada encontrado en sección markdown: {stop_number}")
-                
-                # Buscar "**Descripción de la incidencia o pintada:**" seguido de la descripción
-                desc_section = re.search(
-                    r'\*\*Descripción de la incidencia o pintada:\*\*\s*\n?\s*(.+?)(?=\*\*|Nota adicional|$)', 
-                    content, 
-                    re.IGNORECASE | re.MULTILINE | re.DOTALL
-                )
-                if desc_section:
-                    description = desc_section.group(1).strip()
-                    # Limpiar saltos de línea múltiples y espacios extra
-                    description = re.sub(r'\n+', ' ', description)
-                    description = re.sub(r'\s+', ' ', description).strip()
-                    print(f"✅ Descripción encontrada en sección markdown: {description[:100]}...")
-                
-                # Si no se encontró con el formato estructurado, buscar con los métodos anteriores
-                if not stop_number:
-                    # Buscar número de parada en el texto (puede incluir letras como P1171)
-                    print(f"🔍 Buscando número de parada en: {content[:200]}...")
-                    stop_match = re.search(r'"stop_number"\s*:\s*"?([A-Z]?\d+)"?', content, re.IGNORECASE)
-                    if stop_match:
-                        stop_number = stop_match.group(1).strip()
-                        # Limpiar espacios si hay
-                        stop_number = stop_number.replace(' ', '')
-                        print(f"✅ Número de parada encontrado en JSON: {stop_number}")
-                    else:
-                        # Intentar buscar directamente en el texto con regex (sin volver a enviar a IA)
-                        print("🔍 Buscando número de parada en el texto con regex...")
-                        # Buscar código de parada con formato P seguido de números
-                        stop_match_regex = re.search(r'\bP\s*\d{3,}\b', content, re.IGNORECASE)
-                        if stop_match_regex:
-                            stop_number = stop_match_regex.group(0).replace(' ', '').upper()
-                            print(f"✅ Número de parada encontrado con regex: {stop_number}")
-                        else:
-                            print("⚠️ No se encontró número de parada")
-                
-                # Si no se encontró descripción con el formato estructurado, buscar con métodos anteriores
-                if not description:
-                    # Buscar descripción de la incidencia en el JSON (priorizar campo en español)
-                    desc_match = re.search(r'"(?:descripción de la incidencia|descripcion de la incidencia|description)"\s*:\s*"([^"]+)"', content, re.IGNORECASE)
-                    if desc_match:
-                        description = desc_match.group(1)
-                        print(f"✅ Descripción encontrada en JSON: {description}")
-                    else:
-                        # Buscar descripción en JSON multilínea (puede tener saltos de línea)
-                        desc_match = re.search(r'"(?:descripción de la incidencia|descripcion de la incidencia|description)"\s*:\s*"([^"]*)"', content, re.IGNORECASE | re.DOTALL)
-                        if desc_match:
-                            description = desc_match.group(1).strip()
-                            # Limpiar saltos de línea múltiples
-                            description = re.sub(r'\n+', ' ', description)
-                            description = re.sub(r'\s+', ' ', description).strip()
-                            print(f"✅ Descripción encontrada en JSON multilínea: {description}")
-                        else:
-                            # Si no se encuentra en JSON, usar el texto completo como descripción (sin volver a enviar a IA)
-                            if not stop_number:
-                                # Usar el texto completo como descripción, limpiando campos JSON no deseados
-                                description = content
-                                # Remover campos JSON no deseados
-                                description = re.sub(r'"(?:Numero de parada|numero de parada|stop_number)"\s*:\s*"[^"]*"', '', description, flags=re.IGNORECASE)
-                                description = re.sub(r'"(?:pasos seguidos|conclusi[oó]n)"\s*:\s*[^}]*', '', description, flags=re.IGNORECASE | re.DOTALL)
-                                # Limpiar saltos de línea múltiples
-                                description = re.sub(r'\n+', ' ', description)
-                                description = re.sub(r'\s+', ' ', description).strip()
-                                print(f"✅ Descripción extraída del texto: {description[:100]}...")
-                            else:
-                                # Buscar descripción en el texto sin el número de parada
-                                # Remover el número de parada del texto para obtener la descripción
-                                desc_text = content
-                                if stop_number:
-                                    desc_text = re.sub(rf'{re.escape(stop_number)}', '', desc_text, flags=re.IGNORECASE)
-                                    desc_text = re.sub(r'"(?:Numero de parada|numero de parada|stop_number)"\s*:\s*"[^"]*"', '', desc_text, flags=re.IGNORECASE)
-                                # Remover secciones de notas adicionales y campos JSON no deseados
-                                desc_text = re.sub(r'\*\*Nota adicional:\*\*.*', '', desc_text, flags=re.IGNORECASE | re.DOTALL)
-                                desc_text = re.sub(r'Nota adicional.*', '', desc_text, flags=re.IGNORECASE | re.DOTALL)
-                                # Remover campos JSON que no queremos (pasos seguidos, conclusión)
-                                desc_text = re.sub(r'"(?:pasos seguidos|conclusi[oó]n)"\s*:\s*\[?[^\]]*\]?', '', desc_text, flags=re.IGNORECASE | re.DOTALL)
-                                description = desc_text.strip()
-                                if not description or len(description) < 5:
-                                    description = "Incidencia detectada por IA"
-                                print(f"✅ Descripción obtenida: {description}")
-                
-                # Limpiar la descripción de cualquier nota adicional que pueda quedar
-                if description:
-                    # Remover cualquier nota adicional que pueda estar al final
-                    description = re.sub(r'Nota adicional:.*', '', description, flags=re.IGNORECASE | re.DOTALL)
-                    description = re.sub(r'\*\*Nota adicional:\*\*.*', '', description, flags=re.IGNORECASE | re.DOTALL)
-                    description = re.sub(r'El número.*que ves.*es.*número de línea.*', '', description, flags=re.IGNORECASE)
-                    # Remover campos JSON no deseados si aún están presentes
-                    description = re.sub(r'"(?:pasos seguidos|conclusi[oó]n)"\s*:\s*\[?[^\]]*\]?', '', description, flags=re.IGNORECASE | re.DOTALL)
-                    description = re.sub(r'"(?:Numero de parada|numero de parada|stop_number)"\s*:\s*"[^"]*"', '', description, flags=re.IGNORECASE)
-                    # Remover cualquier estructura JSON completa si está en la descripción
-                    description = re.sub(r'\{[^{}]*"descripción de la incidencia"[^{}]*\}', '', description, flags=re.IGNORECASE | re.DOTALL)
-                    description = description.strip()
-                
-                # Asegurar que siempre tenemos valores válidos
-                if not stop_number:
-                    stop_number = None
-                
-                if not description or description.strip() == '' or len(description) < 5:
-                    description = 'Sin incidencia visible'
-                
-                print(f"📤 Resultado final (sin JSON):")
-                print(f"  - stop_number: {stop_number}")
-                print(f"  - description: {description}")
-                
-                return {
-                    'success': True,
-                    'stop_number': stop_number,
-                    'description': description,
-                    'raw_response': content
-                }
+                return finish_vision_result(content)
             elif response.status_code == 404:
                 error_data = response.json() if response.text else {}
                 error_msg = error_data.get('error', {}).get('message', 'Modelo no encontrado')
@@ -2918,6 +3226,13 @@ if __name__ == '__main__':
     # Iniciar limpieza de sesiones
     cleanup_expired_sessions()
     
+    # Iniciar la cola de trabajos (recupera los envíos pendientes de ejecuciones anteriores)
+    job_queue.start()
+    
+    # Cargar los modelos en segundo plano para que la primera nota de voz no espere la carga
+    if transcription_backend.available and TRANSCRIPTION_CONFIG['preload']:
+        whisper_pool.preload()
+    
     print("=" * 50)
     print("🚀 SERVIDOR FLASK INICIADO")
     print("✅ Endpoints disponibles:")
@@ -0,0 +1,142 @@
+"""
+Módulo para las escrituras diferidas (write-behind): los cambios se guardan
+en memoria y un hilo los escribe al cabo de un momento, de forma que varias
+modificaciones seguidas del mismo elemento acaban en una sola escritura y la
+petición no espera al disco.
+"""
+
+import threading
+import time
+
+class WriteBehindBuffer:
+    """
+    Cola de escrituras pendientes por clave
+
+    schedule() sustituye la escritura pendiente de la misma clave (solo se
+    escribe el último estado). Un hilo las escribe `flush_delay` segundos
+    después del primer cambio; flush() las escribe todas en el momento y
+    stop() lo hace antes de terminar. Si una escritura falla se reintenta en
+    la siguiente pasada.
+    """
+
+    def __init__(self, name='write-behind', flush_delay=1.0):
+        self.name = name
+        self.flush_delay = flush_delay
+        self.scheduled = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.writes = 0
+        self.errors = 0
+        self._pending = {}  # {clave: (datos, función de escritura)}
+        self._first_pending_at = None
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    def schedule(self, key, data, write):
+        """
+        Programa la escritura de `data` con write(data)
+
+        Args:
+            key: Identificador del elemento (p. ej. el ID del dispositivo)
+            data: Estado completo a escribir (no se debe modificar después)
+            write (callable): Función que escribe el estado
+        """
+        with self._condition:
+            if self._stopping:
+                # Tras stop() ya no hay hilo: se escribe en el momento
+                write(data)
+                return
+            self.scheduled += 1
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = (data, write)
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+            self._start()
+            self._condition.notify()
+
+    def get_pending(self, key):
+        """Estado pendiente de escribir de una clave, o None (para leer lo último guardado)"""
+        with self._condition:
+            entry = self._pending.get(key)
+            return entry[0] if entry else None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name=f'{self.name}-flush', daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                remaining = self._first_pending_at + self.flush_delay - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+            self.flush()
+
+    def flush(self):
+        """Escribe ahora todos los cambios pendientes y devuelve cuántos se han escrito"""
+        with self._flush_lock:
+            with self._condition:
+                pending = self._pending
+                self._pending = {}
+                self._first_pending_at = None
+            if not pending:
+                return 0
+
+            written = 0
+            failed = {}
+            for key, (data, write) in pending.items():
+                try:
+                    write(data)
+                    written += 1
+                except Exception as e:
+                    print(f"❌ {self.name}: error al escribir {key}: {e}")
+                    failed[key] = (data, write)
+
+            with self._condition:
+                self.flushes += 1
+                self.writes += written
+                self.errors += len(failed)
+                # Reintentar los fallidos, salvo que ya haya un estado más reciente
+                for key, entry in failed.items():
+                    self._pending.setdefault(key, entry)
+                if self._pending and self._first_pending_at is None:
+                    self._first_pending_at = time.monotonic()
+            return written
+
+    def stop(self):
+        """Escribe lo pendiente y detiene el hilo (al apagar la aplicación)"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        written = self.flush()
+        if written:
+            print(f"💾 {self.name}: {written} escritura(s) pendiente(s) guardada(s) al apagar")
+
+    def get_stats(self):
+        """
+        Contadores de escrituras
+
+        Returns:
+            dict: Cambios programados, agrupados, pasadas, escrituras reales, errores y pendientes
+        """
+        with self._condition:
+            return {
+                'flush_delay': self.flush_delay,
+                'scheduled': self.scheduled,
+                'coalesced': self.coalesced,
+                'flushes': self.flushes,
+                'writes': self.writes,
+                'errors': self.errors,
+                'pending': len(self._pending)
+            }